@@ -2,7 +2,7 @@ from django.contrib import admin
 from django_ckeditor_5.widgets import CKEditor5Widget
 from django import forms
 
-from .models import Post, Category, Heading, PostAnalytics
+from .models import Post, Category, Heading, PostAnalytics, APIKey, Webhook, WebhookDelivery
 
 
 # Category Admin
@@ -70,9 +70,41 @@ class PostAdmin(admin.ModelAdmin):
 class PostAnalyticsAdmin(admin.ModelAdmin):
     list_display = ('post_title', 'views', 'impressions', 'clicks', 'clicks_through_rate', 'avg_time_on_page')
     search_fields = ('post_title',)
-    readonly_fields = ('post', 'views', 'impressions', 'clicks', 'clicks_through_rate', 'avg_time_on_page')
+    readonly_fields = ('post', 'views', 'impressions', 'clicks', 'clicks_through_rate', 'avg_time_on_page', 'time_on_page_samples')
     
     def post_title(self, obj):
         return obj.post.title
     
     post_title.short_description = 'Post Title'
+
+
+@admin.register(APIKey)
+class APIKeyAdmin(admin.ModelAdmin):
+    # Keys are created with manage.py create_api_key, the admin only edits limits and revokes them
+    list_display = ('name', 'prefix', 'rate_per_second', 'burst', 'is_active', 'created_at')
+    search_fields = ('name', 'prefix',)
+    list_filter = ('is_active',)
+    readonly_fields = ('id', 'prefix', 'created_at')
+    fields = ('id', 'name', 'prefix', 'rate_per_second', 'burst', 'is_active', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Webhook)
+class WebhookAdmin(admin.ModelAdmin):
+    list_display = ('name', 'url', 'topics', 'is_active', 'created_at')
+    search_fields = ('name', 'url',)
+    list_filter = ('is_active',)
+    readonly_fields = ('id', 'created_at')
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    # Deliveries are written by the relay_outbox task
+    list_display = ('webhook', 'status', 'attempts', 'response_status', 'next_attempt_at', 'created_at')
+    list_filter = ('status', 'webhook',)
+    readonly_fields = ('id', 'webhook', 'events', 'status', 'attempts', 'next_attempt_at', 'response_status', 'last_error', 'created_at', 'delivered_at')
+    
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,126 @@
+import logging
+import math
+import time
+from collections import namedtuple
+
+import redis
+
+from django.conf import settings
+
+from core.redis_clients import get_redis, register_script
+
+from .models import APIKey
+
+logger = logging.getLogger(__name__)
+
+redis_client = get_redis()
+
+# Per key request and rejection counters, hashes of key id -> count
+API_KEY_REQUESTS_KEY = "api_keys:requests"
+API_KEY_THROTTLED_KEY = "api_keys:throttled"
+
+APIKeyEntry = namedtuple("APIKeyEntry", ["id", "name", "rate_per_second", "burst"])
+
+# Token bucket of a key in a hash (tokens, ts). Refill, take a token and count the request in one
+# round trip, with the clock of redis so every web server shares the same time
+token_bucket_script = register_script("""
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+else
+    retry_after = (1 - tokens) / rate
+    redis.call('HINCRBY', KEYS[3], ARGV[3], 1)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+""")
+
+# In-process copy of the keys: hashed key -> (expires at, APIKeyEntry or None for unknown keys)
+_registry = {}
+
+
+def clear_api_key_cache():
+    _registry.clear()
+
+def get_api_key(key):
+    """
+    Return the active key matching a raw API key, or None. Lookups are cached in the process
+    for API_KEY_CACHE_SECONDS, unknown keys too so they do not reach the database every time
+    """
+    if not key:
+        return None
+
+    hashed_key = APIKey.hash_key(key)
+    now = time.monotonic()
+    cached = _registry.get(hashed_key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    # Keys from VALID_API_KEYS keep working, with the default limits
+    if key in settings.VALID_API_KEYS:
+        entry = APIKeyEntry(f"env:{hashed_key[:8]}", "VALID_API_KEYS", None, None)
+    else:
+        row = (
+            APIKey.objects.filter(hashed_key=hashed_key, is_active=True)
+            .values_list("id", "name", "rate_per_second", "burst")
+            .first()
+        )
+        entry = APIKeyEntry(str(row[0]), *row[1:]) if row else None
+
+    # Guessed keys must not grow the registry without bound
+    if len(_registry) >= settings.API_KEY_CACHE_MAX_ENTRIES:
+        _registry.clear()
+    _registry[hashed_key] = (now + settings.API_KEY_CACHE_SECONDS, entry)
+    return entry
+
+def consume_token(api_key):
+    """
+    Take a token from the bucket of a key, return how many seconds to wait or 0 when allowed
+    """
+    rate = api_key.rate_per_second
+    if rate is None:
+        rate = settings.API_KEY_RATE_LIMIT_PER_SECOND
+        # A default rate of 0 turns the rate limit off
+        if rate <= 0:
+            return 0
+    burst = api_key.burst if api_key.burst is not None else settings.API_KEY_RATE_LIMIT_BURST
+
+    try:
+        if rate <= 0 or burst < 1:
+            # An explicit 0 blocks the key, until the change is picked up from the database
+            redis_client.hincrby(API_KEY_THROTTLED_KEY, api_key.id, 1)
+            return settings.API_KEY_CACHE_SECONDS
+        retry_after = float(token_bucket_script(
+            keys=[f"api_keys:bucket:{api_key.id}", API_KEY_REQUESTS_KEY, API_KEY_THROTTLED_KEY],
+            args=[rate, burst, api_key.id],
+        ))
+    except redis.RedisError:
+        # Rate limiting is best effort, an unreachable redis must not take the API down
+        logger.warning("Rate limit check failed for API key %s", api_key.id, exc_info=True)
+        return 0
+    return math.ceil(retry_after) if retry_after else 0
+
+def get_api_key_usage():
+    """
+    Return {key id: {"requests": count, "throttled": count}} since the counters were last reset
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(API_KEY_REQUESTS_KEY)
+    pipe.hgetall(API_KEY_THROTTLED_KEY)
+    requests, throttled = pipe.execute()
+
+    usage = {}
+    for name, counters in (("requests", requests), ("throttled", throttled)):
+        for key_id, count in counters.items():
+            usage.setdefault(key_id.decode(), {"requests": 0, "throttled": 0})[name] = int(count)
+    return usage
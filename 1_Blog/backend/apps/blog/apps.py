@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.blog'
+
+    def ready(self):
+        # Celery task metrics, in the web processes too so published tasks are stamped
+        from core import task_metrics
+        task_metrics.install()
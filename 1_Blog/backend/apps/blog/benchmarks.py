@@ -0,0 +1,262 @@
+import json
+import math
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+import redis
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core import instrumentation
+from core.metrics import metrics_buffer
+from core.redis_clients import get_redis, load_scripts, override_pools
+
+from .models import Category, Post, PostAnalytics, Heading, PostViews
+from .related import get_many_related_posts
+from .response_cache import post_detail_key
+from .tasks import (
+    redis_client,
+    increment_post_views,
+    sync_impressions_to_db,
+    sync_time_on_page_to_db,
+)
+
+# Committed budgets, a scenario fails when a metric goes over "<metric>" + "<metric>_per_post" * posts
+# + "<metric>_per_batch" * batches, for work written "batch_size" posts at a time
+BUDGETS_PATH = Path(__file__).with_name("benchmark_budgets.json")
+BUDGET_METRICS = ("queries", "redis_commands", "redis_round_trips")
+
+
+class RedisCommandCounter:
+    """
+    Count the redis commands and round trips of every client (django-redis, celery and ours)
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.round_trips = 0
+
+    @contextmanager
+    def capture(self):
+        counter = self
+        execute_command = redis.Redis.execute_command
+        execute_pipeline = redis.client.Pipeline.execute
+
+        def counted_command(client, *args, **kwargs):
+            counter.commands += 1
+            counter.round_trips += 1
+            return execute_command(client, *args, **kwargs)
+
+        def counted_pipeline(pipe, *args, **kwargs):
+            counter.commands += len(pipe.command_stack)
+            counter.round_trips += 1 if pipe.command_stack else 0
+            return execute_pipeline(pipe, *args, **kwargs)
+
+        with patch.object(redis.Redis, "execute_command", counted_command), \
+                patch.object(redis.client.Pipeline, "execute", counted_pipeline):
+            yield self
+
+
+@contextmanager
+def scratch_redis():
+    """
+    Point the cache and every redis client to an in-process fakeredis server, the scenarios flush
+    and delete keys (impression buffers, cached lists) that must never be the ones of a real redis
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        raise ImproperlyConfigured("The benchmarks run on fakeredis, install it with pip install fakeredis")
+
+    # django-redis keeps its pools per url, a fresh url gets a pool of the new server
+    url = f"redis://benchmarks-{uuid.uuid4().hex}/0"
+    pool_options = {"connection_class": fakeredis.FakeConnection, "server": fakeredis.FakeServer()}
+    cache_settings = settings.CACHES["default"]
+    caches = {
+        **settings.CACHES,
+        "default": {
+            **cache_settings,
+            "LOCATION": url,
+            "OPTIONS": {**cache_settings.get("OPTIONS", {}), "CONNECTION_POOL_KWARGS": pool_options},
+        },
+    }
+    # The request metrics buffered so far are real, the ones of the scenarios stay on the scratch server
+    metrics_buffer.flush()
+    with override_settings(CACHES=caches), override_pools(url, **pool_options):
+        clients = [cache.client.get_client(write=True)] + [get_redis(namespace) for namespace in settings.REDIS_URLS]
+        if any(client.connection_pool.connection_class is not fakeredis.FakeConnection for client in clients):
+            raise ImproperlyConfigured("Refusing to run the benchmarks against a real redis")
+        # As on deploy (redis_health --load-scripts), no scenario pays for a NOSCRIPT miss
+        load_scripts()
+        try:
+            yield
+        finally:
+            metrics_buffer.flush()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+def measure(run, setup=None, repeat=20):
+    """
+    Run a scenario repeat times, return its latency percentiles and the most queries and redis
+    commands of a single run
+    """
+    timings = []
+    counts = {"queries": 0, "redis_commands": 0, "redis_round_trips": 0}
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        # The query log keeps the last 9000 queries, past that the captured count is wrong
+        reset_queries()
+        counter = RedisCommandCounter()
+        with CaptureQueriesContext(connection) as queries, counter.capture():
+            started = time.perf_counter()
+            run(i)
+            timings.append((time.perf_counter() - started) * 1000)
+        counts["queries"] = max(counts["queries"], len(queries))
+        counts["redis_commands"] = max(counts["redis_commands"], counter.commands)
+        counts["redis_round_trips"] = max(counts["redis_round_trips"], counter.round_trips)
+
+    return {
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        **counts,
+    }
+
+
+def create_benchmark_posts(size, start=0, headings=8, views=5):
+    category, _ = Category.objects.get_or_create(slug="benchmark", defaults={"name": "Benchmark"})
+    posts = Post.objects.bulk_create([
+        Post(
+            title=f"Benchmark post {i}",
+            description="Benchmark description",
+            content="<p>Benchmark content</p>" * 200,
+            keywords="benchmark",
+            slug=f"benchmark-post-{i}",
+            category=category,
+            status="published",
+            published_at=timezone.now(),
+        )
+        for i in range(start, start + size)
+    ])
+    PostAnalytics.objects.bulk_create([PostAnalytics(post=post, views=views) for post in posts])
+    Heading.objects.bulk_create([
+        Heading(post=post, title=f"Heading {j}", slug=f"heading-{j}", level=2, order=j)
+        for post in posts for j in range(headings)
+    ])
+    PostViews.objects.bulk_create([
+        PostViews(post=post, ip_address=f"10.0.{j // 256}.{j % 256}")
+        for post in posts for j in range(views)
+    ])
+    return posts
+
+def scenarios(client, posts):
+    """
+    (name, run, setup) of every endpoint and task, run and setup receive the iteration number
+    """
+    slug = posts[0].slug
+    headers = {"HTTP_API_KEY": settings.VALID_API_KEYS[0]}
+    list_url = reverse("post-list")
+    detail_url = reverse("post-detail") + f"?slug={slug}"
+    headings_url = reverse("post-headings") + f"?slug={slug}"
+    clicks_url = reverse("increment-post-clicks")
+    batch_slugs = [post.slug for post in posts[:settings.POST_BATCH_MAX_SLUGS]]
+    batch_url = reverse("post-batch") + f"?slugs={','.join(batch_slugs)}"
+
+    def buffer_impressions(i):
+        # The list views buffer impressions too, the ones of posts outside the dataset are dropped
+        stale = redis_client.keys("post:impressions:*")
+        if stale:
+            redis_client.delete(*stale)
+        redis_client.mset({f"post:impressions:{post.id}": 1 for post in posts})
+
+    def buffer_dwell_time(i):
+        pipe = redis_client.pipeline(transaction=False)
+        for post in posts:
+            pipe.hset(f"post:dwell:{post.slug}", mapping={"sum": 30, "count": 1})
+        pipe.execute()
+
+    return (
+        ("post-list cold", lambda i: client.get(list_url, **headers), lambda i: cache.delete_pattern("post_list*")),
+        ("post-list warm", lambda i: client.get(list_url, **headers), None),
+        ("post-detail cold", lambda i: client.get(detail_url, **headers), lambda i: cache.delete(post_detail_key(slug))),
+        ("post-detail warm", lambda i: client.get(detail_url, **headers), None),
+        ("post-batch cold", lambda i: client.get(batch_url, **headers), lambda i: cache.delete_many([f"post_detail_data:{slug}" for slug in batch_slugs])),
+        ("post-batch warm", lambda i: client.get(batch_url, **headers), None),
+        ("post-headings", lambda i: client.get(headings_url, **headers), None),
+        ("post-clicks", lambda i: client.post(clicks_url, {"slug": slug}, content_type="application/json", **headers), None),
+        ("task increment_post_views", lambda i: increment_post_views(slug, f"10.1.{i // 256}.{i % 256}"), None),
+        ("task sync_impressions_to_db", lambda i: sync_impressions_to_db(), buffer_impressions),
+        ("task sync_time_on_page_to_db", lambda i: sync_time_on_page_to_db(), buffer_dwell_time),
+    )
+
+def run_benchmarks(sizes, repeat=20, progress=None):
+    """
+    Create the posts of every dataset size and measure every scenario, the caller is expected to
+    roll the database back. Returns {size: {scenario: metrics}}
+    """
+    results = {}
+    client = Client()
+    # Hook redis before counting, PerformanceMiddleware would otherwise do it inside the first measure
+    instrumentation.install()
+    # No rate limit, no queued celery task and no flush of the request metrics (one round trip every
+    # METRICS_FLUSH_SECONDS, not a cost of the request that happens to send it), only the work done
+    # by the request is measured
+    with scratch_redis(), override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        METRICS_FLUSH_SECONDS=float("inf"),
+        API_KEY_RATE_LIMIT_PER_SECOND=1e9,
+        API_KEY_RATE_LIMIT_BURST=10 ** 9,
+    ), patch.object(increment_post_views, "delay"):
+        created = []
+        for size in sorted(sizes):
+            if size > len(created):
+                created += create_benchmark_posts(size - len(created), start=len(created))
+                # As in production the related posts are cached, a cold response only lost its own cache
+                get_many_related_posts([post.id for post in created])
+            posts = created[:size]
+            cache.delete_pattern("post_list*")
+            results[size] = {}
+            for name, run, setup in scenarios(client, posts):
+                results[size][name] = measure(run, setup, repeat)
+                if progress:
+                    progress(size, name, results[size][name])
+    return results
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path) as file:
+        return json.load(file)
+
+def check_budgets(results, budgets):
+    """
+    Return a message for every metric over its budget
+    """
+    violations = []
+    for size, scenario_results in results.items():
+        for name, metrics in scenario_results.items():
+            budget = budgets.get(name, {})
+            for metric in BUDGET_METRICS:
+                if metric not in budget:
+                    continue
+                batches = math.ceil(size / budget["batch_size"]) if "batch_size" in budget else 0
+                limit = (
+                    budget[metric]
+                    + budget.get(f"{metric}_per_post", 0) * size
+                    + budget.get(f"{metric}_per_batch", 0) * batches
+                )
+                if metrics[metric] > limit:
+                    violations.append(f"{name} with {size} posts: {metrics[metric]} {metric}, budget {limit}")
+    return violations
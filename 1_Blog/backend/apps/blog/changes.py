@@ -0,0 +1,109 @@
+import base64
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .fast_serializers import datetime_to_representation, serialize_post_list
+from .models import Post, PostTombstone
+
+# Changes are read in (timestamp, id) order: updated_at for the posts, deleted_at for the tombstones.
+# The cursor is the position of the last change returned, ties on the timestamp are broken by the id
+# so a page never skips or repeats a change
+START_CURSOR = (None, uuid.UUID(int=0))
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, post_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{post_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    (timestamp, id) of a cursor returned by changes_since(), raises CursorError when it is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, post_id = raw.split("|")
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError(raw)
+        return timestamp, uuid.UUID(post_id)
+    except ValueError as e:
+        raise CursorError("Invalid cursor") from e
+
+def cursor_from_since(since):
+    timestamp = parse_datetime(since)
+    if timestamp is None:
+        raise CursorError("since must be an ISO 8601 datetime")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp, START_CURSOR[1]
+
+def is_expired(position):
+    # Tombstones older than the retention are pruned, a client this far behind needs a full sync
+    timestamp = position[0]
+    return timestamp is not None and timestamp < timezone.now() - timedelta(days=settings.DELTA_SYNC_TOMBSTONE_DAYS)
+
+def after(position, field):
+    timestamp, post_id = position
+    if timestamp is None:
+        return Q()
+    return Q(**{f"{field}__gt": timestamp}) | Q(**{field: timestamp, "id__gt": post_id})
+
+
+def changes_since(position, limit, fields=None):
+    """
+    Up to limit changes after a (timestamp, id) position, oldest first. Changes of the last
+    DELTA_SYNC_SETTLE_SECONDS are held back, a transaction still in flight may commit a timestamp
+    older than them. Returns {"changes", "cursor", "has_more"}
+    """
+    horizon = timezone.now() - timedelta(seconds=settings.DELTA_SYNC_SETTLE_SECONDS)
+    posts = (
+        Post.objects.filter(after(position, "updated_at"), updated_at__lte=horizon, published_at__isnull=False)
+        .order_by("updated_at", "id")
+        .values_list("updated_at", "id", "slug", "status")[:limit + 1]
+    )
+    tombstones = (
+        PostTombstone.objects.filter(after(position, "deleted_at"), deleted_at__lte=horizon)
+        .order_by("deleted_at", "id")
+        .values_list("deleted_at", "id", "slug")[:limit + 1]
+    )
+    rows = sorted(
+        [(timestamp, post_id, slug, "published" if status == "published" else "unpublished")
+         for timestamp, post_id, slug, status in posts]
+        + [(timestamp, post_id, slug, "deleted") for timestamp, post_id, slug in tombstones],
+        key=lambda row: (row[0], row[1].hex),
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    published = {
+        post["id"]: post
+        for post in serialize_post_list(
+            Post.post_published.filter(id__in=[row[1] for row in rows if row[3] == "published"]), fields
+        )
+    }
+    changes = []
+    for timestamp, post_id, slug, change in rows:
+        entry = {"id": str(post_id), "slug": slug, "change": change, "changed_at": datetime_to_representation(timestamp)}
+        if change == "published":
+            post = published.get(str(post_id))
+            if post is None:
+                # Unpublished since it was read, the next sync reports it
+                continue
+            entry["post"] = post
+        changes.append(entry)
+
+    if rows:
+        cursor = encode_cursor(rows[-1][0], rows[-1][1])
+    elif position[0] is not None:
+        cursor = encode_cursor(*position)
+    else:
+        cursor = None
+    return {"changes": changes, "cursor": cursor, "has_more": has_more}
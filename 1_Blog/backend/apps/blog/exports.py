@@ -0,0 +1,117 @@
+import csv
+import json
+from datetime import datetime, time
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import PostAnalytics, PostViews
+
+# Columns of every dataset and the date field used by the start and end filters
+DATASETS = {
+    "analytics": {
+        "model": PostAnalytics,
+        "date_field": "post__created_at",
+        "columns": (
+            ("post_id", "post_id"),
+            ("post_slug", "post__slug"),
+            ("post_title", "post__title"),
+            ("category", "post__category__slug"),
+            ("post_created_at", "post__created_at"),
+            ("views", "views"),
+            ("impressions", "impressions"),
+            ("clicks", "clicks"),
+            ("clicks_through_rate", "clicks_through_rate"),
+            ("avg_time_on_page", "avg_time_on_page"),
+        ),
+    },
+    "views": {
+        "model": PostViews,
+        "date_field": "created_at",
+        "columns": (
+            ("id", "id"),
+            ("post_id", "post_id"),
+            ("post_slug", "post__slug"),
+            ("category", "post__category__slug"),
+            ("ip_address", "ip_address"),
+            ("created_at", "created_at"),
+        ),
+    },
+}
+
+FORMATS = ("csv", "ndjson")
+
+
+def parse_date_bound(value, end=False):
+    """
+    Parse an ISO date or datetime filter, a bare end date includes that whole day
+    """
+    if not value:
+        return None
+
+    date = parse_datetime(value)
+    if date is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        date = datetime.combine(day, time.max if end else time.min)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+def export_rows(dataset, start=None, end=None, category=None, chunk_size=2000):
+    """
+    Return the header and a lazy iterator over the rows of a dataset. The rows are fetched
+    chunk_size at a time (with a server-side cursor on PostgreSQL) so memory stays flat.
+    """
+    config = DATASETS[dataset]
+    header = [name for name, _ in config["columns"]]
+    queryset = config["model"].objects.order_by()
+
+    if start:
+        queryset = queryset.filter(**{f"{config['date_field']}__gte": start})
+    if end:
+        queryset = queryset.filter(**{f"{config['date_field']}__lte": end})
+    if category:
+        queryset = queryset.filter(post__category__slug=category)
+
+    rows = queryset.values_list(*(lookup for _, lookup in config["columns"])).iterator(chunk_size=chunk_size)
+    return header, rows
+
+
+class Echo:
+    # File-like object that hands back what csv.writer writes instead of buffering it
+    def write(self, value):
+        return value
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value if isinstance(value, (int, float, type(None))) else str(value)
+
+def render_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([format_value(value) for value in row])
+
+def render_ndjson(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, map(format_value, row)))) + "\n"
+
+def render_export(export_format, header, rows):
+    return render_csv(header, rows) if export_format == "csv" else render_ndjson(header, rows)
+
+async def stream_export(chunks, lines=200):
+    """
+    Async iterator over a rendered export for StreamingHttpResponse. Under ASGI a sync iterator is
+    read whole with sync_to_async(list), here every few lines are pulled in the thread of the ORM.
+    """
+    read = sync_to_async(lambda: "".join(islice(chunks, lines)))
+    while True:
+        text = await read()
+        if not text:
+            return
+        yield text
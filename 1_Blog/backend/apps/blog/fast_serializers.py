@@ -0,0 +1,203 @@
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Heading, PostViews, PostAnalytics
+
+# Build the same payloads as PostListSerializer and PostSerializer straight from .values() rows,
+# with a fixed number of queries instead of one per nested relation and post.
+# Keep the keys in the same order as the serializers, tests compare the rendered bytes.
+
+
+def datetime_to_representation(value):
+    # Same output as rest_framework.fields.DateTimeField
+    if value is None:
+        return None
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+def file_url(name):
+    # Same output as rest_framework.fields.ImageField without a request in the context
+    return default_storage.url(name) if name else None
+
+def uuid_to_representation(value):
+    return str(value) if value is not None else None
+
+
+# Output fields of the list and detail payloads, in the order of the serializers. The relations cost
+# a query each, the other fields are columns of the post (or of its category). The id and slug are
+# always sent, the views key their caches and counters on them
+LIST_FIELDS = ("id", "title", "description", "slug", "category", "thumbnail", "headings", "post_views", "view_count")
+DETAIL_FIELDS = (
+    "id", "category", "headings", "post_views", "view_count", "title", "description", "content", "thumbnail",
+    "keywords", "slug", "created_at", "updated_at", "status", "published_at", "related_posts",
+)
+RELATIONS = ("headings", "post_views", "view_count", "related_posts")
+REQUIRED_FIELDS = ("id", "slug")
+
+# Output field -> columns selected for it
+LIST_COLUMNS = {
+    "id": ("id",),
+    "title": ("title",),
+    "description": ("description",),
+    "slug": ("slug",),
+    "category": ("category__name", "category__slug"),
+    "thumbnail": ("thumbnail",),
+}
+DETAIL_COLUMNS = {
+    "id": ("id",),
+    "category": (
+        "category__id", "category__name", "category__title", "category__description", "category__thumbnail",
+        "category__slug", "category__parent_id",
+    ),
+    "title": ("title",),
+    "description": ("description",),
+    "content": ("content",),
+    "thumbnail": ("thumbnail",),
+    "keywords": ("keywords",),
+    "slug": ("slug",),
+    "created_at": ("created_at",),
+    "updated_at": ("updated_at",),
+    "status": ("status",),
+    "published_at": ("published_at",),
+}
+
+
+def resolve_fields(query_params, available):
+    """
+    Output fields picked by ?fields= (any field) and ?include= (relations added to the fields, every
+    column when ?fields= is missing). None when neither is given or every field is picked, raises
+    ValueError for unknown names
+    """
+    if "fields" not in query_params and "include" not in query_params:
+        return None
+    requested = [name.strip() for name in query_params.get("fields", "").split(",") if name.strip()]
+    included = [name.strip() for name in query_params.get("include", "").split(",") if name.strip()]
+    unknown = (set(requested) - set(available)) | (set(included) - set(available).intersection(RELATIONS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    if "fields" not in query_params:
+        requested = [name for name in available if name not in RELATIONS]
+    selected = {*requested, *included, *REQUIRED_FIELDS}
+    fields = tuple(name for name in available if name in selected)
+    return None if fields == available else fields
+
+def fields_cache_suffix(fields):
+    # Every shape is cached apart, the default shape keeps the plain keys
+    return "" if fields is None else ":fields:" + ",".join(fields)
+
+def selected_columns(columns, fields):
+    return [column for name, names in columns.items() if fields is None or name in fields for column in names]
+
+def pick(payload, fields):
+    return payload if fields is None else {name: payload[name] for name in fields if name in payload}
+
+
+def related_rows(post_ids, fields=None):
+    """
+    Fetch the headings, views and view counts of many posts in three queries, only the ones in fields
+    """
+    headings = defaultdict(list)
+    post_views = defaultdict(list)
+    view_counts = {}
+
+    if fields is None or "headings" in fields:
+        for heading in (
+            Heading.objects.filter(post_id__in=post_ids)
+            .order_by("order")
+            .values_list("post_id", "title", "slug", "level", "order")
+        ):
+            headings[heading[0]].append({
+                "title": heading[1],
+                "slug": heading[2],
+                "level": heading[3],
+                "order": heading[4],
+            })
+
+    if fields is None or "post_views" in fields:
+        for view in PostViews.objects.filter(post_id__in=post_ids).values_list("id", "ip_address", "created_at", "post_id"):
+            post_views[view[3]].append({
+                "id": uuid_to_representation(view[0]),
+                "ip_address": view[1],
+                "created_at": datetime_to_representation(view[2]),
+                "post": uuid_to_representation(view[3]),
+            })
+
+    if fields is None or "view_count" in fields:
+        for post_id, views in PostAnalytics.objects.filter(post_id__in=post_ids).order_by().values_list("post_id", "views"):
+            view_counts.setdefault(post_id, views)
+
+    return headings, post_views, view_counts
+
+def serialize_post_list(queryset, fields=None):
+    """
+    Fast equivalent of PostListSerializer(queryset, many=True, fields=fields).data
+    """
+    posts = list(queryset.values(*selected_columns(LIST_COLUMNS, fields)))
+    headings, post_views, view_counts = related_rows([post["id"] for post in posts], fields)
+
+    return [
+        pick({
+            "id": uuid_to_representation(post["id"]),
+            "title": post.get("title"),
+            "description": post.get("description"),
+            "slug": post["slug"],
+            "category": {
+                "name": post.get("category__name"),
+                "slug": post.get("category__slug"),
+            },
+            "thumbnail": file_url(post.get("thumbnail")),
+            "headings": headings[post["id"]],
+            "post_views": post_views[post["id"]],
+            "view_count": view_counts.get(post["id"], 0),
+        }, fields)
+        for post in posts
+    ]
+
+def serialize_post_detail(queryset, fields=None):
+    """
+    Fast equivalent of PostSerializer(queryset.get(), fields=fields).data without the related posts,
+    raises Post.DoesNotExist like get()
+    """
+    post = queryset.values(*selected_columns(DETAIL_COLUMNS, fields)).get()
+    return post_detail_payload(post, *related_rows([post["id"]], fields), fields)
+
+def serialize_post_details(queryset, fields=None):
+    """
+    Fast equivalent of PostSerializer(queryset, many=True).data, in four queries whatever the number of posts
+    """
+    posts = list(queryset.values(*selected_columns(DETAIL_COLUMNS, fields)))
+    headings, post_views, view_counts = related_rows([post["id"] for post in posts], fields)
+    return [post_detail_payload(post, headings, post_views, view_counts, fields) for post in posts]
+
+def post_detail_payload(post, headings, post_views, view_counts, fields=None):
+    return pick({
+        "id": uuid_to_representation(post["id"]),
+        "category": {
+            "id": uuid_to_representation(post.get("category__id")),
+            "name": post.get("category__name"),
+            "title": post.get("category__title"),
+            "description": post.get("category__description"),
+            "thumbnail": file_url(post.get("category__thumbnail")),
+            "slug": post.get("category__slug"),
+            "parent": uuid_to_representation(post.get("category__parent_id")),
+        },
+        "headings": headings[post["id"]],
+        "post_views": post_views[post["id"]],
+        "view_count": view_counts.get(post["id"], 0),
+        "title": post.get("title"),
+        "description": post.get("description"),
+        "content": post.get("content"),
+        "thumbnail": file_url(post.get("thumbnail")),
+        "keywords": post.get("keywords"),
+        "slug": post["slug"],
+        "created_at": datetime_to_representation(post.get("created_at")),
+        "updated_at": datetime_to_representation(post.get("updated_at")),
+        "status": post.get("status"),
+        "published_at": datetime_to_representation(post.get("published_at")),
+    }, fields)
@@ -0,0 +1,88 @@
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import LockError
+
+from core.redis_clients import get_redis, increment_counters
+
+logger = logging.getLogger(__name__)
+
+redis_client = get_redis("analytics")
+
+# Events buffered in redis since the last flush of a job, incremented next to the buffer writes
+BACKLOG_KEY = "analytics:backlog:{}"
+LAST_FLUSH_KEY = "analytics:flush:{}:last"
+FLUSH_LOCK_KEY = "analytics:flush:{}:lock"
+
+# name -> function moving the buffer of the job into the database
+FLUSH_JOBS = {}
+
+
+def register_flush_job(name, flush):
+    FLUSH_JOBS[name] = flush
+
+def record_backlog(pipe, name, amount=1):
+    """
+    Count amount events buffered for the flush job name, on the pipeline writing the buffer
+    """
+    pipe.incrby(BACKLOG_KEY.format(name), amount)
+
+def buffer_counters(name, counts, client=None):
+    """
+    Add {post id: amount} to the post:{name}:{id} buffers of the flush job name and to its backlog,
+    in one command. client may be a pipeline
+    """
+    counters = {f"post:{name}:{post_id}": amount for post_id, amount in counts.items()}
+    counters[BACKLOG_KEY.format(name)] = sum(counts.values())
+    return increment_counters(counters, client=client or redis_client)
+
+def flush_interval(backlog):
+    """
+    Seconds between two flushes: ANALYTICS_FLUSH_MAX_INTERVAL up to ANALYTICS_FLUSH_BACKLOG_TARGET
+    buffered events, then shorter in proportion to the backlog down to ANALYTICS_FLUSH_MIN_INTERVAL
+    """
+    target = settings.ANALYTICS_FLUSH_BACKLOG_TARGET
+    if backlog <= target:
+        return settings.ANALYTICS_FLUSH_MAX_INTERVAL
+    return max(settings.ANALYTICS_FLUSH_MIN_INTERVAL, settings.ANALYTICS_FLUSH_MAX_INTERVAL * target / backlog)
+
+def run_due_flushes(now=None):
+    """
+    Flush every job with a backlog that waited its flush interval, return the names of the flushed jobs.
+    A lock per job keeps flushes started by several beat instances from overlapping.
+    """
+    now = now or time.time()
+    names = list(FLUSH_JOBS)
+    values = redis_client.mget(
+        [BACKLOG_KEY.format(name) for name in names] + [LAST_FLUSH_KEY.format(name) for name in names]
+    )
+    backlogs, last_flushes = values[:len(names)], values[len(names):]
+
+    flushed = []
+    for name, backlog, last_flush in zip(names, backlogs, last_flushes):
+        backlog = int(backlog or 0)
+        # Idle jobs are skipped until something is buffered
+        if backlog <= 0 or now - float(last_flush or 0) < flush_interval(backlog):
+            continue
+
+        lock = redis_client.lock(FLUSH_LOCK_KEY.format(name), timeout=settings.ANALYTICS_FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            FLUSH_JOBS[name]()
+            # Events buffered while flushing stay in the backlog for the next run
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.decrby(BACKLOG_KEY.format(name), backlog)
+            pipe.set(LAST_FLUSH_KEY.format(name), now)
+            pipe.execute()
+            flushed.append(name)
+        except Exception as e:
+            logger.error("An unexpected error occurred while flushing the %s buffer: %s", name, str(e))
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # The flush outlived ANALYTICS_FLUSH_LOCK_TIMEOUT, the lock expired or another run took it
+                logger.warning("The %s flush outlived its lock", name)
+    return flushed
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.blog.benchmarks import BUDGETS_PATH, run_benchmarks, load_budgets, check_budgets
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles, queries and redis commands of the blog endpoints and tasks at several "
+        "dataset sizes, and fail when a budget is exceeded. Redis is an in-process fakeredis server "
+        "and the database work is rolled back"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,100,1000", help="Comma separated numbers of posts")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--budgets", default=str(BUDGETS_PATH))
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        try:
+            with transaction.atomic():
+                results = run_benchmarks(sizes, options["repeat"], progress=self.write_result)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+
+        violations = check_budgets(results, load_budgets(options["budgets"]))
+        if violations:
+            raise CommandError("Over budget:\n" + "\n".join(violations))
+        self.stdout.write(self.style.SUCCESS("Every scenario is within its budget"))
+
+    def write_result(self, size, name, metrics):
+        self.stdout.write(
+            f"{size:>6} posts  {name:<30} p50 {metrics['p50_ms']:8.2f} ms  p95 {metrics['p95_ms']:8.2f} ms  "
+            f"p99 {metrics['p99_ms']:8.2f} ms  {metrics['queries']:4d} queries  "
+            f"{metrics['redis_commands']:4d} redis commands in {metrics['redis_round_trips']:3d} round trips"
+        )
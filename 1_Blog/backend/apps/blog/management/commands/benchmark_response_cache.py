@@ -0,0 +1,77 @@
+import pickle
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework_api.serializers import APIResponseSerializer
+
+from apps.blog.response_cache import encode_body, encoded_response
+from apps.blog.views import redis_client
+from core.renderers import FastJSONRenderer
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from at or an have not which "
+    "django redis cache query index post blog server request response database python performance "
+    "latency throughput memory compression render serializer benchmark payload header content"
+).split()
+
+
+class Command(BaseCommand):
+    help = "Compare caching a pickled response payload with caching the pre-rendered, compressed body"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=20, help="Posts in the payload (a list page)")
+        parser.add_argument("--content-size", type=int, default=20000, help="Characters of content per post")
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        payload = APIResponseSerializer({
+            "success": True,
+            "status": 200,
+            "results": [self.make_post(i, options["content_size"]) for i in range(options["posts"])],
+        }).data
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+
+        pickled = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        encoded = pickle.dumps(encode_body(FastJSONRenderer().render(payload)), pickle.HIGHEST_PROTOCOL)
+        cases = (
+            # A hit used to unpickle the payload and render it again on every request
+            ("pickled payload", pickled, lambda: JSONRenderer().render(pickle.loads(pickled))),
+            ("encoded body   ", encoded, lambda: encoded_response(request, pickle.loads(encoded)).content),
+        )
+
+        for name, value, hit in cases:
+            body = hit()
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                hit()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f"{name}: {self.memory_usage(name, value):>10,} bytes in redis, "
+                f"best {min(timings) * 1000:7.3f} ms per hit, {len(body):>10,} bytes sent"
+            )
+
+    def make_post(self, i, content_size):
+        # Random words compress about as well as real prose, a repeated sentence would not be fair
+        words = random.Random(i).choices(WORDS, k=content_size // 6)
+        return {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "title": f"Benchmark post {i}",
+            "slug": f"benchmark-post-{i}",
+            "content": f"<p>{' '.join(words)}</p>",
+            "headings": [{"title": f"Heading {j}", "slug": f"heading-{j}", "level": 2, "order": j} for j in range(8)],
+        }
+
+    def memory_usage(self, name, value):
+        key = f"benchmark:response_cache:{name.strip().replace(' ', '_')}"
+        try:
+            redis_client.set(key, value)
+            usage = redis_client.memory_usage(key)
+            redis_client.delete(key)
+            return usage or len(value)
+        except Exception:
+            # Redis is not reachable, the size of the stored value is close enough
+            return len(value)
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from apps.blog.fast_serializers import serialize_post_list, serialize_post_detail
+from apps.blog.models import Category, Post, PostAnalytics, Heading, PostViews
+from apps.blog.serializers import PostListSerializer, PostSerializer
+from core.renderers import FastJSONRenderer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare the DRF serializers with the fast serialization path on generated posts (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=200)
+        parser.add_argument("--headings", type=int, default=8, help="Headings per post")
+        parser.add_argument("--views", type=int, default=5, help="Unique views per post")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.create_posts(options)
+                self.run(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def create_posts(self, options):
+        category = Category.objects.create(name="Benchmark", slug="benchmark")
+        posts = Post.objects.bulk_create([
+            Post(
+                title=f"Benchmark post {i}",
+                description="Benchmark description",
+                content="<p>Benchmark content</p>" * 200,
+                thumbnail=f"blog/benchmark/{i}.jpg",
+                keywords="benchmark",
+                slug=f"benchmark-post-{i}",
+                category=category,
+                status="published",
+                published_at=timezone.now(),
+            )
+            for i in range(options["posts"])
+        ])
+        PostAnalytics.objects.bulk_create([PostAnalytics(post=post, views=options["views"]) for post in posts])
+        Heading.objects.bulk_create([
+            Heading(post=post, title=f"Heading {j}", slug=f"heading-{j}", level=2, order=j)
+            for post in posts for j in range(options["headings"])
+        ])
+        PostViews.objects.bulk_create([
+            PostViews(post=post, ip_address=f"10.0.{j // 256}.{j % 256}")
+            for post in posts for j in range(options["views"])
+        ])
+
+    def run(self, options):
+        posts = Post.post_published.filter(category__slug="benchmark")
+        slug = "benchmark-post-0"
+        cases = (
+            ("list   DRF ", lambda: JSONRenderer().render(PostListSerializer(posts, many=True).data)),
+            ("list   fast", lambda: FastJSONRenderer().render(serialize_post_list(posts))),
+            ("detail DRF ", lambda: JSONRenderer().render(PostSerializer(Post.post_published.get(slug=slug)).data)),
+            ("detail fast", lambda: FastJSONRenderer().render(serialize_post_detail(Post.post_published.filter(slug=slug)))),
+        )
+
+        for name, case in cases:
+            with CaptureQueriesContext(connection) as queries:
+                body = case()
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                case()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f"{name}: best {min(timings) * 1000:8.2f} ms, {len(queries):4d} queries, {len(body):,} bytes"
+            )
@@ -0,0 +1,60 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.utils import timezone
+
+from apps.blog.utils import uuid7
+
+
+class Command(BaseCommand):
+    help = "Compare insert rate and primary key index size of uuid4 and time-ordered UUIDv7 keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        quote = connection.ops.quote_name
+        uuid_field = models.UUIDField()
+        datetime_field = models.DateTimeField()
+        post_id = uuid_field.get_db_prep_value(uuid.uuid4(), connection)
+
+        for name, generate in (("uuid4", uuid.uuid4), ("uuid7", uuid7)):
+            # Same shape as PostViews, in a scratch table that is dropped afterwards
+            table = f"blog_uuid_benchmark_{name}"
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+                cursor.execute(
+                    f"CREATE TABLE {quote(table)} ("
+                    f"id {uuid_field.db_type(connection)} PRIMARY KEY, "
+                    f"post_id {uuid_field.db_type(connection)} NOT NULL, "
+                    f"ip_address varchar(39) NOT NULL, "
+                    f"created_at {datetime_field.db_type(connection)} NOT NULL)"
+                )
+
+                started = time.monotonic()
+                for start in range(0, options["rows"], options["batch_size"]):
+                    batch = [
+                        (
+                            uuid_field.get_db_prep_value(generate(), connection),
+                            post_id,
+                            f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                            datetime_field.get_db_prep_value(timezone.now(), connection),
+                        )
+                        for i in range(start, min(start + options["batch_size"], options["rows"]))
+                    ]
+                    cursor.executemany(f"INSERT INTO {quote(table)} VALUES (%s, %s, %s, %s)", batch)
+                elapsed = time.monotonic() - started
+
+                index_size = self.index_size(cursor, table)
+                cursor.execute(f"DROP TABLE {quote(table)}")
+
+            self.stdout.write(f"{name}: {options['rows'] / elapsed:,.0f} rows/s, primary key index {index_size}")
+
+    def index_size(self, cursor, table):
+        if connection.vendor != "postgresql":
+            return "n/a (PostgreSQL only)"
+        cursor.execute("SELECT pg_size_pretty(pg_indexes_size(%s))", [table])
+        return cursor.fetchone()[0]
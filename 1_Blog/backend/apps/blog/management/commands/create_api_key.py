@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog.models import APIKey
+
+
+class Command(BaseCommand):
+    help = "Create an API key, the key is only printed once and stored hashed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Who or what uses the key")
+        parser.add_argument("--rate", type=float, help="Requests per second (default: API_KEY_RATE_LIMIT_PER_SECOND)")
+        parser.add_argument("--burst", type=int, help="Burst size (default: API_KEY_RATE_LIMIT_BURST)")
+
+    def handle(self, *args, **options):
+        api_key, key = APIKey.generate(options["name"], rate_per_second=options["rate"], burst=options["burst"])
+        self.stdout.write(f"Created API key {api_key}")
+        self.stdout.write(key)
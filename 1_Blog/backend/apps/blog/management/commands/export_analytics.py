@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.blog.exports import DATASETS, FORMATS, parse_date_bound, export_rows, render_export
+
+
+class Command(BaseCommand):
+    help = "Stream PostAnalytics or PostViews rows to CSV or NDJSON with flat memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=DATASETS.keys())
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--start", help="Only rows from this date (YYYY-MM-DD or ISO datetime)")
+        parser.add_argument("--end", help="Only rows until this date (YYYY-MM-DD or ISO datetime)")
+        parser.add_argument("--category", help="Only posts of this category slug")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per round trip")
+        parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_date_bound(options["start"])
+            end = parse_date_bound(options["end"], end=True)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        header, rows = export_rows(options["dataset"], start, end, options["category"], options["chunk_size"])
+        lines = render_export(options["format"], header, rows)
+
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+
+        started = time.monotonic()
+        count = 0
+        with open(options["output"], "w", newline="", encoding="utf-8") as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+
+        if options["format"] == "csv":
+            count -= 1 # Header
+        self.stderr.write(f"Exported {count} rows in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,272 @@
+import json
+import os
+import re
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+from django.utils.text import slugify
+
+from apps.blog.models import Category, Post, PostAnalytics, Heading
+from apps.blog.tasks import build_related_posts
+from apps.blog.sitemaps import invalidate_all_documents
+
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def read_json_array(path, chunk_size=1 << 16):
+    """
+    Yield the objects of a top level JSON array one at a time without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    with open(path, encoding="utf-8") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer += chunk
+            while True:
+                buffer = buffer.lstrip()
+                if not started:
+                    if not buffer:
+                        break
+                    if buffer[0] != "[":
+                        raise CommandError("A JSON file must contain an array of posts")
+                    buffer = buffer[1:]
+                    started = True
+                    continue
+                buffer = buffer.lstrip(", \n\r\t")
+                if buffer.startswith("]"):
+                    return
+                try:
+                    record, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    # The object is cut by the end of the chunk, read more
+                    break
+                yield record
+                buffer = buffer[end:]
+            if not chunk:
+                if buffer.strip():
+                    raise CommandError("Unexpected end of the JSON file")
+                return
+
+FRONT_MATTER_RE = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.S)
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+
+def read_markdown(path):
+    """
+    Yield a post for every Markdown file, metadata comes from the front matter and
+    headings from the # lines of the body
+    """
+    files = sorted(Path(path).glob("*.md")) if os.path.isdir(path) else [Path(path)]
+    for file in files:
+        text = file.read_text(encoding="utf-8")
+        record = {"slug": file.stem}
+        match = FRONT_MATTER_RE.match(text)
+        if match:
+            for line in match.group(1).splitlines():
+                key, _, value = line.partition(":")
+                if key.strip():
+                    record[key.strip()] = value.strip().strip("\"'").strip("[]")
+            text = text[match.end():]
+
+        blocks, headings = [], []
+        for block in re.split(r"\n\s*\n", text.strip()):
+            heading = HEADING_RE.match(block.strip())
+            if heading and "\n" not in block.strip():
+                level, title = len(heading.group(1)), heading.group(2)
+                headings.append({"title": title, "level": level, "order": len(headings) + 1})
+                blocks.append(f'<h{level} id="{slugify(title)}">{escape(title)}</h{level}>')
+            elif block.strip():
+                blocks.append(f"<p>{escape(block.strip())}</p>")
+
+        record.setdefault("title", file.stem.replace("-", " ").title())
+        record["content"] = "\n".join(blocks)
+        record["headings"] = headings
+        yield record
+
+# Records missing one of these are skipped
+REQUIRED_FIELDS = ("slug", "title")
+
+READERS = {
+    "ndjson": read_ndjson,
+    "json": read_json_array,
+    "markdown": read_markdown,
+}
+
+
+class Command(BaseCommand):
+    help = "Import posts from JSON, NDJSON or Markdown in bulk, without the per-row save signals"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or a directory of Markdown files")
+        parser.add_argument("--format", choices=READERS.keys(),
+                            help="Input format, guessed from the extension by default")
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Posts inserted per transaction")
+        parser.add_argument("--checkpoint",
+                            help="File recording how many records were imported (default: <path>.checkpoint)")
+        parser.add_argument("--resume", action="store_true",
+                            help="Skip the records already imported according to the checkpoint")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        reader = READERS[options["format"] or self.guess_format(path)]
+        checkpoint = options["checkpoint"] or f"{path.rstrip(os.sep)}.checkpoint"
+        offset = self.read_checkpoint(checkpoint) if options["resume"] else 0
+
+        records = islice(reader(path), offset, None)
+        if offset:
+            self.stdout.write(f"Resuming after {offset} records")
+
+        self.categories = dict(Category.objects.values_list("slug", "id"))
+        self.skipped = 0
+        processed, imported, rows = offset, 0, 0
+        started = time.monotonic()
+
+        while True:
+            batch = list(islice(records, options["batch_size"]))
+            if not batch:
+                break
+
+            with transaction.atomic():
+                posts, batch_rows = self.import_batch(batch)
+            processed += len(batch)
+            imported += posts
+            rows += batch_rows
+            self.write_checkpoint(checkpoint, processed)
+
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f"{processed} records processed, {imported} posts imported "
+                f"({imported / elapsed:.0f} posts/s, {rows / elapsed:.0f} rows/s)"
+            )
+
+        # Signals were bypassed, refresh what they would have updated
+        if imported:
+            cache.delete_pattern("post_list*")
+            invalidate_all_documents()
+            build_related_posts.delay()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} posts ({rows} rows), skipped {self.skipped} records in {time.monotonic() - started:.1f}s"
+        ))
+
+    def import_batch(self, records):
+        valid = []
+        for record in records:
+            missing = [field for field in REQUIRED_FIELDS if not self.has_text(record, field)]
+            if missing:
+                self.stderr.write(f"Skipped a record without {' and '.join(missing)}: {str(record)[:80]}")
+                self.skipped += 1
+                continue
+            # The slug is stored truncated, the lookup of existing posts must use the same value
+            valid.append({**record, "slug": record["slug"][:128]})
+
+        slugs = [record["slug"] for record in valid]
+        existing = set(Post.objects.filter(slug__in=slugs).values_list("slug", flat=True))
+
+        posts, headings = [], []
+        for record in valid:
+            # Posts that are already in the database were imported before the last checkpoint
+            if record["slug"] in existing:
+                continue
+
+            created_at = self.parse_created_at(record)
+            if created_at is None:
+                self.stderr.write(f"Skipped {record['slug']}: invalid created_at {record['created_at']!r}")
+                self.skipped += 1
+                continue
+            existing.add(record["slug"])
+
+            status = record.get("status") or "published"
+            post = Post(
+                title=record["title"][:128],
+                description=(record.get("description") or "")[:256],
+                content=record.get("content") or "",
+                thumbnail=record.get("thumbnail") or "",
+                keywords=(record.get("keywords") or "")[:128],
+                slug=record["slug"],
+                category_id=self.get_category_id(record.get("category") or "uncategorized"),
+                created_at=created_at,
+                status=status,
+                # bulk_create skips Post.save(), an imported post was published when it was written
+                published_at=created_at if status == "published" else None,
+            )
+            posts.append(post)
+
+            for order, heading in enumerate(record.get("headings") or [], start=1):
+                headings.append(Heading(
+                    post=post,
+                    title=heading["title"][:128],
+                    slug=(heading.get("slug") or slugify(heading["title"]))[:128],
+                    level=heading.get("level", 2),
+                    order=heading.get("order", order),
+                ))
+
+        Post.objects.bulk_create(posts)
+        Heading.objects.bulk_create(headings)
+        # What the create_post_analytics receiver does for every saved post
+        PostAnalytics.objects.bulk_create([PostAnalytics(post=post) for post in posts])
+
+        return len(posts), len(posts) * 2 + len(headings)
+
+    def has_text(self, record, field):
+        return isinstance(record.get(field), str) and bool(record[field].strip())
+
+    def parse_created_at(self, record):
+        """
+        Aware creation date of a record, now when it has none, None when it can not be parsed
+        """
+        if not record.get("created_at"):
+            return timezone.now()
+        try:
+            created_at = parse_datetime(record["created_at"])
+        except (TypeError, ValueError):
+            # Not a string, or well formed but out of range (a 13th month)
+            return None
+        if created_at is not None and timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return created_at
+
+    def get_category_id(self, slug):
+        if slug not in self.categories:
+            category = Category.objects.create(name=slug.replace("-", " ").title(), slug=slug)
+            self.categories[slug] = category.id
+        return self.categories[slug]
+
+    def guess_format(self, path):
+        if os.path.isdir(path) or path.endswith(".md"):
+            return "markdown"
+        if path.endswith((".ndjson", ".jsonl")):
+            return "ndjson"
+        if path.endswith(".json"):
+            return "json"
+        raise CommandError("Can not guess the format of the input, use --format")
+
+    def read_checkpoint(self, checkpoint):
+        try:
+            with open(checkpoint) as file:
+                return int(file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, checkpoint, processed):
+        # Write to a temporary file first so a crash never leaves a half written checkpoint
+        temporary = f"{checkpoint}.tmp"
+        with open(temporary, "w") as file:
+            file.write(str(processed))
+        os.replace(temporary, checkpoint)
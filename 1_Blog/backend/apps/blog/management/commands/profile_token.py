@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed X-Profile header value, requests sending it are profiled"
+
+    def handle(self, *args, **options):
+        self.stderr.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds, optionally send X-Profile-Mode: sample|cprofile")
+        self.stdout.write(make_profile_token())
@@ -0,0 +1,77 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from apps.blog.retention import (
+    post_views_is_partitioned,
+    partition_post_views,
+    create_post_views_partitions,
+    drop_post_views_partitions,
+    prune_post_views,
+)
+
+
+class Command(BaseCommand):
+    help = "Delete PostViews rows older than the retention window in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.POST_VIEWS_RETENTION_DAYS,
+                            help="Keep the rows of the last N days")
+        parser.add_argument("--batch-size", type=int, default=settings.POST_VIEWS_PRUNE_BATCH_SIZE,
+                            help="Rows deleted per transaction")
+        parser.add_argument("--sleep", type=float, default=0,
+                            help="Seconds to wait between batches to leave room for other writes")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report what would be deleted")
+        parser.add_argument("--partition", action="store_true",
+                            help="Convert the table to monthly partitions first (PostgreSQL only)")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["days"])
+        dry_run = options["dry_run"]
+        started = time.monotonic()
+
+        if options["partition"]:
+            if connection.vendor != "postgresql":
+                raise CommandError("Partitioning is only supported on PostgreSQL")
+            if post_views_is_partitioned():
+                self.stdout.write("PostViews is already partitioned")
+            elif dry_run:
+                self.stdout.write("Would convert PostViews to monthly partitions")
+            else:
+                partition_post_views()
+                self.stdout.write(self.style.SUCCESS("Converted PostViews to monthly partitions"))
+
+        if post_views_is_partitioned():
+            if not dry_run:
+                now = timezone.now()
+                create_post_views_partitions(now, now + timedelta(days=62))
+            dropped = drop_post_views_partitions(before, dry_run=dry_run, progress=self.report_partition)
+            self.stdout.write(f"{'Would drop' if dry_run else 'Dropped'} {len(dropped)} partitions")
+
+        deleted = prune_post_views(
+            before,
+            batch_size=options["batch_size"],
+            sleep=options["sleep"],
+            dry_run=dry_run,
+            progress=lambda count, dry_run=False: self.report_rows(count, started, dry_run),
+        )
+
+        elapsed = time.monotonic() - started
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {deleted} PostViews rows created before {before:%Y-%m-%d %H:%M} in {elapsed:.1f}s"
+        ))
+
+    def report_partition(self, name, dry_run=False):
+        self.stdout.write(f"{'Would drop' if dry_run else 'Dropped'} partition {name}")
+
+    def report_rows(self, count, started, dry_run):
+        if dry_run:
+            return
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f"Deleted {count} rows ({count / elapsed:.0f} rows/s)")
@@ -0,0 +1,32 @@
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.redis_clients import load_scripts, probe, redis_url
+
+
+class Command(BaseCommand):
+    help = "Ping the redis of every namespace, and optionally preload the Lua scripts (run on deploy)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=5, help="Pings per namespace")
+        parser.add_argument("--load-scripts", action="store_true", help="SCRIPT LOAD every registered Lua script")
+
+    def handle(self, *args, **options):
+        down = []
+        for namespace in settings.REDIS_URLS:
+            url = urlsplit(redis_url(namespace))
+            # Never print the password of the url
+            location = f"{url.hostname}:{url.port or 6379}{url.path}"
+            health = probe(namespace, samples=options["samples"])
+            if health["ok"]:
+                self.stdout.write(f"{namespace:<10} {location:<30} ok {health['latency'] * 1000:.2f}ms")
+            else:
+                self.stdout.write(f"{namespace:<10} {location:<30} down: {health['error']}")
+                down.append(namespace)
+
+        if down:
+            raise CommandError(f"Redis is unreachable for: {', '.join(down)}")
+        if options["load_scripts"]:
+            self.stdout.write(f"Loaded {load_scripts()} Lua scripts")
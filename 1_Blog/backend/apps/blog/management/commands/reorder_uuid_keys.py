@@ -0,0 +1,95 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from apps.blog.models import PostViews, PostAnalytics, PostAnalyticsRollup, Heading
+from apps.blog.utils import uuid7
+
+
+# Each model with the field its time-ordered id is derived from
+MODELS = (
+    (PostViews, "created_at"),
+    (PostAnalyticsRollup, "bucket"),
+    (PostAnalytics, "post__created_at"),
+    (Heading, "post__created_at"),
+)
+
+
+class Command(BaseCommand):
+    help = "Rewrite the existing uuid4 primary keys of the high insert tables as time-ordered UUIDv7"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Rows rewritten per transaction")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only count the rows that would be rewritten")
+        parser.add_argument("--reindex", action="store_true",
+                            help="Rebuild the indexes afterwards to reclaim the space of the random layout (PostgreSQL only)")
+
+    def handle(self, *args, **options):
+        # Nothing references these tables by foreign key, so their ids can be rewritten in place
+        for model, timestamp_field in MODELS:
+            started = time.monotonic()
+            rewritten = 0
+            for batch in self.pending_batches(model, timestamp_field, options["batch_size"]):
+                if not options["dry_run"]:
+                    with transaction.atomic():
+                        self.rewrite_ids(model, [(pk, uuid7(timestamp)) for pk, timestamp in batch])
+                rewritten += len(batch)
+                self.stdout.write(f"{model.__name__}: {rewritten}")
+
+            if options["dry_run"]:
+                self.stdout.write(f"{model.__name__}: would rewrite {rewritten} ids")
+                continue
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{model.__name__}: rewrote {rewritten} ids in {elapsed:.1f}s"
+            ))
+
+            if options["reindex"] and rewritten and connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(f"REINDEX TABLE CONCURRENTLY {connection.ops.quote_name(model._meta.db_table)}")
+                self.stdout.write(f"{model.__name__}: reindexed")
+
+    def pending_batches(self, model, timestamp_field, batch_size):
+        """
+        Yield lists of up to batch_size (id, timestamp) of the rows without a UUIDv7, oldest first.
+        Every page is a new keyset query, the rewritten rows are never loaded all at once
+        """
+        position = None
+        batch = []
+        while True:
+            rows = model.objects.order_by(timestamp_field, "pk").values_list("pk", timestamp_field)
+            if position is not None:
+                timestamp, pk = position
+                rows = rows.filter(Q(**{f"{timestamp_field}__gt": timestamp}) | Q(**{timestamp_field: timestamp, "pk__gt": pk}))
+            rows = list(rows[:batch_size])
+            if not rows:
+                break
+            position = (rows[-1][1], rows[-1][0])
+            batch += [(pk, timestamp) for pk, timestamp in rows if pk.version != 7]
+            if len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield batch
+
+    def rewrite_ids(self, model, ids):
+        """
+        Give the rows their new ids with a single UPDATE ... FROM (VALUES ...), ids are (old, new) pairs
+        """
+        field = model._meta.pk
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        column = quote(field.column)
+        params = [field.get_db_prep_value(value, connection) for pair in ids for value in pair]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                # The values are named in a CTE, SQLite has no column list on a VALUES alias
+                f"WITH ids (old_id, new_id) AS (VALUES {', '.join(['(%s, %s)'] * len(ids))}) "
+                f"UPDATE {table} SET {column} = ids.new_id FROM ids WHERE {table}.{column} = ids.old_id",
+                params,
+            )
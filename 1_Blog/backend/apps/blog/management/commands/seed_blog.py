@@ -0,0 +1,326 @@
+import bisect
+import csv
+import io
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date
+from django.utils.text import slugify
+
+from apps.blog.models import Category, Post, PostAnalytics, PostAnalyticsRollup, Heading, PostViews
+from apps.blog.tasks import build_related_posts
+from apps.blog.sitemaps import invalidate_all_documents
+from apps.blog.utils import uuid7
+
+# Dataset size profiles, every value can be overridden from the command line
+PROFILES = {
+    "small": {"categories": 30, "depth": 3, "posts": 1_000, "views": 50_000, "paragraphs": (6, 24)},
+    "medium": {"categories": 200, "depth": 4, "posts": 10_000, "views": 1_000_000, "paragraphs": (4, 16)},
+    "large": {"categories": 1_000, "depth": 6, "posts": 100_000, "views": 5_000_000, "paragraphs": (2, 10)},
+}
+
+# Seeded rows are recognised (and cleared) by this slug prefix
+SLUG_PREFIX = "seed-"
+
+WORDS = (
+    "django python redis cache query index database server request response latency throughput "
+    "memory compression render serializer payload header content post blog category heading view "
+    "analytics performance celery worker queue task schedule deploy container proxy static media "
+    "template model field migration signal middleware session token security scale shard replica "
+    "the of and to in is that for it as with was on be by this are from at or an have not which"
+).split()
+
+
+def sentence(rng, low=6, high=16):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return " ".join(words).capitalize()
+
+def paragraph_pool(rng, size=400):
+    """
+    Prebuilt CKEditor blocks, posts are assembled from them so generating content stays cheap
+    """
+    pool = []
+    for i in range(size):
+        kind = i % 8
+        if kind == 5:
+            items = "".join(f"<li>{sentence(rng, 3, 8)}</li>" for _ in range(rng.randint(3, 6)))
+            pool.append(f"<ul>{items}</ul>")
+        elif kind == 6:
+            pool.append(f"<blockquote><p>{sentence(rng)}.</p></blockquote>")
+        elif kind == 7:
+            pool.append(
+                f'<figure class="image"><img src="/media/blog/seed/figure-{i}.jpg" alt="{sentence(rng, 2, 5)}">'
+                f"<figcaption>{sentence(rng, 3, 8)}</figcaption></figure>"
+            )
+        else:
+            sentences = [sentence(rng) for _ in range(rng.randint(3, 7))]
+            sentences[0] = f"<strong>{sentences[0]}</strong>"
+            sentences[-1] = f'<a href="https://example.com/{slugify(sentences[-1][:30])}">{sentences[-1]}</a>'
+            pool.append(f"<p>{'. '.join(sentences)}.</p>")
+    return pool
+
+# Generated values are already strings, ready to be written as CSV for COPY
+
+def seeded_uuid(rng, timestamp=None):
+    # Time-ordered like the model defaults when TIME_ORDERED_UUIDS is on, reproducible either way
+    if timestamp is not None and settings.TIME_ORDERED_UUIDS:
+        return str(uuid7(timestamp, rng=rng))
+    # Same string as str(uuid.UUID(int=bits, version=4)), without building the UUID object
+    value = rng.getrandbits(128) & ~(0xc000 << 48) & ~(0xf000 << 64) | (0x8000 << 48) | (4 << 76)
+    value = "%032x" % value
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+def random_datetime(rng, start, end):
+    return start + timedelta(seconds=rng.uniform(0, (end - start).total_seconds()))
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic synthetic blog (categories, posts, headings, views) for load and benchmark testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=PROFILES.keys(), default="small")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--categories", type=int)
+        parser.add_argument("--depth", type=int, help="Levels of the category tree")
+        parser.add_argument("--posts", type=int)
+        parser.add_argument("--views", type=int, help="PostViews rows, spread over the posts with a long tail")
+        parser.add_argument("--until", help="Date of the newest rows (default: today), fix it for identical data")
+        parser.add_argument("--batch-size", type=int, default=10_000, help="Rows per COPY or bulk_create")
+        parser.add_argument("--clear", action="store_true", help="Delete the previously seeded data first")
+
+    def handle(self, *args, **options):
+        profile = dict(PROFILES[options["profile"]])
+        for name in ("categories", "depth", "posts", "views"):
+            if options[name] is not None:
+                profile[name] = options[name]
+
+        until_date = parse_date(options["until"]) if options["until"] else datetime.now(dt_timezone.utc).date()
+        if until_date is None:
+            raise CommandError(f"Invalid date: {options['until']}")
+        until = datetime.combine(until_date, datetime.min.time(), tzinfo=dt_timezone.utc)
+
+        if options["clear"]:
+            self.clear()
+        elif Category.objects.filter(slug__startswith=SLUG_PREFIX).exists():
+            raise CommandError("Seeded data already exists, use --clear to replace it")
+
+        self.batch_size = options["batch_size"]
+        self.rows = 0
+        self.started = time.monotonic()
+        rng = random.Random(options["seed"])
+
+        with transaction.atomic():
+            category_ids = self.seed_categories(rng, profile)
+            posts = self.seed_posts(rng, profile, category_ids, until)
+            views = self.seed_views(rng, profile, posts, until)
+            self.seed_analytics(rng, posts, views)
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                for model in (Category, Post, Heading, PostViews, PostAnalytics):
+                    cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+        # Rows were loaded without the save signals, refresh what they would have updated
+        cache.delete_pattern("post_list*")
+        invalidate_all_documents()
+        build_related_posts.delay()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {profile['categories']} categories, {len(posts)} posts and {sum(views.values())} views "
+            f"({self.rows} rows) in {time.monotonic() - self.started:.1f}s"
+        ))
+
+    def clear(self):
+        # Raw deletes, the ORM would load every post to send post_delete
+        prefix = f"{SLUG_PREFIX}%"
+        post_ids = f"SELECT id FROM {Post._meta.db_table} WHERE slug LIKE %s"
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (PostAnalyticsRollup, PostViews, PostAnalytics, Heading):
+                cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE post_id IN ({post_ids})", [prefix])
+            cursor.execute(f"DELETE FROM {Post._meta.db_table} WHERE slug LIKE %s", [prefix])
+            cursor.execute(f"DELETE FROM {Category._meta.db_table} WHERE slug LIKE %s", [prefix])
+
+    def seed_categories(self, rng, profile):
+        # Grow a tree level by level, every category hangs from a random category of the level above
+        levels, rows = [[]], []
+        for i in range(profile["categories"]):
+            # About one category in ten is a root, the others go one level below any existing level
+            if i == 0 or profile["depth"] < 2 or rng.random() < 0.1:
+                level = 0
+            else:
+                level = min(len(levels), rng.randint(1, profile["depth"] - 1))
+            if level == len(levels):
+                levels.append([])
+            parent = rng.choice(levels[level - 1]) if level else None
+            category_id = seeded_uuid(rng)
+            levels[level].append(category_id)
+            name = f"{sentence(rng, 1, 3)} {i}"
+            rows.append((category_id, parent, name, name, sentence(rng), f"{SLUG_PREFIX}category-{i}"))
+
+        self.load(Category, ("id", "parent", "name", "title", "description", "slug"), rows)
+        # Posts go to leaves and inner categories alike, deeper categories are picked more often
+        return [category_id for depth, level in enumerate(levels) for category_id in level for _ in range(depth + 1)]
+
+    def seed_posts(self, rng, profile, category_ids, until):
+        # Posts are assembled from prebuilt pools, generating and slugifying text per post is the slow part
+        paragraphs = paragraph_pool(rng)
+        sentences = [sentence(rng) for _ in range(2000)]
+        heading_titles = [sentence(rng, 2, 6) for _ in range(500)]
+        heading_titles = [(title, slugify(title)) for title in heading_titles]
+        posts, headings = [], []
+
+        def post_rows():
+            for i in range(profile["posts"]):
+                post_id = seeded_uuid(rng)
+                created_at = random_datetime(rng, until - timedelta(days=730), until)
+
+                blocks = []
+                heading_count = rng.randint(2, 8)
+                paragraph_count = max(rng.randint(*profile["paragraphs"]) // heading_count, 1)
+                for order in range(1, heading_count + 1):
+                    level = 2 if order == 1 or rng.random() < 0.6 else 3
+                    title, heading_slug = rng.choice(heading_titles)
+                    heading_slug = f"{heading_slug}-{order}"
+                    headings.append((seeded_uuid(rng), post_id, title, heading_slug, level, order))
+                    blocks.append(f'<h{level} id="{heading_slug}">{title}</h{level}>')
+                    blocks += rng.choices(paragraphs, k=paragraph_count)
+
+                status = "published" if rng.random() < 0.95 else "draft"
+                posts.append((post_id, created_at, status))
+                yield (
+                    post_id, f"{rng.choice(sentences)[:100]} {i}", rng.choice(sentences), "\n".join(blocks),
+                    f"blog/seed/{i}.jpg", ",".join(rng.sample(WORDS, 4)), f"{SLUG_PREFIX}post-{i}",
+                    rng.choice(category_ids), created_at.isoformat(), created_at.isoformat(), status,
+                    created_at.isoformat() if status == "published" else None,
+                )
+
+        self.load(
+            Post,
+            ("id", "title", "description", "content", "thumbnail", "keywords", "slug", "category", "created_at",
+             "updated_at", "status", "published_at"),
+            post_rows(),
+        )
+        self.load(Heading, ("id", "post", "title", "slug", "level", "order"), headings)
+        return posts
+
+    def seed_views(self, rng, profile, posts, until):
+        # Zipf-like popularity: a few posts get most of the views, most posts get a handful
+        popularity = list(range(len(posts)))
+        rng.shuffle(popularity)
+        cumulative = list(accumulate(1 / (rank + 1) ** 1.1 for rank in popularity))
+        # Views of the last 180 days, never before the post was created
+        until_timestamp = until.timestamp()
+        window_start = until_timestamp - 180 * 86400
+        windows = [(post_id, max(created_at.timestamp(), window_start)) for post_id, created_at, _ in posts]
+        counts = [0] * len(posts)
+
+        def view_rows():
+            random_float, random_bits = rng.random, rng.getrandbits
+            for _ in range(profile["views"]):
+                index = min(bisect.bisect(cumulative, random_float() * cumulative[-1]), len(posts) - 1)
+                counts[index] += 1
+                post_id, start = windows[index]
+                created_at = datetime.fromtimestamp(start + random_float() * (until_timestamp - start), dt_timezone.utc)
+                ip = random_bits(32)
+                ip_address = f"{ip % 223 + 1}.{ip >> 8 & 255}.{ip >> 16 & 255}.{(ip >> 24) % 254 + 1}"
+                yield seeded_uuid(rng, created_at), post_id, ip_address, created_at.isoformat()
+
+        if posts:
+            self.load(PostViews, ("id", "post", "ip_address", "created_at"), view_rows())
+        return Counter({post_id: count for (post_id, _, _), count in zip(posts, counts)})
+
+    def seed_analytics(self, rng, posts, views):
+        rows = []
+        for post_id, _, _ in posts:
+            view_count = views[post_id]
+            impressions = view_count * rng.randint(4, 30) + rng.randint(0, 50)
+            clicks = min(round(impressions * rng.uniform(0.01, 0.12)), impressions)
+            rows.append((
+                seeded_uuid(rng), post_id, view_count, impressions, clicks,
+                clicks / impressions * 100 if impressions else 0,
+                round(rng.uniform(15, 420), 2) if view_count else 0, view_count,
+            ))
+
+        self.load(
+            PostAnalytics,
+            ("id", "post", "views", "impressions", "clicks", "clicks_through_rate", "avg_time_on_page",
+             "time_on_page_samples"),
+            rows,
+        )
+
+    def load(self, model, fields, rows):
+        """
+        Insert tuples of field values, with COPY on PostgreSQL and batched INSERTs elsewhere.
+        Both skip the model layer, so auto_now fields keep the generated dates
+        """
+        rows = iter(rows)
+        loaded = 0
+        with self.deferred_indexes(model):
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                if connection.vendor == "postgresql":
+                    self.copy(model, fields, batch)
+                else:
+                    self.insert(model, fields, batch)
+                loaded += len(batch)
+
+        self.rows += loaded
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stdout.write(f"{loaded} {model.__name__} rows loaded ({self.rows / elapsed:.0f} rows/s)")
+
+    @contextmanager
+    def deferred_indexes(self, model):
+        # Building the secondary indexes once after COPY is much faster than updating them row by row
+        if connection.vendor != "postgresql" or not model._meta.indexes:
+            yield
+            return
+
+        with connection.schema_editor() as schema_editor:
+            for index in model._meta.indexes:
+                schema_editor.remove_index(model, index)
+        yield
+        # CREATE INDEX refuses to run while deferred foreign key checks are pending
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        with connection.schema_editor() as schema_editor:
+            for index in model._meta.indexes:
+                schema_editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+    def copy(self, model, fields, batch):
+        buffer = io.StringIO()
+        # None is written as an unquoted empty value, which is NULL in COPY's CSV format
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+
+        quote_name = connection.ops.quote_name
+        columns = ", ".join(quote_name(model._meta.get_field(field).column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+
+    def insert(self, model, fields, batch):
+        model_fields = [model._meta.get_field(field) for field in fields]
+        quote_name = connection.ops.quote_name
+        columns = ", ".join(quote_name(field.column) for field in model_fields)
+        placeholders = ", ".join(["%s"] * len(model_fields))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})",
+                [
+                    [field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)]
+                    for row in batch
+                ],
+            )
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.blog.tasks import warm_blog_cache as warm_blog_cache_task
+from apps.blog.warmup import warm_blog_cache
+
+
+class Command(BaseCommand):
+    help = "Fill the post list and post detail caches, most visited posts first (run after a deploy or a redis flush)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=settings.WARMUP_MAX_POSTS,
+                            help="Warm the N most visited posts, 0 for every published post")
+        parser.add_argument("--chunk-size", type=int, default=settings.WARMUP_CHUNK_SIZE,
+                            help="Posts serialized per query batch")
+        parser.add_argument("--concurrency", type=int, default=settings.WARMUP_CONCURRENCY,
+                            help="Chunks warmed at the same time")
+        parser.add_argument("--background", action="store_true",
+                            help="Queue the warm_blog_cache task instead of warming here")
+
+    def handle(self, *args, **options):
+        if options["background"]:
+            warm_blog_cache_task.delay(limit=options["limit"])
+            self.stdout.write("Queued the warm_blog_cache task")
+            return
+
+        report = warm_blog_cache(
+            limit=options["limit"],
+            chunk_size=options["chunk_size"],
+            concurrency=options["concurrency"],
+            progress=self.report_progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {report['posts']} posts and the list of {report['list_posts']} posts in {report['seconds']:.1f}s"
+        ))
+
+    def report_progress(self, done, total, elapsed):
+        self.stdout.write(f"Warmed {done}/{total} posts ({done / max(elapsed, 1e-6):.0f} posts/s)")
@@ -0,0 +1,46 @@
+import hmac
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from apps.blog.outbox import sign
+
+
+class Command(BaseCommand):
+    help = "Serve a local webhook endpoint printing the outbox deliveries it receives, for development"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8900)
+        parser.add_argument("--secret", default="", help="Check the X-Webhook-Signature of the deliveries")
+        parser.add_argument("--status", type=int, default=200, help="Status answered, to try the retries")
+
+    def handle(self, *args, **options):
+        command = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                signature = self.headers.get("X-Webhook-Signature", "")
+                valid = not options["secret"] or hmac.compare_digest(signature, sign(options["secret"], body))
+                events = json.loads(body)["events"]
+                command.stdout.write(
+                    f"Delivery {self.headers.get('X-Webhook-Delivery')} "
+                    f"({'valid' if valid else 'INVALID'} signature, answered {options['status']})"
+                )
+                for event in events:
+                    command.stdout.write(f"  {event['topic']:<18} {json.dumps(event['data'])}")
+                self.send_response(options["status"] if valid else 401)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), Handler)
+        self.stdout.write(f"Listening on http://127.0.0.1:{options['port']}/, stop with CTRL-C")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_alter_postanalytics_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postanalytics',
+            name='time_on_page_samples',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:30
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_postanalytics_time_on_page_samples'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostAnalyticsRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], default='hour', max_length=5)),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('impressions', models.PositiveIntegerField(default=0)),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('dwell_sum', models.FloatField(default=0)),
+                ('dwell_count', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_rollups', to='blog.post')),
+            ],
+            options={
+                'verbose_name': 'Post Analytics Rollup',
+                'verbose_name_plural': 'Post Analytics Rollups',
+                'ordering': ['bucket'],
+                'indexes': [models.Index(fields=['period', 'bucket'], name='post_rollup_period_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'period', 'bucket'), name='unique_post_rollup_bucket')],
+            },
+        ),
+    ]
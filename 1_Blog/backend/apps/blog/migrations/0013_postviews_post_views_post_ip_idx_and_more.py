@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_postanalyticsrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postviews',
+            index=models.Index(fields=['post', 'ip_address'], name='post_views_post_ip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postviews',
+            index=models.Index(fields=['created_at'], name='post_views_created_at_idx'),
+        ),
+    ]
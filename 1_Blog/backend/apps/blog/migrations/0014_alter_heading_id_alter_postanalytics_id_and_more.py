@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:35
+
+import apps.blog.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_postviews_post_views_post_ip_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='heading',
+            name='id',
+            field=models.UUIDField(default=apps.blog.utils.time_ordered_uuid, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='postanalytics',
+            name='id',
+            field=models.UUIDField(default=apps.blog.utils.time_ordered_uuid, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='postanalyticsrollup',
+            name='id',
+            field=models.UUIDField(default=apps.blog.utils.time_ordered_uuid, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='postviews',
+            name='id',
+            field=models.UUIDField(default=apps.blog.utils.time_ordered_uuid, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:05
+
+import apps.blog.utils
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_posttombstone_post_post_updated_at_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPost',
+            fields=[
+                ('id', models.UUIDField(default=apps.blog.utils.time_ordered_uuid, editable=False, primary_key=True, serialize=False)),
+                ('score', models.FloatField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='blog.post')),
+                ('related', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='blog.post')),
+            ],
+            options={
+                'ordering': ['post', '-score'],
+                'constraints': [models.UniqueConstraint(fields=('post', 'related'), name='unique_related_post')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:07
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_published_at(apps, schema_editor):
+    # The first publication was not recorded, the creation date is the closest known
+    Post = apps.get_model("blog", "Post")
+    Post.objects.filter(status="published").update(published_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0018_relatedpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='published_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_published_at, migrations.RunPython.noop),
+    ]
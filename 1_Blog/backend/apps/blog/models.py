@@ -1,14 +1,19 @@
+import hashlib
+import secrets
 import uuid
+from collections import defaultdict
 
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncHour, TruncDay, TruncMonth
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.text import slugify
 
 from django_ckeditor_5.fields import CKEditor5Field
 
-from .utils import get_client_ip
+from .utils import get_client_ip, time_ordered_uuid
 
 # This function is used to store the thumbnail in a specific directory
 def blog_thumbnail_directory(instance, filename):
@@ -68,25 +73,106 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     status = models.CharField(max_length=10, choices=status_options, default="draft")
+    # First publication, drafts that were never public stay out of the delta sync and leave no tombstone
+    published_at = models.DateTimeField(blank=True, null=True, editable=False)
     
     objects = models.Manager() # Default manager
     post_published = PostObject() # Manager for published posts (custom manager)
     
     class Meta:
         ordering = ("status", "-created_at")
+        indexes = [
+            # Keyset pagination of the delta sync, see changes.py
+            models.Index(fields=["updated_at", "id"], name="post_updated_at_id_idx"),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as loaded, so the outbox can tell publications and slug changes from edits
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        if self.status == "published" and self.published_at is None:
+            self.published_at = timezone.now()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "published_at"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
 class PostViews(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="post_views")
     ip_address = models.GenericIPAddressField()
     created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Used by the unique view lookup in PostAnalytics.increment_views
+            models.Index(fields=["post", "ip_address"], name="post_views_post_ip_idx"),
+            # Used by the retention job to find old rows
+            models.Index(fields=["created_at"], name="post_views_created_at_idx"),
+        ]
+
+class PostAnalyticsManager(models.Manager):
+    def add_counts(self, rows, batch_size=500):
+        """
+        Add counters to the analytics of many posts with one UPDATE per batch, refreshing their click
+        through rate. Each row is a dict with post_id and any of the counter fields.
+        Return the ids (as strings) of the posts that have analytics.
+        """
+        merged = defaultdict(lambda: dict.fromkeys(PostAnalytics.COUNTER_FIELDS, 0))
+        for row in rows:
+            for field in PostAnalytics.COUNTER_FIELDS:
+                merged[str(row["post_id"])][field] += row.get(field, 0)
+        
+        if not merged:
+            return set()
+        
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        post_field = opts.get_field("post")
+        post_column = quote(post_field.column)
+        names = ", ".join(PostAnalytics.COUNTER_FIELDS)
+        row_placeholder = "({})".format(", ".join(["%s"] * (1 + len(PostAnalytics.COUNTER_FIELDS))))
+        updates = ", ".join(
+            f"{quote(name)} = {table}.{quote(name)} + counts.{name}" for name in PostAnalytics.COUNTER_FIELDS
+        )
+        impressions = f"{table}.{quote('impressions')} + counts.impressions"
+        click_through_rate = (
+            f"{quote('clicks_through_rate')} = CASE WHEN {impressions} > 0 "
+            f"THEN ({table}.{quote('clicks')} + counts.clicks) * 100.0 / ({impressions}) ELSE 0 END"
+        )
+        
+        items = list(merged.items())
+        updated = set()
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                params = []
+                for post_id, counters in batch:
+                    params.append(post_field.get_db_prep_value(post_id, connection))
+                    params.extend(counters.values())
+                # The values are named in a CTE, SQLite has no column list on a VALUES alias
+                cursor.execute(
+                    f"WITH counts (post_id, {names}) AS (VALUES {', '.join([row_placeholder] * len(batch))}) "
+                    f"UPDATE {table} SET {updates}, {click_through_rate} FROM counts "
+                    f"WHERE {table}.{post_column} = counts.post_id RETURNING {table}.{post_column}",
+                    params,
+                )
+                updated.update(str(post_field.to_python(post_id)) for post_id, in cursor.fetchall())
+        return updated
 
 class PostAnalytics(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    COUNTER_FIELDS = ("views", "impressions", "clicks")
+    
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="post_analytics")
     
     views = models.PositiveIntegerField(default=0)
@@ -94,6 +180,10 @@ class PostAnalytics(models.Model):
     clicks = models.PositiveIntegerField(default=0)
     clicks_through_rate = models.FloatField(default=0)
     avg_time_on_page = models.FloatField(default=0)
+    # Number of dwell time samples behind avg_time_on_page, used to merge new batches into the mean
+    time_on_page_samples = models.PositiveIntegerField(default=0)
+    
+    objects = PostAnalyticsManager()
     
     def update_click_through_rate(self):
         if self.impressions > 0:
@@ -103,6 +193,8 @@ class PostAnalytics(models.Model):
         
         self.save()
     
+    # The hourly rollups are filled by the flush jobs of apps.blog.tasks from the counters buffered
+    # in redis, these methods only update the lifetime totals
     def increment_clicks(self):
         self.clicks += 1
         self.save()
@@ -118,14 +210,163 @@ class PostAnalytics(models.Model):
             PostViews.objects.create(post=self.post, ip_address=ip_address)
             self.views += 1
             self.save()
+            return True
+        return False
+    
+    def merge_time_on_page(self, total_seconds, samples):
+        """
+        Merge a batch of dwell time samples into the running average (does not save)
+        """
+        if samples <= 0:
+            return
+        
+        combined_samples = self.time_on_page_samples + samples
+        self.avg_time_on_page = (
+            self.avg_time_on_page * self.time_on_page_samples + total_seconds
+        ) / combined_samples
+        self.time_on_page_samples = combined_samples
     
     class Meta:
         verbose_name = 'Post Analytics'
         verbose_name_plural = 'Post Analytics'
 
 
+def current_hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+class PostAnalyticsRollupManager(models.Manager):
+    def add_counts(self, rows, period="hour", batch_size=500):
+        """
+        Add counters to their (post, period, bucket) rows with one upsert per batch.
+        Each row is a dict with post_id, an optional bucket (defaults to the current hour)
+        and any of the counter fields.
+        """
+        # Merge rows that share a bucket, an upsert can not touch the same row twice
+        merged = defaultdict(lambda: dict.fromkeys(PostAnalyticsRollup.COUNTER_FIELDS, 0))
+        for row in rows:
+            key = (row["post_id"], row.get("bucket") or current_hour())
+            for field in PostAnalyticsRollup.COUNTER_FIELDS:
+                merged[key][field] += row.get(field, 0)
+        
+        if not merged:
+            return
+        
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        fields = [opts.get_field(name) for name in ("id", "post", "period", "bucket", *PostAnalyticsRollup.COUNTER_FIELDS)]
+        columns = ", ".join(quote(field.column) for field in fields)
+        row_placeholder = "({})".format(", ".join(["%s"] * len(fields)))
+        conflict = ", ".join(quote(opts.get_field(name).column) for name in ("post", "period", "bucket"))
+        updates = ", ".join(
+            f"{quote(name)} = {table}.{quote(name)} + EXCLUDED.{quote(name)}"
+            for name in PostAnalyticsRollup.COUNTER_FIELDS
+        )
+        
+        items = list(merged.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                params = []
+                for (post_id, bucket), counters in batch:
+                    values = (time_ordered_uuid(), post_id, period, bucket, *counters.values())
+                    params.extend(
+                        field.get_db_prep_value(value, connection) for field, value in zip(fields, values)
+                    )
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_placeholder] * len(batch))} "
+                    f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}",
+                    params,
+                )
+
+
+    def compact(self, source_period, target_period, before):
+        """
+        Fold the source_period rows older than `before` into target_period rows and delete them
+        """
+        trunc = {"day": TruncDay, "month": TruncMonth}[target_period]
+        
+        with transaction.atomic(using=self.db):
+            old_rows = self.filter(period=source_period, bucket__lt=before)
+            totals = (
+                old_rows.annotate(target_bucket=trunc("bucket"))
+                .values("post_id", "target_bucket")
+                .annotate(**{f"total_{field}": Sum(field) for field in PostAnalyticsRollup.COUNTER_FIELDS})
+                .order_by()
+            )
+            self.add_counts(
+                (
+                    {
+                        "post_id": row["post_id"],
+                        "bucket": row["target_bucket"],
+                        **{field: row[f"total_{field}"] for field in PostAnalyticsRollup.COUNTER_FIELDS},
+                    }
+                    for row in totals
+                ),
+                period=target_period,
+            )
+            deleted, _ = old_rows.delete()
+        
+        return deleted
+    
+    def trend(self, post_id, period, start, end):
+        """
+        Sum the counters of a post per hour, day or month between start and end.
+        Rows that were already compacted into a coarser period than requested are not included.
+        """
+        source_periods = {"hour": ["hour"], "day": ["hour", "day"], "month": ["hour", "day", "month"]}[period]
+        trunc = {"hour": TruncHour, "day": TruncDay, "month": TruncMonth}[period]
+        
+        return (
+            self.filter(post_id=post_id, period__in=source_periods, bucket__gte=start, bucket__lt=end)
+            .annotate(period_bucket=trunc("bucket"))
+            .values("period_bucket")
+            .annotate(**{f"total_{field}": Sum(field) for field in PostAnalyticsRollup.COUNTER_FIELDS})
+            .order_by("period_bucket")
+        )
+
+
+class PostAnalyticsRollup(models.Model):
+    # Period options, hourly rows are compacted into daily rows and daily rows into monthly rows
+    period_options = (
+        ("hour", "Hour"),
+        ("day", "Day"),
+        ("month", "Month"),
+    )
+    
+    COUNTER_FIELDS = ("views", "impressions", "clicks", "dwell_sum", "dwell_count")
+    
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="analytics_rollups")
+    
+    period = models.CharField(max_length=5, choices=period_options, default="hour")
+    # Start of the bucket (truncated to the hour, day or month)
+    bucket = models.DateTimeField()
+    
+    views = models.PositiveIntegerField(default=0)
+    impressions = models.PositiveIntegerField(default=0)
+    clicks = models.PositiveIntegerField(default=0)
+    dwell_sum = models.FloatField(default=0)
+    dwell_count = models.PositiveIntegerField(default=0)
+    
+    objects = PostAnalyticsRollupManager()
+    
+    class Meta:
+        verbose_name = 'Post Analytics Rollup'
+        verbose_name_plural = 'Post Analytics Rollups'
+        ordering = ["bucket"]
+        constraints = [
+            models.UniqueConstraint(fields=["post", "period", "bucket"], name="unique_post_rollup_bucket"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "bucket"], name="post_rollup_period_bucket_idx"),
+        ]
+
+
 class Heading(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
     
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="headings")
     
@@ -152,7 +393,239 @@ class Heading(models.Model):
             self.slug = slugify(self.title)
         super().save(*args, **kwargs)
 
+
+class RelatedPost(models.Model):
+    """
+    One of the RELATED_POSTS_COUNT most similar posts of a post, by tf-idf cosine similarity
+    """
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
+    
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="related_entries")
+    # Left in place when the related post is deleted, so the update of the index finds the lists it was in
+    related = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ["post", "-score"]
+        constraints = [
+            models.UniqueConstraint(fields=["post", "related"], name="unique_related_post"),
+        ]
+
+class PostVector(models.Model):
+    """
+    Normalized tf-idf vector of a published post, {term: weight}, the related posts of a saved post are
+    scored against the stored vectors of the others
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name="tfidf_vector")
+    weights = models.JSONField()
+
+class RelatedTerm(models.Model):
+    """
+    Inverse document frequency of a term of the published posts, as of the last full build of the related posts
+    """
+    term = models.CharField(max_length=64, primary_key=True)
+    idf = models.FloatField()
+
+class APIKey(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    name = models.CharField(max_length=128)
+    # Only the SHA-256 of the key is stored, the key itself is shown once when it is created
+    hashed_key = models.CharField(max_length=64, unique=True, editable=False)
+    # First characters of the key, to tell keys apart in the admin
+    prefix = models.CharField(max_length=8, editable=False)
+    
+    # Token bucket of the key, empty to use API_KEY_RATE_LIMIT_PER_SECOND and API_KEY_RATE_LIMIT_BURST,
+    # 0 blocks the key
+    rate_per_second = models.FloatField(blank=True, null=True)
+    burst = models.PositiveIntegerField(blank=True, null=True)
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "API key"
+        verbose_name_plural = "API keys"
+        ordering = ["-created_at"]
+    
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
+    
+    @staticmethod
+    def hash_key(key):
+        # Keys are long random strings, a fast hash is enough (no salt or key stretching needed)
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    @classmethod
+    def generate(cls, name, **kwargs):
+        """
+        Create a new key, return the instance and the raw key
+        """
+        key = secrets.token_urlsafe(32)
+        api_key = cls.objects.create(name=name, hashed_key=cls.hash_key(key), prefix=key[:8], **kwargs)
+        return api_key, key
+
+
+class OutboxEvent(models.Model):
+    """
+    Change to published content, written in the transaction of the change. The relay_outbox task
+    moves pending events into webhook deliveries and deletes them
+    """
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
+    
+    # post.published, post.updated, post.unpublished or post.deleted
+    topic = models.CharField(max_length=64)
+    # Events of a same key in a relayed batch are merged into one, see outbox.merge_events()
+    key = models.CharField(max_length=128)
+    data = models.JSONField(default=dict)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Outbox event"
+        verbose_name_plural = "Outbox events"
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["created_at"], name="outbox_created_at_idx"),
+        ]
+    
+    def __str__(self):
+        return f"{self.topic} {self.key}"
+
+
+class Webhook(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    name = models.CharField(max_length=128)
+    url = models.URLField(max_length=512)
+    # Deliveries are signed with HMAC-SHA256 of the body in the X-Webhook-Signature header
+    secret = models.CharField(max_length=128, blank=True)
+    # Topics sent to the webhook, empty for every topic
+    topics = models.JSONField(default=list, blank=True)
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ["name"]
+    
+    def __str__(self):
+        return self.name
+    
+    def accepts(self, topic):
+        return not self.topics or topic in self.topics
+
+
+class WebhookDelivery(models.Model):
+    """
+    One batch of events for a webhook, retried with exponential backoff until it is accepted
+    """
+    status_options = (
+        ("pending", "Pending"),
+        ("delivered", "Delivered"),
+        ("failed", "Failed"),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE, related_name="deliveries")
+    events = models.JSONField(default=list)
+    
+    status = models.CharField(max_length=10, choices=status_options, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    response_status = models.PositiveIntegerField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Webhook delivery"
+        verbose_name_plural = "Webhook deliveries"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="webhook_delivery_due_idx"),
+        ]
+    
+    def __str__(self):
+        return f"{self.webhook} {self.status} ({len(self.events)} events)"
+
+class PostTombstone(models.Model):
+    """
+    Deleted post, reported by the delta sync until DELTA_SYNC_TOMBSTONE_DAYS have passed
+    """
+    # Id of the deleted post
+    id = models.UUIDField(primary_key=True, editable=False)
+    slug = models.CharField(max_length=128)
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ["deleted_at"]
+        indexes = [
+            models.Index(fields=["deleted_at", "id"], name="post_tombstone_deleted_idx"),
+        ]
+    
+    def __str__(self):
+        return self.slug
+
+
 @receiver(post_save, sender=Post)
 def create_post_analytics(sender, instance, created, **kwargs):
     if created:
         PostAnalytics.objects.create(post=instance)
+
+# Keep the related posts index up to date, after the transaction so the task reads the saved post
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def update_related_posts_index(sender, instance, **kwargs):
+    from .tasks import update_related_posts
+    
+    transaction.on_commit(lambda: update_related_posts.delay(str(instance.id)))
+
+
+# Only the sitemap shard of the post is rendered again, with the sitemap index and the feeds. After
+# the transaction, a request in between would cache the documents without the change again
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_sitemaps(sender, instance, **kwargs):
+    from .sitemaps import invalidate_post_documents
+    
+    transaction.on_commit(lambda: invalidate_post_documents(instance))
+
+
+# Publish events go to the outbox in the transaction of the change, the relay starts once it commits
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def record_post_outbox_event(sender, instance, **kwargs):
+    from .outbox import record_post_event
+    
+    record_post_event(instance, deleted=kwargs.get("signal") is post_delete)
+
+@receiver(post_save, sender=Heading)
+@receiver(post_delete, sender=Heading)
+def record_heading_outbox_event(sender, instance, **kwargs):
+    from .outbox import record_heading_event
+    
+    record_heading_event(instance)
+
+
+# Deleted posts leave a tombstone, heading changes move their post in the delta sync
+@receiver(post_delete, sender=Post)
+def create_post_tombstone(sender, instance, **kwargs):
+    if instance.published_at is None:
+        return
+    PostTombstone.objects.update_or_create(id=instance.id, defaults={"slug": instance.slug, "deleted_at": timezone.now()})
+
+@receiver(post_save, sender=Heading)
+@receiver(post_delete, sender=Heading)
+def touch_heading_post(sender, instance, **kwargs):
+    Post.objects.filter(id=instance.post_id).update(updated_at=timezone.now())
+
+
+# Drop the in-process copy of the keys so changes apply right away in this process
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def clear_api_key_registry(sender, **kwargs):
+    from .api_keys import clear_api_key_cache
+    
+    clear_api_key_cache()
@@ -0,0 +1,212 @@
+import hashlib
+import hmac
+import json
+import logging
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent, Post, Webhook, WebhookDelivery
+from .response_cache import POST_LIST_KEYS, pop_tracked_keys, post_detail_key, post_shapes_key
+
+logger = logging.getLogger(__name__)
+
+# Held by the relay so the beat schedule and the tasks started on commit never relay the same events twice
+OUTBOX_LOCK_KEY = "outbox:relay:lock"
+
+
+def schedule_relay():
+    """
+    Relay the outbox once the current transaction commits, the beat schedule catches anything missed
+    """
+    from .tasks import relay_outbox
+
+    transaction.on_commit(relay_outbox.delay)
+
+def record_post_event(post, deleted=False):
+    """
+    Write the outbox event of a saved or deleted post. Drafts that stay drafts are not public, no event
+    """
+    loaded = getattr(post, "_loaded_values", {})
+    was_published = loaded.get("status") == "published"
+    if deleted:
+        topic = "post.deleted" if was_published or post.status == "published" else None
+    elif post.status == "published":
+        topic = "post.updated" if was_published else "post.published"
+    else:
+        topic = "post.unpublished" if was_published else None
+    if topic is None:
+        return None
+
+    data = {"id": str(post.id), "slug": post.slug}
+    if loaded.get("slug") and loaded["slug"] != post.slug:
+        data["previous_slug"] = loaded["slug"]
+    event = OutboxEvent.objects.create(topic=topic, key=f"post:{post.id}", data=data)
+    # A second save of the same instance is compared to this one
+    post._loaded_values = {**loaded, "status": post.status, "slug": post.slug}
+    schedule_relay()
+    return event
+
+def record_heading_event(heading):
+    """
+    A heading change updates its post, when the post is published
+    """
+    slug = Post.post_published.filter(id=heading.post_id).values_list("slug", flat=True).first()
+    if slug is None:
+        return None
+    event = OutboxEvent.objects.create(
+        topic="post.updated", key=f"post:{heading.post_id}", data={"id": str(heading.post_id), "slug": slug}
+    )
+    schedule_relay()
+    return event
+
+
+def merge_events(events):
+    """
+    One event per key, with the latest topic and data. A publication followed by edits stays a
+    publication and the first previous slug is kept, so every stale url still gets purged
+    """
+    merged = {}
+    for event in events:
+        entry = {
+            "id": str(event.id),
+            "topic": event.topic,
+            "data": dict(event.data),
+            "created_at": event.created_at.isoformat(),
+        }
+        previous = merged.get(event.key)
+        if previous:
+            if previous["topic"] == "post.published" and event.topic == "post.updated":
+                entry["topic"] = "post.published"
+            previous_slug = previous["data"].get("previous_slug")
+            if previous_slug and previous_slug != entry["data"].get("slug"):
+                entry["data"]["previous_slug"] = previous_slug
+        merged[event.key] = entry
+    return list(merged.values())
+
+def purge_post_caches(events):
+    """
+    Drop the cached responses of the posts of the events, under their current and previous slugs
+    """
+    slugs = {
+        slug for event in events
+        for slug in (event["data"].get("slug"), event["data"].get("previous_slug")) if slug
+    }
+    stale = [
+        key for slug in slugs
+        for key in (post_detail_key(slug), f"post_detail_data:{slug}", f"post_card:{slug}")
+    ]
+    # The ?fields= and ?include= shapes of the posts and the list pages are tracked in sets as they
+    # are cached, the lists warmed by warmup.py keep their plain keys
+    stale += ["post_list", "post_list:ids"]
+    stale += pop_tracked_keys([POST_LIST_KEYS] + [post_shapes_key(slug) for slug in slugs])
+    cache.delete_many(stale)
+
+def dispatch_events(batch_size):
+    """
+    Move a batch of pending events into one delivery per interested webhook, return the number of
+    events. The events are deleted in the transaction creating the deliveries
+    """
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True).order_by("created_at")[:batch_size]
+        )
+        if not events:
+            return 0
+        merged = merge_events(events)
+        deliveries = []
+        for webhook in Webhook.objects.filter(is_active=True):
+            accepted = [event for event in merged if webhook.accepts(event["topic"])]
+            if accepted:
+                deliveries.append(WebhookDelivery(webhook=webhook, events=accepted))
+        WebhookDelivery.objects.bulk_create(deliveries)
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+
+    purge_post_caches(merged)
+    return len(events)
+
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def send(delivery):
+    """
+    POST a delivery to its webhook, return (response status or None, error message)
+    """
+    body = json.dumps({"delivery": str(delivery.id), "events": delivery.events}).encode()
+    headers = {"Content-Type": "application/json", "X-Webhook-Delivery": str(delivery.id)}
+    if delivery.webhook.secret:
+        headers["X-Webhook-Signature"] = sign(delivery.webhook.secret, body)
+    request = urllib.request.Request(delivery.webhook.url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=settings.WEBHOOK_TIMEOUT_SECONDS) as response:
+            return response.status, ""
+    except urllib.error.HTTPError as e:
+        return e.code, f"HTTP {e.code}"
+    except (urllib.error.URLError, OSError) as e:
+        return None, str(getattr(e, "reason", e))
+
+def retry_delay(attempts):
+    """
+    Seconds before the next attempt, doubling from WEBHOOK_RETRY_BASE_SECONDS up to WEBHOOK_RETRY_MAX_SECONDS
+    """
+    return min(settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX_SECONDS)
+
+def deliver_due(limit):
+    """
+    Send up to limit pending deliveries that are due, WEBHOOK_CONCURRENCY at a time. Return the
+    number of deliveries accepted by their webhook
+    """
+    now = timezone.now()
+    deliveries = list(
+        WebhookDelivery.objects.filter(status="pending", next_attempt_at__lte=now)
+        .select_related("webhook")
+        .order_by("next_attempt_at")[:limit]
+    )
+    if not deliveries:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=settings.WEBHOOK_CONCURRENCY) as executor:
+        results = list(executor.map(send, deliveries))
+
+    delivered = 0
+    now = timezone.now()
+    for delivery, (status, error) in zip(deliveries, results):
+        delivery.attempts += 1
+        delivery.response_status = status
+        delivery.last_error = error
+        if status is not None and 200 <= status < 300:
+            delivery.status = "delivered"
+            delivery.delivered_at = now
+            delivered += 1
+        elif delivery.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            delivery.status = "failed"
+            logger.warning("Gave up on delivery %s to webhook %s: %s", delivery.id, delivery.webhook, error)
+        else:
+            delivery.next_attempt_at = now + timedelta(seconds=retry_delay(delivery.attempts))
+    WebhookDelivery.objects.bulk_update(
+        deliveries, ["attempts", "response_status", "last_error", "status", "delivered_at", "next_attempt_at"]
+    )
+    return delivered
+
+def relay_events():
+    """
+    Dispatch every pending event and send the due deliveries. Return (events, delivered), None when
+    another relay is running
+    """
+    lock = cache.lock(OUTBOX_LOCK_KEY, timeout=settings.OUTBOX_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        events = 0
+        while dispatched := dispatch_events(settings.OUTBOX_BATCH_SIZE):
+            events += dispatched
+        return events, deliver_due(settings.WEBHOOK_DELIVERY_BATCH_SIZE)
+    finally:
+        lock.release()
@@ -0,0 +1,8 @@
+from rest_framework.parsers import JSONParser
+
+
+class PlainTextJSONParser(JSONParser):
+    """
+    Parse JSON sent as text/plain, which is what navigator.sendBeacon uses for string payloads
+    """
+    media_type = "text/plain"
@@ -0,0 +1,293 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.html import strip_tags
+
+from .models import Post, PostVector, RelatedPost, RelatedTerm
+
+# The neighbours of every post are stored in RelatedPost, its tf-idf vector in PostVector and the idf
+# of every term in RelatedTerm, so saving a post only vectorizes that post. The idf is the one of the
+# last full build until the next one. The related posts of each post are also cached without expiry
+# under their own key, so the detail view reads a single small key
+RELATED_LOCK_KEY = "related_posts:lock"
+
+TOKEN_RE = re.compile(r"[^\W\d_]{3,}")
+STOP_WORDS = frozenset("""
+    the and for are but not you all any can had her was one our out has his how its may new now
+    who did get let put say she too use that this with from have they will your what when which
+    their there been were into more than then them these some would could about after other
+    los las del por con una para que como mas sus entre sin sobre este esta estos estas pero
+""".split())
+
+# Keywords and titles describe a post better than its body, so they count several times
+FIELD_WEIGHTS = (("keywords", 3), ("title", 2), ("description", 1), ("content", 1))
+
+
+def tokenize(post):
+    tokens = []
+    for field, weight in FIELD_WEIGHTS:
+        text = strip_tags(post.get(field) or "").lower()
+        # RelatedTerm.term holds 64 characters
+        words = [word for word in TOKEN_RE.findall(text) if word not in STOP_WORDS and len(word) <= 64]
+        tokens.extend(words * weight)
+    return tokens
+
+def term_frequencies(documents, vocabulary, grow=False):
+    """
+    Build the sparse matrix of sublinear term frequencies (1 + log count) of tokenized documents
+    """
+    rows, cols, data = [], [], []
+    for row, tokens in enumerate(documents):
+        for term, count in Counter(tokens).items():
+            col = vocabulary.get(term)
+            if col is None:
+                if not grow:
+                    continue
+                col = vocabulary[term] = len(vocabulary)
+            rows.append(row)
+            cols.append(col)
+            data.append(1 + math.log(count))
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(documents), len(vocabulary)), dtype=np.float64)
+
+def vector_matrix(vectors, vocabulary):
+    """
+    Build the sparse matrix of stored {term: weight} vectors, adding their terms to the vocabulary
+    """
+    rows, cols, data = [], [], []
+    for row, weights in enumerate(vectors):
+        for term, weight in weights.items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(weight)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(vectors), len(vocabulary)), dtype=np.float64)
+
+def row_weights(matrix, row, terms):
+    start, end = matrix.indptr[row], matrix.indptr[row + 1]
+    return {terms[col]: float(weight) for col, weight in zip(matrix.indices[start:end], matrix.data[start:end])}
+
+def normalize(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+def top_neighbours(scores, own_row, k):
+    """
+    Return the (row, score) pairs of the k highest positive scores, leaving out the post itself
+    """
+    scores = scores.copy()
+    if own_row is not None:
+        scores[own_row] = 0
+    k = min(k, len(scores))
+    if k == 0:
+        return []
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [(int(row), float(scores[row])) for row in candidates if scores[row] > 0]
+
+def published_posts(ids=None):
+    posts = Post.post_published.all()
+    if ids is not None:
+        posts = posts.filter(id__in=ids)
+    return list(posts.values("id", "title", "description", "slug", "thumbnail", "keywords", "content"))
+
+def post_cards(ids):
+    """
+    {post id: card} of the published posts among ids
+    """
+    posts = Post.post_published.filter(id__in=ids).values("id", "title", "description", "slug", "thumbnail")
+    return {str(post["id"]): post_card(post) for post in posts}
+
+def post_card(post):
+    return {
+        "id": str(post["id"]),
+        "title": post["title"],
+        "description": post["description"],
+        "slug": post["slug"],
+        "thumbnail": f"{settings.MEDIA_URL}{post['thumbnail']}" if post["thumbnail"] else None,
+    }
+
+
+def tfidf_matrix(posts):
+    """
+    Normalized tf-idf vectors of the posts, one row per post, with their vocabulary and idf
+    """
+    vocabulary = {}
+    tf = term_frequencies([tokenize(post) for post in posts], vocabulary, grow=True)
+
+    # Smoothed inverse document frequency
+    document_frequency = np.bincount(tf.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(posts)) / (1 + document_frequency)) + 1
+    return normalize(tf @ sparse.diags(idf)), vocabulary, idf
+
+def tfidf_vector(post, documents):
+    """
+    Normalized {term: weight} of a post with the stored idf, a term of no indexed post counts as
+    appearing in this post only
+    """
+    counts = Counter(tokenize(post))
+    idf = dict(RelatedTerm.objects.filter(term__in=counts).values_list("term", "idf"))
+    unseen = math.log((1 + documents) / 2) + 1
+    weights = {term: (1 + math.log(count)) * idf.get(term, unseen) for term, count in counts.items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1
+    return {term: weight / norm for term, weight in weights.items()}
+
+def stored_neighbours(post_ids=None):
+    """
+    {post id: [(related id, score)]} of the posts in RelatedPost, best first
+    """
+    rows = RelatedPost.objects.order_by("post_id", "-score")
+    if post_ids is not None:
+        rows = rows.filter(post_id__in=post_ids)
+    neighbours = {}
+    for post_id, related_id, score in rows.values_list("post_id", "related_id", "score"):
+        neighbours.setdefault(str(post_id), []).append((str(related_id), score))
+    return neighbours
+
+
+def build_related_index(k=None, chunk_size=500):
+    """
+    Compute the tf-idf vectors of every published post and store them with their top-k cosine
+    neighbours, return {post id: [(related id, score)]}
+    """
+    k = k or settings.RELATED_POSTS_COUNT
+    posts = published_posts()
+    matrix, vocabulary, idf = tfidf_matrix(posts)
+
+    # Cosine similarities are computed a block of rows at a time to bound memory
+    neighbours = {}
+    ids = [str(post["id"]) for post in posts]
+    for start in range(0, len(posts), chunk_size):
+        block = (matrix[start:start + chunk_size] @ matrix.T).toarray()
+        for offset, scores in enumerate(block):
+            row = start + offset
+            neighbours[ids[row]] = [(ids[other], score) for other, score in top_neighbours(scores, row, k)]
+
+    terms = list(vocabulary)
+    with transaction.atomic():
+        RelatedTerm.objects.all().delete()
+        RelatedTerm.objects.bulk_create(
+            [RelatedTerm(term=term, idf=float(weight)) for term, weight in zip(terms, idf)], batch_size=chunk_size
+        )
+        PostVector.objects.all().delete()
+        PostVector.objects.bulk_create(
+            [PostVector(post_id=post_id, weights=row_weights(matrix, row, terms)) for row, post_id in enumerate(ids)],
+            batch_size=chunk_size,
+        )
+
+    previous = set(RelatedPost.objects.values_list("post_id", flat=True).distinct())
+    removed = {str(post_id) for post_id in previous} - set(ids)
+    cards = {str(post["id"]): post_card(post) for post in posts}
+    save_related_index(neighbours, changed=ids, removed=removed, cards=cards)
+    return neighbours
+
+def update_related_index(post_id, k=None):
+    """
+    Refresh the neighbours touched by a single post being saved or deleted: its own, and those of
+    the posts it enters or leaves the top-k of. Only that post is vectorized, the others are scored
+    with their stored vectors
+    """
+    if not PostVector.objects.exists():
+        return build_related_index(k)
+
+    k = k or settings.RELATED_POSTS_COUNT
+    post_id = str(post_id)
+    vectors = {
+        str(other_id): weights
+        for other_id, weights in PostVector.objects.exclude(post_id=post_id).values_list("post_id", "weights")
+    }
+    # An unpublished or deleted post has no vector and no neighbours anymore
+    post = published_posts([post_id])
+    if post:
+        vectors[post_id] = tfidf_vector(post[0], documents=len(vectors))
+        PostVector.objects.update_or_create(post_id=post_id, defaults={"weights": vectors[post_id]})
+    else:
+        PostVector.objects.filter(post_id=post_id).delete()
+
+    ids = list(vectors)
+    rows = {other_id: row for row, other_id in enumerate(ids)}
+    row = rows.get(post_id)
+    matrix = vector_matrix(list(vectors.values()), {})
+    neighbours = stored_neighbours()
+
+    changed = {post_id}
+    if row is not None:
+        scores = (matrix @ matrix[row].T).toarray().ravel()
+        neighbours[post_id] = [(ids[other], score) for other, score in top_neighbours(scores, row, k)]
+    else:
+        scores = np.zeros(len(ids))
+        neighbours.pop(post_id, None)
+
+    for other_id, other_row in rows.items():
+        if other_id == post_id:
+            continue
+        related = neighbours.get(other_id, [])
+        related_ids = [related_id for related_id, _ in related]
+        if post_id in related_ids:
+            # The post was a neighbour, its score changed or it is gone: recompute the whole list
+            other_scores = (matrix @ matrix[other_row].T).toarray().ravel()
+            neighbours[other_id] = [(ids[i], score) for i, score in top_neighbours(other_scores, other_row, k)]
+            changed.add(other_id)
+        elif scores[other_row] > 0 and (len(related) < k or scores[other_row] > related[-1][1]):
+            related = sorted([*related, (post_id, float(scores[other_row]))], key=lambda item: -item[1])
+            neighbours[other_id] = related[:k]
+            changed.add(other_id)
+
+    save_related_index(neighbours, changed=changed, removed=[] if row is not None else [post_id])
+    return neighbours
+
+def related_entries(neighbours, post_ids, cards):
+    """
+    post_related:{id} cache entries of the posts, the neighbours without a card (unpublished) are left out
+    """
+    return {
+        f"post_related:{post_id}": [
+            {**cards[related_id], "score": round(score, 4)}
+            for related_id, score in neighbours.get(str(post_id), [])
+            if related_id in cards
+        ]
+        for post_id in post_ids
+    }
+
+def save_related_index(neighbours, changed, removed, cards=None):
+    """
+    Replace the stored neighbours of the changed posts and their cached related posts
+    """
+    changed = [post_id for post_id in changed if post_id in neighbours]
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id__in=[*changed, *removed]).delete()
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post_id=post_id, related_id=related_id, score=score)
+            for post_id in changed
+            for related_id, score in neighbours[post_id]
+        ])
+    if cards is None:
+        cards = post_cards({related_id for post_id in changed for related_id, _ in neighbours[post_id]})
+    cache.set_many(related_entries(neighbours, changed, cards), timeout=None)
+    if removed:
+        cache.delete_many([f"post_related:{post_id}" for post_id in removed])
+
+def get_related_posts(post_id):
+    return get_many_related_posts([post_id])[post_id]
+
+def get_many_related_posts(post_ids):
+    """
+    {post id: related posts} of many posts in one cache round trip, the ones missing from the cache
+    (flushed or evicted) are read from RelatedPost and cached again
+    """
+    keys = {post_id: f"post_related:{post_id}" for post_id in post_ids}
+    related = cache.get_many(keys.values())
+    missing = [post_id for post_id, key in keys.items() if key not in related]
+    if missing:
+        neighbours = stored_neighbours(missing)
+        cards = post_cards({related_id for entries in neighbours.values() for related_id, _ in entries})
+        fresh = related_entries(neighbours, missing, cards)
+        cache.set_many(fresh, timeout=None)
+        related.update(fresh)
+    return {post_id: related.get(key, []) for post_id, key in keys.items()}
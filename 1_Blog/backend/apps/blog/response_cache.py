@@ -0,0 +1,102 @@
+import gzip
+from collections import defaultdict
+
+import brotli
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework_api.serializers import APIResponseSerializer
+
+from core.renderers import FastJSONRenderer
+
+# Cached responses are stored as {encoding: bytes}. Bodies worth compressing are only kept
+# compressed (the rare client without gzip support gets a decompressed copy), small bodies
+# are kept as they are under "identity".
+PREFERRED_ENCODINGS = ("br", "gzip")
+
+
+def post_detail_key(slug, suffix=""):
+    # v2: the rendered {encoding: bytes} body, the plain post_detail:{slug} keys held serialized dicts
+    return f"post_detail:v2:{slug}{suffix}"
+
+# Sets of the cached keys a post change cannot derive from the slug: the ?fields= shapes of each post
+# and every list page. The purge drops their members without walking the keyspace
+POST_LIST_KEYS = "cache_keys:post_list"
+
+def post_shapes_key(slug):
+    return f"cache_keys:post_shapes:{slug}"
+
+def cache_tracked(entries, trackers, timeout):
+    """
+    cache.set_many(entries) adding the keys of trackers ({key: set}) to their set, in one round trip
+    """
+    pipe = cache.client.get_client(write=True).pipeline(transaction=False)
+    for key, value in entries.items():
+        cache.client.set(key, value, timeout, client=pipe)
+    tracked = defaultdict(list)
+    for key, tracker in trackers.items():
+        tracked[cache.make_key(tracker)].append(key)
+    for tracker, keys in tracked.items():
+        pipe.sadd(tracker, *keys)
+        pipe.expire(tracker, timeout)
+    pipe.execute()
+
+def pop_tracked_keys(trackers):
+    """
+    Empty the sets, return the keys they held
+    """
+    pipe = cache.client.get_client(write=True).pipeline()
+    for tracker in trackers:
+        pipe.smembers(cache.make_key(tracker))
+        pipe.delete(cache.make_key(tracker))
+    return [key.decode() for members in pipe.execute()[::2] for key in members]
+
+
+def render_api_response(results):
+    """
+    Render the same body as StandardAPIView.response(results)
+    """
+    return FastJSONRenderer().render(APIResponseSerializer({"success": True, "status": 200, "results": results}).data)
+
+def encode_body(body):
+    if len(body) < settings.RESPONSE_CACHE_COMPRESS_MIN_BYTES:
+        return {"identity": body}
+
+    return {
+        "br": brotli.compress(body, quality=settings.RESPONSE_CACHE_BROTLI_QUALITY),
+        "gzip": gzip.compress(body, compresslevel=6),
+    }
+
+def decode_body(encoded):
+    if "identity" in encoded:
+        return encoded["identity"]
+    return gzip.decompress(encoded["gzip"])
+
+def accepted_encodings(request):
+    encodings = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = item.strip().partition(";")
+        # Encodings explicitly refused with q=0 are left out
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+def encoded_response(request, encoded, status=200, content_type="application/json"):
+    """
+    Serve a cached body as is, in the best encoding the client accepts
+    """
+    accepted = accepted_encodings(request)
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding in encoded and encoding in accepted:
+            response = HttpResponse(encoded[encoding], content_type=content_type, status=status)
+            response["Content-Encoding"] = encoding
+            break
+    else:
+        response = HttpResponse(decode_body(encoded), content_type=content_type, status=status)
+
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
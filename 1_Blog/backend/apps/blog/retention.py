@@ -0,0 +1,169 @@
+import re
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .models import PostViews
+
+
+def month_start(date):
+    return datetime(date.year, date.month, 1, tzinfo=dt_timezone.utc)
+
+def next_month(date):
+    return datetime(date.year + date.month // 12, date.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def prune_post_views(before, batch_size=5000, sleep=0, dry_run=False, progress=None):
+    """
+    Delete the PostViews rows created before `before` in small batches.
+    Every batch runs in its own short transaction so the table is never locked for long.
+    The views are already counted in PostAnalytics and the analytics rollups when they are created.
+    """
+    queryset = PostViews.objects.filter(created_at__lt=before)
+
+    if dry_run:
+        total = queryset.count()
+        if progress:
+            progress(total, dry_run=True)
+        return total
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by("created_at").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            count, _ = PostViews.objects.filter(id__in=ids).delete()
+
+        deleted += count
+        if progress:
+            progress(deleted)
+        if sleep:
+            time.sleep(sleep)
+
+    return deleted
+
+
+# Monthly partitioning of PostViews (PostgreSQL only)
+
+PARTITION_SUFFIX = re.compile(r"_p(\d{4})_(\d{2})$")
+
+def partition_name(month):
+    return f"{PostViews._meta.db_table}_p{month:%Y_%m}"
+
+def post_views_is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [PostViews._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+def list_post_views_partitions():
+    """
+    Return the monthly partitions of PostViews as a list of (name, month start)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s ORDER BY c.relname",
+            [PostViews._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_SUFFIX.search(name)
+        # The default partition does not follow the naming scheme and is never dropped
+        if match:
+            partitions.append((name, datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)))
+    return partitions
+
+def create_post_views_partitions(start, end):
+    """
+    Create the monthly partitions covering start..end that do not exist yet
+    """
+    quote = connection.ops.quote_name
+    table = PostViews._meta.db_table
+    created = []
+
+    month = month_start(start)
+    with connection.cursor() as cursor:
+        while month <= end:
+            name = partition_name(month)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(table)} "
+                "FOR VALUES FROM (%s) TO (%s)",
+                [month, next_month(month)],
+            )
+            created.append(name)
+            month = next_month(month)
+    return created
+
+def drop_post_views_partitions(before, dry_run=False, progress=None):
+    """
+    Drop the monthly partitions that only hold rows created before `before`
+    """
+    quote = connection.ops.quote_name
+    table = PostViews._meta.db_table
+    dropped = []
+
+    for name, month in list_post_views_partitions():
+        if next_month(month) > before:
+            continue
+
+        if not dry_run:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}")
+                cursor.execute(f"DROP TABLE {quote(name)}")
+        dropped.append(name)
+        if progress:
+            progress(name, dry_run=dry_run)
+
+    return dropped
+
+def partition_post_views(months_ahead=2):
+    """
+    Convert PostViews into a table partitioned by month on created_at, copying the existing rows.
+    PostgreSQL requires the primary key of a partitioned table to include the partition key,
+    so the primary key becomes (id, created_at); ids are still unique uuids.
+    """
+    quote = connection.ops.quote_name
+    table = PostViews._meta.db_table
+    old_table = f"{table}_unpartitioned"
+    post_table = PostViews._meta.get_field("post").related_model._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Run pending deferred foreign key checks now, the old table can not be dropped while they are queued
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(old_table)} INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD FOREIGN KEY (post_id) REFERENCES {quote(post_table)} (id) "
+            "DEFERRABLE INITIALLY DEFERRED"
+        )
+        cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+
+        cursor.execute(f"SELECT MIN(created_at) FROM {quote(old_table)}")
+        oldest = cursor.fetchone()[0] or datetime.now(dt_timezone.utc)
+        newest = datetime.now(dt_timezone.utc)
+        for _ in range(months_ahead):
+            newest = next_month(newest)
+        create_post_views_partitions(oldest, newest)
+
+        cursor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}")
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        # The indexes of the old table were dropped with it, recreate the ones declared on the model
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for index in PostViews._meta.indexes:
+                schema_editor.add_index(PostViews, index)
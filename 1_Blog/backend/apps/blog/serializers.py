@@ -3,6 +3,16 @@ from rest_framework import serializers
 from .models import Post, Category, Heading, PostViews
 
 
+class SparseFieldsMixin:
+    """
+    Accept a fields argument keeping only those fields, see fast_serializers.resolve_fields()
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -23,7 +33,7 @@ class PostViewsSerializer(serializers.ModelSerializer):
         model = PostViews
         fields = '__all__'
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer()
     headings = HeadingSerializer(many=True)
     post_views = PostViewsSerializer(many=True)
@@ -34,9 +44,11 @@ class PostSerializer(serializers.ModelSerializer):
         fields = '__all__'
     
     def get_view_count(self, obj):
-        return obj.post_views.count()
+        # PostViews rows are pruned after the retention window, the lifetime total lives in PostAnalytics
+        analytics = next(iter(obj.post_analytics.all()), None)
+        return analytics.views if analytics else 0
 
-class PostListSerializer(serializers.ModelSerializer):
+class PostListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategoryListSerializer()
     headings = HeadingSerializer(many=True)
     post_views = PostViewsSerializer(many=True)
@@ -47,4 +59,6 @@ class PostListSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'slug', 'category', 'thumbnail', 'headings', 'post_views', 'view_count',]
     
     def get_view_count(self, obj):
-        return obj.post_views.count()
+        # PostViews rows are pruned after the retention window, the lifetime total lives in PostAnalytics
+        analytics = next(iter(obj.post_analytics.all()), None)
+        return analytics.views if analytics else 0
@@ -0,0 +1,177 @@
+import hashlib
+import math
+import re
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.db.models.functions import TruncMonth
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from core.db_routers import use_primary
+from core.instrumentation import timed, record_cache_lookup
+
+from .models import Post
+from .response_cache import cache_tracked, encode_body, encoded_response, pop_tracked_keys
+
+# Posts are split in one sitemap shard per creation month, so saving a post only renders its
+# month again. A month above SITEMAP_SHARD_MAX_URLS is split in numbered parts ("YYYY-MM",
+# "YYYY-MM-2", ...). Every document is cached as {"etag", "body": encoded body} until a save
+# touches it, the parts of a month are tracked in one set to be dropped together
+SITEMAP_INDEX_KEY = "sitemap:index"
+SITEMAP_SHARD_KEY = "sitemap:shard:{}"
+SITEMAP_PARTS_KEY = "sitemap:parts:{}"
+FEED_KEY = "feed:{}"
+
+SITEMAP_CONTENT_TYPE = "application/xml"
+FEED_FORMATS = {
+    "rss": (Rss201rev2Feed, "application/rss+xml"),
+    "atom": (Atom1Feed, "application/atom+xml"),
+}
+SHARD_PATTERN = re.compile(r"(\d{4})-(0[1-9]|1[0-2])(?:-([2-9]|[1-9]\d+))?")
+
+
+def shard_name(created_at):
+    return timezone.localtime(created_at).strftime("%Y-%m")
+
+def part_name(month, part):
+    return month if part == 1 else f"{month}-{part}"
+
+def shard_bounds(shard):
+    """
+    (start, end, part) of a shard name, None when it is not a "YYYY-MM" month or one of its parts
+    """
+    match = SHARD_PATTERN.fullmatch(shard)
+    if not match:
+        return None
+    year, month = int(match[1]), int(match[2])
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end, int(match[3] or 1)
+
+def shard_parts_key(shard):
+    return SITEMAP_PARTS_KEY.format(shard[:7])
+
+def site_url(path):
+    return settings.SITE_URL.rstrip("/") + path
+
+def post_url(slug):
+    return site_url(settings.SITE_POST_PATH.format(slug=slug))
+
+
+def render_sitemap_index():
+    shards = (
+        Post.post_published.annotate(shard=TruncMonth("created_at"))
+        .order_by("shard")
+        .values("shard")
+        .annotate(lastmod=Max("updated_at"), urls=Count("id"))
+    )
+    entries = "".join(
+        f"<sitemap><loc>{escape(site_url(settings.SITEMAP_SHARD_PATH.format(shard=part_name(shard_name(row['shard']), part))))}</loc>"
+        f"<lastmod>{row['lastmod'].isoformat()}</lastmod></sitemap>"
+        for row in shards
+        for part in range(1, math.ceil(row["urls"] / settings.SITEMAP_SHARD_MAX_URLS) + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>'
+    ).encode()
+
+def render_sitemap_shard(shard):
+    start, end, part = shard_bounds(shard)
+    limit = settings.SITEMAP_SHARD_MAX_URLS
+    rows = (
+        Post.post_published.filter(created_at__gte=start, created_at__lt=end)
+        .order_by("created_at", "id")
+        .values_list("slug", "updated_at")[(part - 1) * limit:part * limit]
+    )
+    entries = "".join(
+        f"<url><loc>{escape(post_url(slug))}</loc><lastmod>{updated_at.isoformat()}</lastmod></url>"
+        for slug, updated_at in rows
+    )
+    if not entries:
+        return None
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>'
+    ).encode()
+
+def render_feed(feed_format):
+    feed_class = FEED_FORMATS[feed_format][0]
+    feed = feed_class(
+        title=settings.FEED_TITLE,
+        link=site_url("/"),
+        description=settings.FEED_DESCRIPTION,
+        feed_url=site_url(settings.FEED_PATH.format(format=feed_format)),
+        language=settings.LANGUAGE_CODE,
+    )
+    rows = (
+        Post.post_published.order_by("-created_at")
+        .values_list("slug", "title", "description", "created_at", "updated_at")[:settings.FEED_ITEMS]
+    )
+    for slug, title, description, created_at, updated_at in rows:
+        feed.add_item(
+            title=title,
+            link=post_url(slug),
+            description=description,
+            unique_id=post_url(slug),
+            pubdate=created_at,
+            updateddate=updated_at,
+        )
+    return feed.writeString("utf-8").encode()
+
+
+def cached_document(key, render, tracker=None):
+    """
+    Return the cached {"etag", "body"} of a document, rendering it on a miss. None when there is
+    nothing to render. The key is added to the tracker set when one is given
+    """
+    document = cache.get(key)
+    record_cache_lookup(document is not None)
+    if document is None:
+        # Cached for SITEMAP_CACHE_SECONDS, a lagging replica would keep a change out of it that long
+        with timed("serialize"), use_primary():
+            body = render()
+            if body is None:
+                return None
+            # Weak, the same document is served in several encodings
+            document = {"etag": f'W/"{hashlib.sha1(body).hexdigest()}"', "body": encode_body(body)}
+        cache_tracked({key: document}, {key: tracker} if tracker else {}, timeout=settings.SITEMAP_CACHE_SECONDS)
+    return document
+
+def document_response(request, document, content_type):
+    """
+    Serve a cached document, or a 304 when the client already has it
+    """
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if "*" in etags or document["etag"] in etags:
+        response = HttpResponseNotModified()
+        patch_vary_headers(response, ("Accept-Encoding",))
+    else:
+        response = encoded_response(request, document["body"], content_type=content_type)
+    response["ETag"] = document["etag"]
+    response["Cache-Control"] = f"public, max-age={settings.SITEMAP_MAX_AGE}"
+    return response
+
+def invalidate_post_documents(post):
+    """
+    Drop the documents listing a post: every part of its sitemap shard, the sitemap index and the feeds
+    """
+    month = shard_name(post.created_at)
+    cache.delete_many([
+        SITEMAP_INDEX_KEY,
+        SITEMAP_SHARD_KEY.format(month),
+        *pop_tracked_keys([shard_parts_key(month)]),
+        *(FEED_KEY.format(feed_format) for feed_format in FEED_FORMATS),
+    ])
+
+def invalidate_all_documents():
+    # For bulk loads that bypass the save signals
+    cache.delete_pattern("sitemap:*")
+    cache.delete_many([FEED_KEY.format(feed_format) for feed_format in FEED_FORMATS])
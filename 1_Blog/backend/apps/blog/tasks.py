@@ -2,60 +2,295 @@ from celery import shared_task
 
 import logging
 
-import redis
+from datetime import timedelta
 
 from django.conf import settings
-from .models import PostAnalytics, Post
+from django.core.cache import cache
+from django.utils import timezone
+from .models import PostAnalytics, Post, PostAnalyticsRollup, PostTombstone, PostViews
+from .related import build_related_index, update_related_index, RELATED_LOCK_KEY
+from .trending import record_trending_activity, rescale_trending_scores
+from .flush import buffer_counters, register_flush_job, run_due_flushes
+from .outbox import relay_events
+from .warmup import warm_blog_cache as warm_cache
+from core.redis_clients import get_redis
+from .retention import (
+    post_views_is_partitioned,
+    create_post_views_partitions,
+    drop_post_views_partitions,
+    prune_post_views,
+)
 
 logger = logging.getLogger(__name__)
 
-redis_client = redis.Redis(host=settings.REDIS_HOST, port=6379, db=0)
+redis_client = get_redis("analytics")
 
 
-@shared_task
+# The analytics tasks are fire and forget, they skip the result backend (one row per page view
+# otherwise) and re-raise so their failures reach the task metrics of core.task_metrics
+@shared_task(ignore_result=True)
 def increment_post_impressions(post_id):
     """
     Increment the number of impressions for an associated post
     """
     try:
-        analytics, created = PostAnalytics.objects.get_or_create(post__id=post_id)
-        analytics.increment_impressions()
-        analytics.save()
-    except PostAnalytics.DoesNotExist:
-        logger.error("Post analytics does not exist for post id: %s", post_id)
+        slug = Post.objects.values_list("slug", flat=True).get(id=post_id)
+        buffer_counters("impressions", {post_id: 1})
+        record_trending_activity([(slug, "impression")])
+    except Post.DoesNotExist:
+        logger.error("Post does not exist for post id: %s", post_id)
     except Exception as e:
         logger.error("An unexpected error occurred while updating post analytics: %s", str(e))
+        raise
 
-@shared_task
+@shared_task(ignore_result=True)
 def increment_post_views(slug, ip_address):
     """
     Increment the views of a post
     """
     try:
-        post = Post.objects.get(slug=slug)
-        post_analytics, _ = PostAnalytics.objects.get_or_create(post=post)
-        post_analytics.increment_views(ip_address)
-        post_analytics.save()
+        post = Post.objects.only("id").get(slug=slug)
+        # Only the first view of an ip address counts, the counter is buffered like the impressions
+        if not PostViews.objects.filter(post=post, ip_address=ip_address).exists():
+            PostViews.objects.create(post=post, ip_address=ip_address)
+            buffer_counters("views", {post.id: 1})
+            record_trending_activity([(slug, "view")])
     except Exception as e:
         logger.info(f"Error incrementing views for Post slug {slug}: {str(e)}")
+        raise
 
-@shared_task
+def sync_counters_to_db(name, batch_size=500):
+    """
+    Add the post:{name}:{post id} counters buffered in redis to the analytics and rollups of their
+    posts, batch_size posts at a time. name is a counter field of PostAnalytics
+    """
+    # SCAN walks the whole keyspace without blocking redis, large pages keep the round trips low
+    keys = list(redis_client.scan_iter(f"post:{name}:*", count=1000))
+    for start in range(0, len(keys), batch_size):
+        flush_counters(name, keys[start:start + batch_size])
+
+def flush_counters(name, keys):
+    # GETDEL reads and resets every counter atomically, events arriving meanwhile start a new one
+    # (and a key SCAN returned twice reads None the second time)
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.getdel(key)
+    buffered = {
+        key.decode("utf-8").split(":")[-1]: int(value)
+        for key, value in zip(keys, pipe.execute())
+        if value is not None
+    }
+    
+    # Added in the UPDATE itself, counters written meanwhile are not overwritten
+    rows = [{"post_id": post_id, name: amount} for post_id, amount in buffered.items()]
+    known = PostAnalytics.objects.add_counts(rows)
+    if len(known) < len(buffered):
+        logger.warning("Dropping %s for unknown post ids: %s", name, ", ".join(set(buffered) - known))
+    PostAnalyticsRollup.objects.add_counts([row for row in rows if row["post_id"] in known])
+
+@shared_task(ignore_result=True)
 def sync_impressions_to_db():
     """
     Sync the number of impressions for all posts from redis to the database
     """
-    keys = redis_client.keys("post:impressions:*")
     try:
+        sync_counters_to_db("impressions")
+    except Exception as e:
+        logger.error("An unexpected error occurred while syncing impressions to database: %s", str(e))
+        raise
+
+@shared_task(ignore_result=True)
+def sync_clicks_to_db():
+    """
+    Sync the number of clicks for all posts from redis to the database
+    """
+    try:
+        sync_counters_to_db("clicks")
+    except Exception as e:
+        logger.error("An unexpected error occurred while syncing clicks to database: %s", str(e))
+        raise
+
+@shared_task(ignore_result=True)
+def sync_views_to_db():
+    """
+    Sync the number of views for all posts from redis to the database
+    """
+    try:
+        sync_counters_to_db("views")
+    except Exception as e:
+        logger.error("An unexpected error occurred while syncing views to database: %s", str(e))
+        raise
+
+@shared_task(ignore_result=True)
+def sync_time_on_page_to_db():
+    """
+    Sync the buffered dwell time samples for all posts from redis into avg_time_on_page
+    """
+    # SCAN walks the whole keyspace, large pages keep the round trips low next to the cached responses
+    keys = list(redis_client.scan_iter("post:dwell:*", count=1000))
+    if not keys:
+        return
+    
+    try:
+        # Read and reset every buffer atomically so samples arriving meanwhile are not lost
+        pipe = redis_client.pipeline(transaction=True)
         for key in keys:
-            post_id = key.decode("utf-8").split(":")[-1]
-            impressions = int(redis_client.get(key))
-            
-            analytics, _ = PostAnalytics.objects.get_or_create(post__id=post_id)
-            analytics.impressions += impressions
-            analytics.save()
-            
-            analytics.update_click_through_rate()
-            
-            redis_client.delete(key)
-    except Exception as e:
-        logger.error("An unexpected error occurred while syncing impressions to database: %s", str(e))
\ No newline at end of file
+            pipe.hgetall(key)
+            pipe.delete(key)
+        results = pipe.execute()[::2]
+        
+        buffered = {}
+        for key, values in zip(keys, results):
+            if not values:
+                continue
+            slug = key.decode("utf-8").split(":", 2)[-1]
+            buffered[slug] = (float(values[b"sum"]), int(values[b"count"]))
+        
+        analytics_by_slug = {
+            analytics.post.slug: analytics
+            for analytics in PostAnalytics.objects.select_related("post").filter(post__slug__in=buffered)
+        }
+        rollups = []
+        for slug, (total_seconds, samples) in buffered.items():
+            analytics = analytics_by_slug.get(slug)
+            if analytics is None:
+                logger.warning("Dropping dwell time samples for unknown post slug: %s", slug)
+                continue
+            analytics.merge_time_on_page(total_seconds, samples)
+            rollups.append({
+                "post_id": analytics.post_id,
+                "dwell_sum": total_seconds,
+                "dwell_count": samples,
+            })
+        
+        PostAnalytics.objects.bulk_update(
+            analytics_by_slug.values(), ["avg_time_on_page", "time_on_page_samples"], batch_size=500
+        )
+        PostAnalyticsRollup.objects.add_counts(rollups)
+    except Exception as e:
+        logger.error("An unexpected error occurred while syncing dwell time to database: %s", str(e))
+        raise
+
+register_flush_job("impressions", sync_impressions_to_db)
+register_flush_job("clicks", sync_clicks_to_db)
+register_flush_job("views", sync_views_to_db)
+register_flush_job("dwell", sync_time_on_page_to_db)
+
+@shared_task(ignore_result=True)
+def flush_analytics_buffers():
+    """
+    Flush the analytics buffers whose backlog waited long enough, run every ANALYTICS_FLUSH_TICK_SECONDS
+    """
+    flushed = run_due_flushes()
+    if flushed:
+        logger.info("Flushed the %s analytics buffers", ", ".join(flushed))
+
+@shared_task(ignore_result=True)
+def relay_outbox():
+    """
+    Deliver the outbox events to the webhooks, started when a change commits and every OUTBOX_RELAY_INTERVAL
+    """
+    try:
+        relayed = relay_events()
+        if relayed and any(relayed):
+            logger.info("Relayed %s outbox events, %s webhook deliveries accepted", *relayed)
+    except Exception as e:
+        logger.error("An unexpected error occurred while relaying the outbox: %s", str(e))
+        raise
+
+@shared_task(ignore_result=True)
+def warm_blog_cache(limit=None):
+    """
+    Fill the post list and post detail caches after a deploy or a redis flush
+    """
+    try:
+        report = warm_cache(limit=settings.WARMUP_MAX_POSTS if limit is None else limit)
+        logger.info(
+            "Warmed the cache of %s posts and the list of %s posts in %.1fs",
+            report["posts"], report["list_posts"], report["seconds"],
+        )
+    except Exception as e:
+        logger.error("An unexpected error occurred while warming the blog cache: %s", str(e))
+        raise
+
+@shared_task
+def compact_analytics_rollups():
+    """
+    Compact old hourly analytics rollups into daily rows, and old daily rows into monthly rows
+    """
+    now = timezone.now()
+    try:
+        hourly = PostAnalyticsRollup.objects.compact(
+            "hour", "day", before=now - timedelta(days=settings.ANALYTICS_HOURLY_ROLLUP_DAYS)
+        )
+        daily = PostAnalyticsRollup.objects.compact(
+            "day", "month", before=now - timedelta(days=settings.ANALYTICS_DAILY_ROLLUP_DAYS)
+        )
+        logger.info("Compacted %s hourly and %s daily analytics rollups", hourly, daily)
+    except Exception as e:
+        logger.error("An unexpected error occurred while compacting analytics rollups: %s", str(e))
+
+@shared_task
+def prune_old_post_views():
+    """
+    Delete the PostViews rows older than the retention window, dropping whole partitions when partitioned
+    """
+    now = timezone.now()
+    before = now - timedelta(days=settings.POST_VIEWS_RETENTION_DAYS)
+    try:
+        if post_views_is_partitioned():
+            # Keep the partitions of the next months ready so rows never land in the default partition
+            create_post_views_partitions(now, now + timedelta(days=62))
+            dropped = drop_post_views_partitions(before)
+            logger.info("Dropped %s PostViews partitions", len(dropped))
+        
+        deleted = prune_post_views(before, batch_size=settings.POST_VIEWS_PRUNE_BATCH_SIZE)
+        logger.info("Deleted %s PostViews rows older than %s", deleted, before)
+    except Exception as e:
+        logger.error("An unexpected error occurred while pruning post views: %s", str(e))
+
+@shared_task
+def prune_post_tombstones():
+    """
+    Delete the tombstones of posts deleted before the delta sync history
+    """
+    before = timezone.now() - timedelta(days=settings.DELTA_SYNC_TOMBSTONE_DAYS)
+    try:
+        deleted, _ = PostTombstone.objects.filter(deleted_at__lt=before).delete()
+        logger.info("Deleted %s post tombstones older than %s", deleted, before)
+    except Exception as e:
+        logger.error("An unexpected error occurred while pruning post tombstones: %s", str(e))
+
+@shared_task
+def rescale_trending_posts():
+    """
+    Rebase the decayed trending scores on the current time and drop the posts that went cold
+    """
+    try:
+        rescale_trending_scores()
+    except Exception as e:
+        logger.error("An unexpected error occurred while rescaling trending posts: %s", str(e))
+
+@shared_task
+def build_related_posts():
+    """
+    Rebuild the related posts index of every published post
+    """
+    try:
+        with cache.lock(RELATED_LOCK_KEY, timeout=60 * 10):
+            index = build_related_index()
+        logger.info("Built the related posts index for %s posts", len(index))
+    except Exception as e:
+        logger.error("An unexpected error occurred while building the related posts index: %s", str(e))
+
+@shared_task
+def update_related_posts(post_id):
+    """
+    Update the related posts touched by a post that was saved or deleted
+    """
+    try:
+        with cache.lock(RELATED_LOCK_KEY, timeout=60 * 10):
+            update_related_index(post_id)
+    except Exception as e:
+        logger.error("An unexpected error occurred while updating the related posts of post id %s: %s", post_id, str(e))
+
@@ -1,14 +1,69 @@
+import asyncio
+import gzip
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, TestCase, override_settings
+from django.core.management import call_command, CommandError
 from django.urls import reverse
+from django.contrib.auth.models import User
 from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
+from django.db import connection
+from django.db.models import Sum
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from .models import Category, Post, PostAnalytics, Heading
+from .models import (
+    Category, Post, PostAnalytics, Heading, PostAnalyticsRollup, PostViews, APIKey, OutboxEvent, Webhook, WebhookDelivery,
+    PostTombstone, RelatedPost, PostVector,
+)
+from .retention import (
+    prune_post_views,
+    partition_post_views,
+    post_views_is_partitioned,
+    drop_post_views_partitions,
+    partition_name,
+    month_start,
+)
+from .tasks import redis_client, sync_clicks_to_db, sync_impressions_to_db, sync_views_to_db, sync_time_on_page_to_db
+from .utils import uuid7
+from .serializers import PostListSerializer, PostSerializer
+from .fast_serializers import serialize_post_list, serialize_post_detail, resolve_fields, LIST_FIELDS, DETAIL_FIELDS
+from rest_framework.renderers import JSONRenderer
+from core.renderers import FastJSONRenderer
+from .related import build_related_index, update_related_index, get_related_posts, tokenize
+from .benchmarks import run_benchmarks, load_budgets, check_budgets
+from .api_keys import clear_api_key_cache, get_api_key, get_api_key_usage
+from .response_cache import POST_LIST_KEYS, cache_tracked, encode_body, encoded_response, post_shapes_key
+from celery.app.task import Context
+from core.metrics import METRICS_KEY, render_metrics, metrics_buffer
+from core.task_metrics import queue_latency
+from core.db_routers import ReplicaRouter, replica_scope, use_primary
+from core.redis_clients import get_redis, get_async_redis, increment_counters, probe, pipeline as redis_pipeline
+from core.profiling import PROFILES_KEY, PROFILE_DATA_KEY, list_profiles, make_profile_token
+from .flush import (
+    BACKLOG_KEY, LAST_FLUSH_KEY, FLUSH_LOCK_KEY, FLUSH_JOBS, buffer_counters, record_backlog, flush_interval, run_due_flushes,
+)
+from .sitemaps import SITEMAP_INDEX_KEY, SITEMAP_SHARD_KEY
+from .outbox import merge_events, purge_post_caches, relay_events, sign
+from .warmup import posts_by_traffic
+from .changes import encode_cursor
+from .response_cache import decode_body
+from .trending import TRENDING_KEY, TRENDING_EPOCH_KEY, record_trending_activity, rescale_trending_scores
 
 
 class CategoryModelTest(TestCase):
@@ -144,6 +199,25 @@ class PostListViewTest(TestCase):
         self.assertIsNone(data["next"])
         self.assertIsNone(data["previous"])
 
+    def test_sparse_fieldsets_are_cached_apart(self):
+        url = reverse("post-list")
+        full = self.client.get(url, HTTP_API_KEY=self.api_key).json()["results"][0]
+        
+        # Cards skip the headings, views and view count queries
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"fields": "title,slug,thumbnail,category"}, HTTP_API_KEY=self.api_key)
+        card = response.json()["results"][0]
+        self.assertEqual(list(card), ["id", "title", "slug", "category", "thumbnail"])
+        self.assertEqual(card["category"], full["category"])
+        self.assertTrue(cache.get("post_list:fields:id,title,slug,category,thumbnail"))
+        self.assertIn("headings", cache.get("post_list")[0])
+        
+        response = self.client.get(url, {"fields": "title", "include": "view_count"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(list(response.json()["results"][0]), ["id", "title", "slug", "view_count"])
+        
+        response = self.client.get(url, {"fields": "content"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class PostDetailViewTest(TestCase):
     def setUp(self):
@@ -164,6 +238,20 @@ class PostDetailViewTest(TestCase):
     def tearDown(self):
         cache.clear()
 
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_sparse_fieldset(self, mock_increment_post_views):
+        url = reverse("post-detail")
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"slug": self.post.slug, "fields": "title,content"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.json()["results"], {
+            "id": str(self.post.id), "title": "Test Post", "content": "Test content", "slug": "test-post",
+        })
+        self.assertTrue(cache.get("post_detail:v2:test-post:fields:id,title,content,slug"))
+        self.assertIsNone(cache.get("post_detail:v2:test-post"))
+        
+        response = self.client.get(url, {"slug": self.post.slug, "fields": "title", "include": "related_posts"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.json()["results"]["related_posts"], [])
+
     # For testing the increment_post_views task from Celery
     @patch("apps.blog.tasks.increment_post_views.delay")
     def test_get_post_detail_success(self, mock_increment_post_views):
@@ -202,6 +290,16 @@ class PostDetailViewTest(TestCase):
         
         mock_increment_post_views.assert_called_once_with(self.post.slug, '127.0.0.1')
     
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_entries_of_the_previous_cache_format_are_ignored(self, mock_increment_post_views):
+        # Before the rendered bodies, the same slug was cached as the serialized post
+        cache.set(f"post_detail:{self.post.slug}", {"id": str(self.post.id), "title": "Stale"})
+        
+        response = self.client.get(reverse("post-detail"), {"slug": self.post.slug}, HTTP_API_KEY=self.api_key)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"]["title"], self.post.title)
+    
     def test_get_post_detail_not_found(self):
         """
         Test to verify that a not found error is returned when the post is not found.
@@ -220,6 +318,55 @@ class PostDetailViewTest(TestCase):
         self.assertEqual(data["detail"], "Post does not exist")
 
 
+@patch("apps.blog.views.increment_post_views.delay")
+class PostBatchDetailViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        self.category = Category.objects.create(name="Batch", slug="batch")
+        self.posts = [
+            Post.objects.create(
+                title=f"Batch {i}", description="Batch", content="Batch content", slug=f"batch-{i}",
+                category=self.category, status="published",
+            )
+            for i in range(3)
+        ]
+        Heading.objects.create(post=self.posts[0], title="Intro", level=2, order=1)
+        Post.objects.create(title="Draft", description="Draft", content="Draft", slug="batch-draft", category=self.category)
+        self.url = reverse("post-batch")
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_batch_matches_the_detail_view_without_counting_views(self, delay):
+        slugs = "batch-2,batch-0,batch-draft,unknown,batch-0"
+        # The cache was cleared, the related posts are read from RelatedPost
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {"slugs": slugs}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual([post["slug"] for post in results["posts"]], ["batch-2", "batch-0"])
+        self.assertEqual(results["missing"], ["batch-draft", "unknown"])
+        
+        detail = self.client.get(reverse("post-detail"), {"slug": "batch-0"}, HTTP_API_KEY=self.api_key).json()["results"]
+        self.assertEqual(results["posts"][1], detail)
+        delay.assert_called_once()
+        
+        # The misses were cached, only the new slug is loaded, with its related posts
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {"slugs": "batch-0,batch-1,batch-2"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(len(response.json()["results"]["posts"]), 3)
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {"slugs": "batch-0,batch-1,batch-2"}, HTTP_API_KEY=self.api_key)
+
+    @override_settings(POST_BATCH_MAX_SLUGS=2)
+    def test_slugs_are_required_and_limited(self, delay):
+        self.assertEqual(self.client.get(self.url, HTTP_API_KEY=self.api_key).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"slugs": "batch-0,batch-1,batch-2"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class PostHeadingsViewTest(TestCase):
     def setUp(self):
         cache.clear()
@@ -350,9 +497,14 @@ class IncrementPostClicksViewTest(TestCase):
         
         self.assertEqual(results["clicks"], 1)
         
+        # The click is buffered until the clicks flush job runs
         from apps.blog.models import PostAnalytics
         analytics = PostAnalytics.objects.get(post=self.post)
+        self.assertEqual(analytics.clicks, 0)
+        sync_clicks_to_db()
+        analytics.refresh_from_db()
         self.assertEqual(analytics.clicks, 1)
+        self.assertEqual(PostAnalyticsRollup.objects.get(post=self.post).clicks, 1)
     
     def test_increment_post_clicks_not_found(self):
         """
@@ -372,3 +524,1597 @@ class IncrementPostClicksViewTest(TestCase):
         
         self.assertIn("detail", data)
         self.assertEqual(data["detail"], "Post does not exist")
+
+
+class SyncImpressionsTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Impressions", slug="impressions")
+        self.posts = [
+            Post.objects.create(
+                title=f"Impressions {i}", description="Test", content="Test", slug=f"impressions-{i}",
+                category=category, status="published",
+            )
+            for i in range(2)
+        ]
+        PostAnalytics.objects.filter(post=self.posts[0]).update(impressions=6, clicks=2)
+        self.keys = [f"post:impressions:{post.id}" for post in self.posts] + [f"post:impressions:{uuid.uuid4()}"]
+
+    def tearDown(self):
+        redis_client.delete(*self.keys)
+
+    def test_impressions_are_added_in_one_update_per_batch(self):
+        redis_client.mset(dict(zip(self.keys, (4, 3, 9))))
+        
+        with self.assertNumQueries(2), self.assertLogs("apps.blog.tasks", "WARNING"):
+            sync_impressions_to_db()
+        
+        analytics = PostAnalytics.objects.get(post=self.posts[0])
+        self.assertEqual((analytics.impressions, analytics.clicks, analytics.clicks_through_rate), (10, 2, 20))
+        self.assertEqual(PostAnalytics.objects.get(post=self.posts[1]).impressions, 3)
+        self.assertEqual(
+            PostAnalyticsRollup.objects.aggregate(total=Sum("impressions"))["total"], 7
+        )
+        self.assertEqual(redis_client.exists(*self.keys), 0)
+
+
+class PostDwellTimeViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        
+        self.category = Category.objects.create(name="Dwell Category", slug="dwell-category")
+        self.post = Post.objects.create(
+            title="Dwell Test Post",
+            description="Test description",
+            content="Test content",
+            slug="dwell-test-post",
+            category=self.category,
+            status="published"
+        )
+        cache.clear()
+        redis_client.delete(f"post:dwell:{self.post.slug}")
+
+    def tearDown(self):
+        redis_client.delete(f"post:dwell:{self.post.slug}")
+
+    def send_beacon(self, seconds, user_agent="Mozilla/5.0"):
+        return self.client.post(
+            reverse("post-dwell-time"),
+            data=f'{{"slug": "{self.post.slug}", "seconds": {seconds}}}',
+            content_type="text/plain;charset=UTF-8",
+            HTTP_USER_AGENT=user_agent
+        )
+
+    def test_dwell_time_is_synced_to_analytics(self):
+        """
+        Test to verify that beacons are buffered in redis and merged into avg_time_on_page.
+        """
+        self.assertEqual(self.send_beacon(10).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.send_beacon(20).status_code, status.HTTP_204_NO_CONTENT)
+        
+        sync_time_on_page_to_db()
+        
+        analytics = PostAnalytics.objects.get(post=self.post)
+        self.assertEqual(analytics.avg_time_on_page, 15)
+        self.assertEqual(analytics.time_on_page_samples, 2)
+        self.assertFalse(redis_client.exists(f"post:dwell:{self.post.slug}"))
+        
+        self.send_beacon(45)
+        sync_time_on_page_to_db()
+        
+        analytics.refresh_from_db()
+        self.assertEqual(analytics.avg_time_on_page, 25)
+        self.assertEqual(analytics.time_on_page_samples, 3)
+
+    def test_outliers_and_bots_are_dropped(self):
+        """
+        Test to verify that outliers and crawler beacons never reach redis.
+        """
+        self.send_beacon(0.2)
+        self.send_beacon(60 * 60 * 5)
+        self.send_beacon(30, user_agent="Googlebot/2.1")
+        
+        self.assertFalse(redis_client.exists(f"post:dwell:{self.post.slug}"))
+
+    def test_invalid_payload(self):
+        response = self.send_beacon('"a while"')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_only_published_slugs_are_buffered(self):
+        draft = Post.objects.create(
+            title="Dwell Draft", description="Test", content="Test", slug="dwell-draft", category=self.category
+        )
+        url = reverse("post-dwell-time")
+        
+        for slug, expected in (
+            ("dwell-draft", status.HTTP_404_NOT_FOUND),
+            ("no-such-post", status.HTTP_404_NOT_FOUND),
+            (["dwell-test-post"], status.HTTP_400_BAD_REQUEST),
+            ({"$gt": ""}, status.HTTP_400_BAD_REQUEST),
+            ("x" * 129, status.HTTP_400_BAD_REQUEST),
+        ):
+            response = self.client.post(url, {"slug": slug, "seconds": 30}, format="json", HTTP_USER_AGENT="Mozilla/5.0")
+            self.assertEqual(response.status_code, expected, slug)
+        
+        self.assertFalse(redis_client.exists(f"post:dwell:{draft.slug}", "post:dwell:no-such-post"))
+
+
+class PostAnalyticsRollupTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Rollup Category", slug="rollup-category")
+        self.post = Post.objects.create(
+            title="Rollup Test Post",
+            description="Test description",
+            content="Test content",
+            slug="rollup-test-post",
+            category=self.category,
+            status="published"
+        )
+        self.analytics = PostAnalytics.objects.get(post=self.post)
+
+    def test_flushed_counters_are_upserted_into_the_current_hour(self):
+        buffer_counters("impressions", {self.post.id: 2})
+        buffer_counters("clicks", {self.post.id: 1})
+        buffer_counters("views", {self.post.id: 1})
+        
+        sync_impressions_to_db()
+        sync_clicks_to_db()
+        sync_views_to_db()
+        
+        rollup = PostAnalyticsRollup.objects.get(post=self.post)
+        self.assertEqual(rollup.period, "hour")
+        self.assertEqual((rollup.impressions, rollup.clicks, rollup.views), (2, 1, 1))
+        self.analytics.refresh_from_db()
+        self.assertEqual((self.analytics.impressions, self.analytics.clicks, self.analytics.views), (2, 1, 1))
+        self.assertEqual(self.analytics.clicks_through_rate, 50)
+
+    def test_compaction_into_daily_rows(self):
+        day = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=30)
+        PostAnalyticsRollup.objects.add_counts([
+            {"post_id": self.post.id, "bucket": day, "views": 2},
+            {"post_id": self.post.id, "bucket": day + timedelta(hours=1), "views": 3, "impressions": 10},
+        ])
+        
+        deleted = PostAnalyticsRollup.objects.compact("hour", "day", before=timezone.now() - timedelta(days=14))
+        
+        self.assertEqual(deleted, 2)
+        daily = PostAnalyticsRollup.objects.get(post=self.post)
+        self.assertEqual(daily.period, "day")
+        self.assertEqual(daily.views, 5)
+        self.assertEqual(daily.impressions, 10)
+
+    def test_get_trend(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        PostAnalyticsRollup.objects.add_counts([
+            {"post_id": self.post.id, "bucket": hour, "impressions": 4, "clicks": 1, "dwell_sum": 30, "dwell_count": 2},
+        ])
+        
+        response = self.client.get(
+            reverse("post-analytics-trend") + f"?slug={self.post.slug}&period=hour",
+            HTTP_API_KEY=self.api_key
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        trend = response.json()["results"]
+        self.assertEqual(len(trend), 1)
+        self.assertEqual(trend[0]["impressions"], 4)
+        self.assertEqual(trend[0]["clicks_through_rate"], 25)
+        self.assertEqual(trend[0]["avg_time_on_page"], 15)
+
+
+class PostViewsRetentionTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Retention Category", slug="retention-category")
+        self.post = Post.objects.create(
+            title="Retention Test Post",
+            description="Test description",
+            content="Test content",
+            slug="retention-test-post",
+            category=self.category,
+            status="published"
+        )
+        self.analytics = PostAnalytics.objects.get(post=self.post)
+        for i in range(5):
+            self.analytics.increment_views(f"10.0.0.{i}")
+        
+        self.old_date = timezone.now() - timedelta(days=200)
+        PostViews.objects.filter(ip_address__in=["10.0.0.0", "10.0.0.1", "10.0.0.2"]).update(created_at=self.old_date)
+
+    def test_dry_run_deletes_nothing(self):
+        count = prune_post_views(timezone.now() - timedelta(days=90), dry_run=True)
+        
+        self.assertEqual(count, 3)
+        self.assertEqual(PostViews.objects.count(), 5)
+
+    def test_prune_in_batches_keeps_view_count(self):
+        batches = []
+        deleted = prune_post_views(timezone.now() - timedelta(days=90), batch_size=2, progress=batches.append)
+        
+        self.assertEqual(deleted, 3)
+        self.assertEqual(batches, [2, 3])
+        self.assertEqual(PostViews.objects.count(), 2)
+        
+        self.analytics.refresh_from_db()
+        self.assertEqual(self.analytics.views, 5)
+
+    @skipUnless(connection.vendor == "postgresql", "Partitioning requires PostgreSQL")
+    def test_partitioned_table_drops_old_months(self):
+        partition_post_views()
+        
+        self.assertTrue(post_views_is_partitioned())
+        self.assertEqual(PostViews.objects.count(), 5)
+        
+        dropped = drop_post_views_partitions(timezone.now() - timedelta(days=90))
+        
+        self.assertIn(partition_name(month_start(self.old_date)), dropped)
+        self.assertEqual(PostViews.objects.count(), 2)
+
+
+class TimeOrderedUUIDTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="UUID Category", slug="uuid-category")
+        self.post = Post.objects.create(
+            title="UUID Test Post",
+            description="Test description",
+            content="Test content",
+            slug="uuid-test-post",
+            category=self.category,
+            status="published"
+        )
+
+    def test_uuid7_is_ordered_by_time(self):
+        now = timezone.now()
+        ids = [uuid7(now + timedelta(milliseconds=i)) for i in range(50)]
+        
+        self.assertTrue(all(value.version == 7 for value in ids))
+        self.assertEqual(ids, sorted(ids))
+
+    @override_settings(TIME_ORDERED_UUIDS=True)
+    def test_opt_in_default(self):
+        heading = Heading.objects.create(post=self.post, title="Heading 1", level=1, order=1)
+        self.assertEqual(heading.id.version, 7)
+
+    def test_reorder_existing_keys(self):
+        PostAnalytics.objects.get(post=self.post).increment_views("10.0.0.1")
+        self.assertEqual(PostViews.objects.get().id.version, 4)
+        
+        call_command("reorder_uuid_keys", stdout=StringIO())
+        
+        self.assertEqual(PostViews.objects.get().id.version, 7)
+        self.assertEqual(PostAnalytics.objects.get(post=self.post).id.version, 7)
+
+    def test_reorder_in_batches(self):
+        PostViews.objects.bulk_create([
+            PostViews(id=uuid.uuid4(), post=self.post, ip_address=f"10.0.0.{i}") for i in range(5)
+        ])
+        for i, view in enumerate(PostViews.objects.all()):
+            PostViews.objects.filter(pk=view.pk).update(created_at=timezone.now() - timedelta(minutes=i))
+        
+        out = StringIO()
+        call_command("reorder_uuid_keys", "--dry-run", stdout=out)
+        self.assertIn("PostViews: would rewrite 5 ids", out.getvalue())
+        self.assertEqual({view.id.version for view in PostViews.objects.all()}, {4})
+        
+        out = StringIO()
+        call_command("reorder_uuid_keys", "--batch-size", "2", stdout=out)
+        self.assertIn("PostViews: 2\nPostViews: 4\nPostViews: 5\n", out.getvalue())
+        
+        # The ids now sort like the rows were created
+        by_id = list(PostViews.objects.order_by("id").values_list("created_at", flat=True))
+        self.assertEqual(by_id, sorted(by_id))
+        self.assertEqual({view.id.version for view in PostViews.objects.all()}, {7})
+
+
+class TrendingPostListViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        redis_client.delete(TRENDING_KEY, TRENDING_EPOCH_KEY)
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Trending Category", slug="trending-category")
+        self.posts = [
+            Post.objects.create(
+                title=f"Trending Post {i}",
+                description="Test description",
+                content="Test content",
+                slug=f"trending-post-{i}",
+                category=self.category,
+                status="published"
+            )
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+        redis_client.delete(TRENDING_KEY, TRENDING_EPOCH_KEY)
+
+    def get_trending(self):
+        response = self.client.get(reverse("post-trending"), HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post["slug"] for post in response.json()["results"]]
+
+    def test_clicks_rank_posts(self):
+        for _ in range(2):
+            self.client.post(
+                reverse("increment-post-clicks"), {"slug": "trending-post-2"}, HTTP_API_KEY=self.api_key, format="json"
+            )
+        record_trending_activity([("trending-post-0", "view")])
+        
+        self.assertEqual(self.get_trending(), ["trending-post-2", "trending-post-0"])
+        # The second request is served from the post card cache
+        self.assertEqual(self.get_trending(), ["trending-post-2", "trending-post-0"])
+
+    def test_rescale_keeps_ranking(self):
+        record_trending_activity([("trending-post-1", "view"), ("trending-post-0", "impression")])
+        redis_client.set(TRENDING_EPOCH_KEY, float(redis_client.get(TRENDING_EPOCH_KEY)) - 3600)
+        
+        rescale_trending_scores()
+        
+        self.assertLess(redis_client.zscore(TRENDING_KEY, "trending-post-1"), 1)
+        self.assertEqual(self.get_trending(), ["trending-post-1", "trending-post-0"])
+
+
+class RelatedPostsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Related Category", slug="related-category")
+        self.django_post = self.create_post("django-orm", "Django ORM queries", "django, orm, queries", "<p>Optimizing django querysets</p>")
+        self.django_cache = self.create_post("django-cache", "Django cache framework", "django, cache, redis", "<p>Caching django querysets in redis</p>")
+        self.gardening = self.create_post("tomatoes", "Growing tomatoes", "garden, tomatoes", "<p>Watering tomato plants</p>")
+
+    def tearDown(self):
+        cache.clear()
+
+    def create_post(self, slug, title, keywords, content):
+        return Post.objects.create(
+            title=title,
+            description=title,
+            content=content,
+            keywords=keywords,
+            slug=slug,
+            category=self.category,
+            status="published"
+        )
+
+    def related_slugs(self, post):
+        return [related["slug"] for related in get_related_posts(post.id)]
+
+    def test_build_index(self):
+        build_related_index()
+        
+        self.assertEqual(self.related_slugs(self.django_post), ["django-cache"])
+        self.assertEqual(self.related_slugs(self.gardening), [])
+
+    def test_incremental_update(self):
+        build_related_index()
+        
+        self.gardening.keywords = "django, orm"
+        self.gardening.title = "Django ORM for gardeners"
+        self.gardening.save()
+        update_related_index(self.gardening.id)
+        
+        self.assertEqual(self.related_slugs(self.gardening)[0], "django-orm")
+        self.assertIn("tomatoes", self.related_slugs(self.django_post))
+        
+        self.django_cache.status = "draft"
+        self.django_cache.save()
+        update_related_index(self.django_cache.id)
+        
+        self.assertNotIn("django-cache", self.related_slugs(self.django_post))
+        self.assertEqual(get_related_posts(self.django_cache.id), [])
+        
+        gardening_id = self.gardening.id
+        self.gardening.delete()
+        update_related_index(gardening_id)
+        
+        self.assertNotIn("tomatoes", self.related_slugs(self.django_post))
+        self.assertFalse(RelatedPost.objects.filter(related_id=gardening_id).exists())
+
+    def test_neighbours_are_stored_apart_from_the_cache(self):
+        build_related_index()
+        
+        self.assertEqual(
+            list(RelatedPost.objects.filter(post=self.django_post).values_list("related__slug", flat=True)),
+            ["django-cache"],
+        )
+        self.assertIsNone(cache.get("related_posts:index"))
+        
+        # The cached lists are filled again from the posts when the cache was flushed
+        cache.clear()
+        update_related_index(self.django_cache.id)
+        self.assertEqual(self.related_slugs(self.django_post), ["django-cache"])
+
+    def test_related_posts_missing_from_the_cache_are_read_from_the_table(self):
+        build_related_index()
+        cache.clear()
+        
+        with self.assertNumQueries(2):
+            self.assertEqual(self.related_slugs(self.django_post), ["django-cache"])
+        self.assertEqual([post["slug"] for post in cache.get(f"post_related:{self.django_post.id}")], ["django-cache"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.related_slugs(self.django_post), ["django-cache"])
+
+    def test_update_only_vectorizes_the_saved_post(self):
+        build_related_index()
+        self.assertEqual(PostVector.objects.count(), 3)
+        
+        post = self.create_post("django-signals", "Django signals", "django, signals", "<p>Django receivers</p>")
+        with patch("apps.blog.related.tokenize", wraps=tokenize) as mock_tokenize:
+            update_related_index(post.id)
+        
+        self.assertEqual(mock_tokenize.call_count, 1)
+        self.assertEqual(PostVector.objects.count(), 4)
+        self.assertIn("django-signals", self.related_slugs(self.django_post))
+
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_detail_includes_related_posts(self, mock_increment_post_views):
+        build_related_index()
+        
+        response = self.client.get(reverse("post-detail") + "?slug=django-orm", HTTP_API_KEY=self.api_key)
+        
+        related = response.json()["results"]["related_posts"]
+        self.assertEqual([post["slug"] for post in related], ["django-cache"])
+
+
+@patch("apps.blog.management.commands.import_posts.build_related_posts.delay")
+class ImportPostsCommandTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.records = [
+            {
+                "title": f"Imported Post {i}",
+                "description": "Imported description",
+                "content": "<p>Imported content</p>",
+                "keywords": "import",
+                "slug": f"imported-post-{i}",
+                "category": "archive",
+                "headings": [{"title": "Introduction", "level": 2}, {"title": "Conclusion", "level": 2}],
+            }
+            for i in range(5)
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    def test_import_ndjson(self, mock_build_related_posts):
+        path = self.write("posts.ndjson", "\n".join(json.dumps(record) for record in self.records))
+        
+        call_command("import_posts", path, "--batch-size", "2", stdout=StringIO())
+        
+        self.assertEqual(Post.objects.filter(category__slug="archive").count(), 5)
+        self.assertEqual(Heading.objects.filter(post__slug="imported-post-0").count(), 2)
+        self.assertEqual(PostAnalytics.objects.filter(post__slug__startswith="imported-post").count(), 5)
+        with open(f"{path}.checkpoint") as file:
+            self.assertEqual(file.read(), "5")
+        mock_build_related_posts.assert_called_once()
+
+    def test_resume_from_checkpoint(self, mock_build_related_posts):
+        path = self.write("posts.json", json.dumps(self.records))
+        self.write("posts.json.checkpoint", "3")
+        
+        call_command("import_posts", path, "--resume", stdout=StringIO())
+        
+        self.assertEqual(
+            sorted(Post.objects.values_list("slug", flat=True)), ["imported-post-3", "imported-post-4"]
+        )
+
+    def test_import_markdown(self, mock_build_related_posts):
+        self.write("hello-world.md", "---\ntitle: Hello World\ncategory: notes\n---\n# Hello\n\nFirst paragraph\n\n## Details\n\nMore text\n")
+        
+        call_command("import_posts", self.directory.name, stdout=StringIO())
+        
+        post = Post.objects.get(slug="hello-world")
+        self.assertEqual(post.title, "Hello World")
+        self.assertIn("<p>First paragraph</p>", post.content)
+        self.assertEqual(list(post.headings.values_list("title", "level")), [("Hello", 1), ("Details", 2)])
+
+    def test_markdown_paragraphs_are_escaped(self, mock_build_related_posts):
+        self.write("unsafe.md", "Some <script>alert(1)</script> text\n")
+        
+        call_command("import_posts", self.directory.name, stdout=StringIO())
+        
+        content = Post.objects.get(slug="unsafe").content
+        self.assertNotIn("<script>", content)
+        self.assertIn("<p>Some &lt;script&gt;alert(1)&lt;/script&gt; text</p>", content)
+
+    def test_records_with_an_invalid_date_are_skipped(self, mock_build_related_posts):
+        self.records[1]["created_at"] = "not a date"
+        self.records[2]["created_at"] = "2024-13-01T00:00:00"
+        self.records[3]["created_at"] = "2024-05-01T12:00:00"
+        path = self.write("posts.ndjson", "\n".join(json.dumps(record) for record in self.records))
+        stdout, stderr = StringIO(), StringIO()
+        
+        call_command("import_posts", path, stdout=stdout, stderr=stderr)
+        
+        self.assertEqual(
+            sorted(Post.objects.values_list("slug", flat=True)),
+            ["imported-post-0", "imported-post-3", "imported-post-4"],
+        )
+        self.assertIn("Skipped imported-post-1", stderr.getvalue())
+        self.assertIn("skipped 2 records", stdout.getvalue())
+
+    def test_records_without_slug_or_title_are_skipped(self, mock_build_related_posts):
+        del self.records[1]["slug"]
+        self.records[2]["title"] = " "
+        self.records[3]["slug"] = "long-" * 40
+        path = self.write("posts.ndjson", "\n".join(json.dumps(record) for record in self.records))
+        stdout = StringIO()
+        
+        call_command("import_posts", path, stdout=stdout, stderr=StringIO())
+        # Long slugs are stored truncated and found again on a second import
+        call_command("import_posts", path, stdout=stdout, stderr=StringIO())
+        
+        self.assertEqual(
+            sorted(Post.objects.values_list("slug", flat=True)),
+            sorted(["imported-post-0", "imported-post-4", ("long-" * 40)[:128]]),
+        )
+        self.assertIn("skipped 2 records", stdout.getvalue())
+
+
+class AnalyticsExportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        
+        self.news = Category.objects.create(name="News", slug="news")
+        self.other = Category.objects.create(name="Other", slug="other")
+        self.post = Post.objects.create(
+            title="Export Post", description="Test", content="Test", slug="export-post", category=self.news, status="published"
+        )
+        Post.objects.create(
+            title="Other Post", description="Test", content="Test", slug="other-post", category=self.other, status="published"
+        )
+        analytics = PostAnalytics.objects.get(post=self.post)
+        analytics.increment_views("10.0.0.1")
+        analytics.increment_views("10.0.0.2")
+        PostViews.objects.filter(ip_address="10.0.0.1").update(created_at=timezone.now() - timedelta(days=10))
+
+    def read(self, response):
+        async def collect():
+            return b"".join([part async for part in response])
+        return async_to_sync(collect)()
+
+    def test_export_requires_admin(self):
+        response = self.client.get(reverse("analytics-export"))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_stream_csv_filtered_by_category(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse("analytics-export") + "?dataset=analytics&category=news")
+        
+        self.assertTrue(response.streaming)
+        lines = self.read(response).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["post_id", "post_slug"])
+        self.assertEqual(len(lines), 2)
+        self.assertIn("export-post", lines[1])
+
+    def test_stream_ndjson_filtered_by_date(self):
+        self.client.force_authenticate(self.admin)
+        start = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.client.get(reverse("analytics-export") + f"?dataset=views&output=ndjson&start={start}")
+        
+        rows = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        self.assertEqual([row["ip_address"] for row in rows], ["10.0.0.2"])
+
+    def test_stream_is_read_lazily_under_asgi(self):
+        fetched = []
+        
+        def rows():
+            for i in range(1000):
+                fetched.append(i)
+                yield (i, f"post-{i}")
+        
+        self.client.force_authenticate(self.admin)
+        with patch("apps.blog.views.export_rows", return_value=(["post_id", "post_slug"], rows())):
+            response = self.client.get(reverse("analytics-export"))
+        
+        async def first_chunk():
+            return await anext(aiter(response))
+        
+        self.assertTrue(response.is_async)
+        self.assertTrue(async_to_sync(first_chunk)().startswith(b"post_id,post_slug\r\n0,post-0"))
+        self.assertLess(len(fetched), 1000)
+
+    def test_export_command(self):
+        path = os.path.join(tempfile.mkdtemp(), "views.csv")
+        call_command("export_analytics", "views", "--output", path, stderr=StringIO())
+        
+        with open(path) as file:
+            self.assertEqual(len(file.read().splitlines()), 3)
+
+
+class FastSerializerParityTest(TestCase):
+    def setUp(self):
+        parent = Category.objects.create(name="Parent", slug="parent")
+        self.category = Category.objects.create(
+            name="Child", title="Child category", slug="child", parent=parent, thumbnail="blog_categories/child/c.png"
+        )
+        for i in range(3):
+            post = Post.objects.create(
+                title=f"Parity Post {i}",
+                description="Descripción con acentos",
+                content="<p>Parity content</p>",
+                thumbnail=f"blog/parity/{i}.jpg" if i else "",
+                keywords="parity",
+                slug=f"parity-post-{i}",
+                category=self.category,
+                status="published"
+            )
+            Heading.objects.create(post=post, title="Second", slug="second", level=2, order=2)
+            Heading.objects.create(post=post, title="First", slug="first", level=1, order=1)
+            analytics = PostAnalytics.objects.get(post=post)
+            for j in range(i):
+                analytics.increment_views(f"10.0.0.{j}")
+
+    def test_list_parity(self):
+        posts = Post.post_published.all()
+        self.assertEqual(
+            FastJSONRenderer().render(serialize_post_list(posts)),
+            JSONRenderer().render(PostListSerializer(posts, many=True).data),
+        )
+
+    def test_detail_parity(self):
+        posts = Post.post_published.filter(slug="parity-post-2")
+        self.assertEqual(
+            FastJSONRenderer().render(serialize_post_detail(posts)),
+            JSONRenderer().render(PostSerializer(posts.get()).data),
+        )
+
+    def test_detail_not_found(self):
+        with self.assertRaises(Post.DoesNotExist):
+            serialize_post_detail(Post.post_published.filter(slug="missing"))
+
+    def test_sparse_fields_parity(self):
+        posts = Post.post_published.all()
+        fields = resolve_fields({"fields": "title,category", "include": "headings"}, LIST_FIELDS)
+        self.assertEqual(fields, ("id", "title", "slug", "category", "headings"))
+        with self.assertNumQueries(2):
+            fast = FastJSONRenderer().render(serialize_post_list(posts, fields))
+        self.assertEqual(fast, JSONRenderer().render(PostListSerializer(posts, many=True, fields=fields).data))
+        
+        fields = resolve_fields({"include": "view_count"}, DETAIL_FIELDS)
+        self.assertNotIn("headings", fields)
+        post = posts.filter(slug="parity-post-2")
+        self.assertEqual(
+            FastJSONRenderer().render(serialize_post_detail(post, fields)),
+            JSONRenderer().render(PostSerializer(post.get(), fields=fields).data),
+        )
+
+    def test_resolve_fields(self):
+        self.assertIsNone(resolve_fields({}, LIST_FIELDS))
+        self.assertIsNone(resolve_fields({"fields": ",".join(LIST_FIELDS)}, LIST_FIELDS))
+        self.assertEqual(resolve_fields({"fields": "", "include": ""}, LIST_FIELDS), ("id", "slug"))
+        with self.assertRaisesMessage(ValueError, "Unknown fields: content"):
+            resolve_fields({"fields": "title,content"}, LIST_FIELDS)
+        with self.assertRaisesMessage(ValueError, "Unknown fields: title"):
+            resolve_fields({"include": "title"}, LIST_FIELDS)
+
+
+
+@override_settings(RESPONSE_CACHE_COMPRESS_MIN_BYTES=100)
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Cached", slug="cached")
+        self.post = Post.objects.create(
+            title="Cached Post",
+            description="Cached description",
+            content="<p>Cached content</p>" * 50,
+            slug="cached-post",
+            category=self.category,
+            status="published"
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_small_bodies_are_not_compressed(self):
+        encoded = encode_body(b'{"success":true}')
+        self.assertEqual(encoded, {"identity": b'{"success":true}'})
+
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_detail_is_served_compressed_from_cache(self, mock_increment_post_views):
+        url = reverse("post-detail") + f"?slug={self.post.slug}"
+        plain = self.client.get(url, HTTP_API_KEY=self.api_key)
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertIn("Accept-Encoding", plain["Vary"])
+        
+        with self.assertNumQueries(0):
+            compressed = self.client.get(url, HTTP_API_KEY=self.api_key, HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(json.loads(plain.content)["results"]["slug"], self.post.slug)
+        self.assertEqual(mock_increment_post_views.call_count, 2)
+
+    def test_list_pages_are_cached_and_count_impressions(self):
+        url = reverse("post-list")
+        first = self.client.get(url, HTTP_API_KEY=self.api_key)
+        with self.assertNumQueries(0):
+            second = self.client.get(url, HTTP_API_KEY=self.api_key, HTTP_ACCEPT_ENCODING="br")
+        
+        self.assertEqual(second["Content-Encoding"], "br")
+        self.assertEqual(first.json()["results"][0]["slug"], self.post.slug)
+        self.assertEqual(int(redis_client.get(f"post:impressions:{self.post.id}")), 2)
+        redis_client.delete(f"post:impressions:{self.post.id}")
+
+    def test_identity_fallback(self):
+        encoded = encode_body(b"x" * 200)
+        response = encoded_response(RequestFactory().get("/", HTTP_ACCEPT_ENCODING="deflate"), encoded)
+        self.assertEqual(response.content, b"x" * 200)
+
+
+class APIKeyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_api_key_cache()
+        self.client = APIClient()
+        self.api_key, self.key = APIKey.generate("Frontend")
+        self.url = reverse("post-headings") + "?slug=missing"
+
+    def tearDown(self):
+        cache.clear()
+        clear_api_key_cache()
+
+    def test_keys_are_stored_hashed(self):
+        self.assertNotEqual(self.api_key.hashed_key, self.key)
+        self.assertEqual(self.api_key.prefix, self.key[:8])
+        self.assertEqual(get_api_key(self.key).id, str(self.api_key.id))
+        self.assertIsNone(get_api_key("not-a-key"))
+
+    def test_revoked_key_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, HTTP_API_KEY=self.key).status_code, status.HTTP_200_OK)
+        
+        self.api_key.is_active = False
+        self.api_key.save()
+        self.assertEqual(self.client.get(self.url, HTTP_API_KEY=self.key).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_lookups_are_cached(self):
+        get_api_key(self.key)
+        with self.assertNumQueries(0):
+            get_api_key(self.key)
+
+    def test_token_bucket(self):
+        self.api_key.rate_per_second = 0.01
+        self.api_key.burst = 2
+        self.api_key.save()
+        
+        responses = [self.client.get(self.url, HTTP_API_KEY=self.key) for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertGreater(int(responses[2]["Retry-After"]), 0)
+        self.assertEqual(get_api_key_usage()[str(self.api_key.id)], {"requests": 2, "throttled": 1})
+        
+        # Other keys have their own bucket
+        response = self.client.get(self.url, HTTP_API_KEY=settings.VALID_API_KEYS[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_a_rate_or_burst_of_zero_blocks_the_key(self):
+        for throttled, (rate, burst) in enumerate(((0, None), (None, 0)), 1):
+            self.api_key.rate_per_second = rate
+            self.api_key.burst = burst
+            self.api_key.save()
+            clear_api_key_cache()
+            
+            response = self.client.get(self.url, HTTP_API_KEY=self.key)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(int(response["Retry-After"]), settings.API_KEY_CACHE_SECONDS)
+            self.assertEqual(get_api_key_usage()[str(self.api_key.id)], {"requests": 0, "throttled": throttled})
+
+
+class EndpointBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_endpoints_and_tasks_stay_within_budget(self):
+        results = run_benchmarks([3, 12], repeat=2)
+        
+        self.assertEqual(set(results[12]), set(load_budgets()))
+        self.assertEqual(check_budgets(results, load_budgets()), [])
+
+    def test_budget_violations_are_reported(self):
+        results = {10: {"post-list warm": {"queries": 1, "redis_commands": 25, "redis_round_trips": 4}}}
+        
+        self.assertEqual(check_budgets(results, load_budgets()), [
+            "post-list warm with 10 posts: 1 queries, budget 0",
+            "post-list warm with 10 posts: 25 redis_commands, budget 4",
+        ])
+
+    def test_batched_budgets_grow_per_started_batch(self):
+        results = {
+            250: {"task sync_time_on_page_to_db": {"queries": 4, "redis_commands": 0, "redis_round_trips": 0}},
+            251: {"task sync_time_on_page_to_db": {"queries": 5, "redis_commands": 0, "redis_round_trips": 0}},
+        }
+        
+        self.assertEqual(check_budgets(results, load_budgets()), [
+            "task sync_time_on_page_to_db with 250 posts: 4 queries, budget 3",
+        ])
+
+    def test_benchmarks_leave_the_configured_redis_alone(self):
+        cache.set("post_list", ["live"])
+        redis_client.set("post:impressions:live", 7)
+        
+        run_benchmarks([3], repeat=1)
+        
+        self.assertEqual(cache.get("post_list"), ["live"])
+        self.assertEqual(redis_client.get("post:impressions:live"), b"7")
+        redis_client.delete("post:impressions:live")
+
+
+class WarmBlogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Warm", slug="warm")
+        self.posts = [
+            Post.objects.create(
+                title=f"Warm {i}", description="Warm", content="Warm content", slug=f"warm-{i}",
+                category=self.category, status="published",
+            )
+            for i in range(5)
+        ]
+        Post.objects.create(title="Draft", description="Draft", content="Draft", slug="warm-draft", category=self.category)
+        # Recent traffic first, then all time views, then the newest
+        PostAnalytics.objects.filter(post=self.posts[0]).update(views=500)
+        PostAnalytics.objects.filter(post=self.posts[1]).update(views=10)
+        PostAnalyticsRollup.objects.create(post=self.posts[2], bucket=timezone.now() - timedelta(hours=2), views=3)
+        PostAnalyticsRollup.objects.create(post=self.posts[3], bucket=timezone.now() - timedelta(days=30), views=900)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_posts_by_traffic(self):
+        expected = [self.posts[i].id for i in (2, 0, 1, 4, 3)]
+        self.assertEqual(posts_by_traffic(), expected)
+        self.assertEqual(posts_by_traffic(limit=2), expected[:2])
+
+    @patch("apps.blog.views.increment_post_views.delay")
+    def test_command_fills_the_detail_and_list_caches(self, delay):
+        out = StringIO()
+        # Four queries for the list, one for the order, then five per chunk (the related posts
+        # of a cleared cache are read from RelatedPost)
+        with self.assertNumQueries(5 + 5 * 3):
+            call_command("warm_blog_cache", limit=0, chunk_size=2, concurrency=1, stdout=out)
+        self.assertIn("Warmed 2/5 posts", out.getvalue())
+        self.assertIn("Warmed 5 posts and the list of 5 posts", out.getvalue())
+        
+        self.assertEqual(len(cache.get("post_list")), 5)
+        self.assertIsNone(cache.get("post_detail:v2:warm-draft"))
+        warmed = json.loads(decode_body(cache.get("post_detail:v2:warm-0")))
+        with self.assertNumQueries(0):
+            response = APIClient().get(reverse("post-detail"), {"slug": "warm-0"}, HTTP_API_KEY=settings.VALID_API_KEYS[0])
+        self.assertEqual(response.json(), warmed)
+        self.assertEqual(cache.get("post_detail_data:warm-0"), warmed["results"])
+
+
+@patch("apps.blog.management.commands.seed_blog.build_related_posts.delay")
+class SeedBlogCommandTest(TestCase):
+    options = {"categories": 8, "depth": 3, "posts": 20, "views": 300, "until": "2026-01-01", "stdout": StringIO()}
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by("slug").values_list("id", "category_id", "created_at", "updated_at", "content")),
+            list(PostViews.objects.order_by("id").values_list("id", "post_id", "ip_address", "created_at")),
+        )
+
+    def test_seed(self, mock_build_related_posts):
+        call_command("seed_blog", **self.options)
+        
+        self.assertEqual(Category.objects.count(), 8)
+        self.assertTrue(Category.objects.filter(parent__parent__isnull=False).exists())
+        self.assertEqual(Post.objects.count(), 20)
+        self.assertEqual(PostViews.objects.count(), 300)
+        self.assertEqual(sum(PostAnalytics.objects.values_list("views", flat=True)), 300)
+        self.assertEqual(PostAnalytics.objects.count(), 20)
+        self.assertTrue(Heading.objects.exists())
+        # Dates come from the generator, not from auto_now_add
+        self.assertFalse(PostViews.objects.filter(created_at__gt="2026-01-01T00:00:00Z").exists())
+        mock_build_related_posts.assert_called_once()
+
+    def test_same_seed_same_data(self, mock_build_related_posts):
+        call_command("seed_blog", **self.options)
+        first = self.snapshot()
+        call_command("seed_blog", clear=True, **self.options)
+        
+        self.assertEqual(self.snapshot(), first)
+        with self.assertRaises(CommandError):
+            call_command("seed_blog", **self.options)
+
+
+class PerformanceInstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Timed", slug="timed")
+        self.post = Post.objects.create(
+            title="Timed Post",
+            description="Timed description",
+            content="Timed content",
+            slug="timed-post",
+            category=self.category,
+            status="published"
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_server_timing_header(self, mock_increment_post_views):
+        url = reverse("post-detail") + f"?slug={self.post.slug}"
+        miss = self.client.get(url, HTTP_API_KEY=self.api_key)["Server-Timing"]
+        hit = self.client.get(url, HTTP_API_KEY=self.api_key)["Server-Timing"]
+        
+        self.assertRegex(miss, r'db;dur=[0-9.]+;desc="\d+ queries"')
+        self.assertIn("serialize;dur=", miss)
+        self.assertIn('cache;desc="miss"', miss)
+        self.assertIn('cache;desc="hit"', hit)
+        self.assertNotIn("db;", hit)
+        self.assertRegex(hit, r"total;dur=[0-9.]+$")
+
+    @override_settings(METRICS_TOKEN="scrape-token")
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_metrics_endpoint(self, mock_increment_post_views):
+        metrics_buffer.flush()
+        redis_client.delete(METRICS_KEY)
+        self.client.get(reverse("post-detail") + f"?slug={self.post.slug}", HTTP_API_KEY=self.api_key)
+        
+        self.assertEqual(self.client.get("/metrics").status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        metrics = response.content.decode()
+        self.assertIn('blog_http_requests_total{view="post-detail",method="GET",status="200"} 1', metrics)
+        self.assertIn('blog_http_request_duration_seconds_bucket{view="post-detail",le="+Inf"} 1', metrics)
+        self.assertIn('blog_http_request_duration_seconds_count{view="post-detail"} 1', metrics)
+        self.assertIn('blog_cache_lookups_total{view="post-detail",result="miss"} 1', metrics)
+        self.assertIn("# TYPE blog_http_db_duration_seconds histogram", metrics)
+        self.assertIn('blog_api_key_requests_total{key="env:', metrics)
+
+    @override_settings(METRICS_FLUSH_SECONDS=3600)
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_request_metrics_are_flushed_in_batches(self, mock_increment_post_views):
+        metrics_buffer.flush()
+        redis_client.delete(METRICS_KEY)
+        
+        for _ in range(3):
+            self.client.get(reverse("post-detail") + f"?slug={self.post.slug}", HTTP_API_KEY=self.api_key)
+        self.assertFalse(redis_client.exists(METRICS_KEY))
+        self.assertNotIn("Server-Timing", self.client.get(reverse("post-detail") + f"?slug={self.post.slug}", HTTP_API_KEY=self.api_key))
+        
+        metrics_buffer.flush()
+        self.assertIn('blog_http_requests_total{view="post-detail",method="GET",status="200"} 4', render_metrics())
+
+
+class ProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        redis_client.delete(PROFILES_KEY)
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        self.url = reverse("post-list")
+        self.staff = User.objects.create_user(username="profiler", password="password", is_staff=True)
+
+    def tearDown(self):
+        cache.clear()
+        redis_client.delete(PROFILES_KEY)
+
+    def test_unsigned_requests_are_not_profiled(self):
+        self.assertNotIn("X-Profile-Id", self.client.get(self.url, HTTP_API_KEY=self.api_key))
+        self.assertNotIn("X-Profile-Id", self.client.get(self.url, HTTP_API_KEY=self.api_key, HTTP_X_PROFILE="forged"))
+        self.assertEqual(list_profiles(), [])
+
+    def test_signed_request_profiles_are_downloadable_by_staff(self):
+        sampled = self.client.get(self.url, HTTP_API_KEY=self.api_key, HTTP_X_PROFILE=make_profile_token())
+        profiled = self.client.get(
+            self.url, HTTP_API_KEY=self.api_key, HTTP_X_PROFILE=make_profile_token(), HTTP_X_PROFILE_MODE="cprofile"
+        )
+        download_url = reverse("profile-download", args=[profiled["X-Profile-Id"]])
+
+        self.assertEqual(self.client.get(reverse("profile-list")).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(download_url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(self.staff)
+        profiles = self.client.get(reverse("profile-list")).json()["results"]
+        self.assertEqual([p["id"] for p in profiles], [profiled["X-Profile-Id"], sampled["X-Profile-Id"]])
+        self.assertEqual(profiles[0]["path"], self.url)
+
+        speedscope = self.client.get(reverse("profile-download", args=[sampled["X-Profile-Id"]])).json()
+        self.assertEqual(speedscope["profiles"][0]["type"], "sampled")
+
+        with tempfile.NamedTemporaryFile(suffix=".pstats") as file:
+            file.write(self.client.get(download_url).content)
+            file.flush()
+            stats = pstats.Stats(file.name)
+        self.assertTrue(any(name == "get" for _, _, name in stats.stats))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_MAX_PROFILES=2)
+    def test_ring_buffer_keeps_the_latest_profiles(self):
+        ids = [self.client.get(self.url, HTTP_API_KEY=self.api_key)["X-Profile-Id"] for i in range(3)]
+        
+        self.assertEqual([p["id"] for p in list_profiles()], ids[:0:-1])
+        self.assertIsNone(redis_client.get(PROFILE_DATA_KEY.format(ids[0])))
+        self.assertIsNotNone(redis_client.get(PROFILE_DATA_KEY.format(ids[2])))
+
+
+# A queue of its own, the real celery lists of the broker are never touched
+@override_settings(TASK_METRICS_QUEUES=["test-metrics-queue"])
+class TaskMetricsTest(TestCase):
+    queues = ("test-metrics-queue", "test-metrics-queue\x06\x163")
+
+    def setUp(self):
+        get_redis("broker").delete(*self.queues)
+        metrics_buffer.flush()
+        redis_client.delete(METRICS_KEY)
+        self.category = Category.objects.create(name="Tasks", slug="tasks")
+        self.post = Post.objects.create(
+            title="Task Post",
+            description="Task description",
+            content="Task content",
+            slug="task-post",
+            category=self.category,
+            status="published"
+        )
+
+    def tearDown(self):
+        get_redis("broker").delete(*self.queues)
+        redis_client.delete(METRICS_KEY)
+
+    def test_task_runs_and_failures_are_recorded(self):
+        from .tasks import increment_post_views
+
+        self.assertTrue(increment_post_views.ignore_result)
+        increment_post_views.apply(args=[self.post.slug, "10.0.0.1"])
+        failed = increment_post_views.apply(args=["missing-post", "10.0.0.1"])
+        self.assertEqual(failed.state, "FAILURE")
+        
+        metrics = render_metrics()
+        task = 'task="apps.blog.tasks.increment_post_views"'
+        self.assertIn(f'blog_tasks_total{{{task},state="SUCCESS"}} 1', metrics)
+        self.assertIn(f'blog_tasks_total{{{task},state="FAILURE"}} 1', metrics)
+        self.assertIn(f'blog_task_failures_total{{{task},exception="DoesNotExist"}} 1', metrics)
+        self.assertIn(f'blog_task_duration_seconds_count{{{task}}} 2', metrics)
+
+    @override_settings(METRICS_FLUSH_SECONDS=3600)
+    def test_task_metrics_are_flushed_in_batches(self):
+        from .tasks import increment_post_views
+        
+        for _ in range(3):
+            increment_post_views.apply(args=[self.post.slug, "10.0.0.1"])
+        self.assertFalse(redis_client.exists(METRICS_KEY))
+        
+        task = 'task="apps.blog.tasks.increment_post_views"'
+        self.assertIn(f'blog_tasks_total{{{task},state="SUCCESS"}} 3', render_metrics())
+
+    def test_queue_latency_and_length(self):
+        request = Context(enqueued_at=time.time() - 5, eta=None)
+        self.assertAlmostEqual(queue_latency(request), 5, delta=1)
+        delayed = Context(enqueued_at=time.time() - 5, eta=(timezone.now() - timedelta(seconds=2)).isoformat())
+        self.assertAlmostEqual(queue_latency(delayed), 2, delta=1)
+        self.assertIsNone(queue_latency(Context()))
+
+        get_redis("broker").rpush(self.queues[0], "a", "b")
+        get_redis("broker").rpush(self.queues[1], "c")
+        self.assertIn('blog_celery_queue_length{queue="test-metrics-queue"} 3', render_metrics())
+
+
+@override_settings(ANALYTICS_FLUSH_MIN_INTERVAL=5, ANALYTICS_FLUSH_MAX_INTERVAL=300, ANALYTICS_FLUSH_BACKLOG_TARGET=10)
+class AnalyticsFlushSchedulerTest(TestCase):
+    def setUp(self):
+        self.keys = [BACKLOG_KEY.format(name) for name in FLUSH_JOBS] + [LAST_FLUSH_KEY.format(name) for name in FLUSH_JOBS]
+        redis_client.delete(*self.keys)
+        self.category = Category.objects.create(name="Flush", slug="flush")
+        self.post = Post.objects.create(
+            title="Flush Post",
+            description="Flush description",
+            content="Flush content",
+            slug="flush-post",
+            category=self.category,
+            status="published"
+        )
+
+    def tearDown(self):
+        redis_client.delete(*self.keys, f"post:impressions:{self.post.id}", FLUSH_LOCK_KEY.format("impressions"))
+
+    def buffer_impressions(self, count):
+        pipe = redis_client.pipeline()
+        pipe.incrby(f"post:impressions:{self.post.id}", count)
+        record_backlog(pipe, "impressions", count)
+        pipe.execute()
+
+    def test_interval_shrinks_with_the_backlog(self):
+        self.assertEqual(flush_interval(0), 300)
+        self.assertEqual(flush_interval(10), 300)
+        self.assertEqual(flush_interval(100), 30)
+        self.assertEqual(flush_interval(10 ** 6), 5)
+
+    def test_due_buffers_are_flushed(self):
+        self.assertIn("impressions", FLUSH_JOBS)
+        self.assertEqual(run_due_flushes(now=1000), [])
+        
+        self.buffer_impressions(3)
+        self.assertEqual(run_due_flushes(now=1000), ["impressions"])
+        self.assertEqual(PostAnalytics.objects.get(post=self.post).impressions, 3)
+        self.assertEqual(int(redis_client.get(BACKLOG_KEY.format("impressions"))), 0)
+        
+        # A small backlog waits the max interval, a large one only a fraction of it
+        self.buffer_impressions(3)
+        self.assertEqual(run_due_flushes(now=1100), [])
+        self.buffer_impressions(97)
+        self.assertEqual(run_due_flushes(now=1100), ["impressions"])
+        self.assertEqual(PostAnalytics.objects.get(post=self.post).impressions, 103)
+
+    def test_locked_jobs_are_skipped(self):
+        self.buffer_impressions(1)
+        lock = redis_client.lock(FLUSH_LOCK_KEY.format("impressions"), timeout=60)
+        lock.acquire()
+        try:
+            self.assertEqual(run_due_flushes(now=1000), [])
+        finally:
+            lock.release()
+        self.assertEqual(run_due_flushes(now=1000), ["impressions"])
+
+    def test_a_flush_outliving_its_lock_is_still_reported(self):
+        self.buffer_impressions(1)
+        
+        def slow_flush():
+            # The lock timeout passes while the job runs
+            redis_client.delete(FLUSH_LOCK_KEY.format("slow"))
+        
+        # The jobs after it still run
+        jobs = {"slow": slow_flush, "impressions": FLUSH_JOBS["impressions"]}
+        with patch.dict(FLUSH_JOBS, jobs, clear=True), self.assertLogs("apps.blog.flush", "WARNING"):
+            redis_client.set(BACKLOG_KEY.format("slow"), 1)
+            self.assertEqual(run_due_flushes(now=1000), ["slow", "impressions"])
+        redis_client.delete(BACKLOG_KEY.format("slow"), LAST_FLUSH_KEY.format("slow"))
+
+
+class RedisClientsTest(TestCase):
+    def tearDown(self):
+        redis_client.delete("test:counter", "test:hash")
+
+    def test_namespaces_share_the_pool_of_their_url(self):
+        self.assertIs(get_redis("analytics"), get_redis())
+        self.assertIs(get_redis("unknown"), get_redis())
+        with override_settings(REDIS_URLS={**settings.REDIS_URLS, "analytics": "redis://127.0.0.1:6379/3"}):
+            self.assertIsNot(get_redis("analytics"), get_redis())
+            self.assertEqual(get_redis("analytics").connection_pool.connection_kwargs["db"], 3)
+
+    def test_increment_counters(self):
+        self.assertEqual(increment_counters({"test:counter": 2, ("test:hash", "sum"): 1.5, ("test:hash", "count"): 1}), 3)
+        increment_counters({"test:counter": 3, ("test:hash", "sum"): 2.25, ("test:hash", "count"): 1})
+        
+        self.assertEqual(redis_client.get("test:counter"), b"5")
+        self.assertEqual(redis_client.hgetall("test:hash"), {b"sum": b"3.75", b"count": b"2"})
+        with redis_pipeline() as pipe:
+            increment_counters({"test:counter": 1}, client=pipe)
+        self.assertEqual(redis_client.get("test:counter"), b"6")
+
+    def test_async_client_and_probe(self):
+        async def ping():
+            return await get_async_redis("analytics").ping()
+        
+        self.assertTrue(asyncio.run(ping()))
+        health = probe()
+        self.assertTrue(health["ok"])
+        self.assertGreater(health["latency"], 0)
+        with override_settings(REDIS_URLS={**settings.REDIS_URLS, "analytics": "redis://127.0.0.1:1/0"}):
+            self.assertFalse(probe("analytics", samples=1)["ok"])
+            self.assertIn('blog_redis_up{namespace="analytics"} 0', render_metrics())
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0", "replica_1"])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        
+        self.category = Category.objects.create(name="Replica", slug="replica")
+        self.post = Post.objects.create(
+            title="Replica Post",
+            description="Replica description",
+            content="Replica content",
+            slug="replica-post",
+            category=self.category,
+            status="published"
+        )
+
+    @patch("core.db_routers.replica_lag", lambda alias: 60 if alias == "replica_1" else 0)
+    def test_content_reads_go_to_fresh_replicas(self):
+        # Test cases run in a transaction, which pins reads to the primary
+        self.assertEqual(self.router.db_for_read(Post), "default")
+        
+        with patch.object(connection, "in_atomic_block", False):
+            self.assertEqual(self.router.db_for_read(Post), "replica_0")
+            self.assertEqual(self.router.db_for_read(PostAnalytics), "default")
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Post), "default")
+            with replica_scope() as scope:
+                self.assertEqual(self.router.db_for_read(Category), "replica_0")
+                self.assertEqual(self.router.db_for_write(PostAnalytics), "default")
+                self.assertTrue(scope["wrote"])
+                self.assertEqual(self.router.db_for_read(Category), "default")
+            with override_settings(REPLICA_STALENESS_SECONDS=120):
+                self.assertIn(self.router.db_for_read(Post), ("replica_0", "replica_1"))
+        
+        self.assertFalse(self.router.allow_migrate("replica_0", "blog"))
+        self.assertTrue(self.router.allow_migrate("default", "blog"))
+
+    def test_writing_clients_are_pinned_to_the_primary(self):
+        # Clicks are buffered in redis, a category saved in the admin writes to the database
+        self.client.force_login(User.objects.create_superuser("replica-admin", "admin@example.com", "password"))
+        response = self.client.post(reverse("admin:blog_category_add"), {"name": "Pinned", "slug": "pinned"})
+        
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response.cookies[settings.REPLICA_PIN_COOKIE]["max-age"], 5)
+        # The pinned client reads its own writes without any replica connection
+        response = self.client.get(reverse("post-headings") + f"?slug={self.post.slug}", HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+
+class SitemapFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Sitemap", slug="sitemap")
+        self.january, self.march = [
+            Post.objects.create(
+                title=f"Sitemap {month}",
+                description="Sitemap description",
+                content="Sitemap content",
+                slug=f"sitemap-{month}",
+                category=self.category,
+                status="published",
+                created_at=timezone.make_aware(timezone.datetime(2026, month, 15)),
+            )
+            for month in (1, 3)
+        ]
+        Post.objects.create(
+            title="Draft", description="Draft", content="Draft", slug="sitemap-draft", category=self.category,
+            created_at=timezone.make_aware(timezone.datetime(2026, 2, 15)),
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_sitemap_index_and_shards(self):
+        index = self.client.get(reverse("sitemap-index"))
+        self.assertEqual(index["Content-Type"], "application/xml")
+        self.assertIn(b"<loc>http://localhost:3000/sitemaps/2026-01.xml</loc>", index.content)
+        self.assertIn(b"<loc>http://localhost:3000/sitemaps/2026-03.xml</loc>", index.content)
+        self.assertNotIn(b"2026-02", index.content)
+        
+        shard = self.client.get(reverse("sitemap-shard", args=["2026-01"]))
+        self.assertIn(b"<loc>http://localhost:3000/blog/sitemap-1</loc>", shard.content)
+        self.assertNotIn(b"sitemap-3", shard.content)
+        for missing in ("2026-02", "2026-13", "latest"):
+            self.assertEqual(self.client.get(reverse("sitemap-shard", args=[missing])).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(SITEMAP_SHARD_MAX_URLS=2)
+    @patch("apps.blog.tasks.relay_outbox.delay")
+    @patch("apps.blog.tasks.update_related_posts.delay")
+    def test_big_months_are_split_in_parts(self, update_related_posts, relay_outbox):
+        for day in (16, 17):
+            Post.objects.create(
+                title=f"Sitemap 1-{day}", description="Sitemap description", content="Sitemap content",
+                slug=f"sitemap-1-{day}", category=self.category, status="published",
+                created_at=timezone.make_aware(timezone.datetime(2026, 1, day)),
+            )
+        
+        index = self.client.get(reverse("sitemap-index"))
+        self.assertIn(b"<loc>http://localhost:3000/sitemaps/2026-01.xml</loc>", index.content)
+        self.assertIn(b"<loc>http://localhost:3000/sitemaps/2026-01-2.xml</loc>", index.content)
+        self.assertNotIn(b"2026-01-3", index.content)
+        self.assertNotIn(b"2026-03-2", index.content)
+        
+        first = self.client.get(reverse("sitemap-shard", args=["2026-01"])).content
+        second = self.client.get(reverse("sitemap-shard", args=["2026-01-2"])).content
+        self.assertEqual([first.count(b"<url>"), second.count(b"<url>")], [2, 1])
+        self.assertIn(b"/blog/sitemap-1-17<", second)
+        for missing in ("2026-01-3", "2026-01-1", "2026-01-02"):
+            self.assertEqual(self.client.get(reverse("sitemap-shard", args=[missing])).status_code, status.HTTP_404_NOT_FOUND)
+        
+        # Saving a post of the month drops every part
+        with self.captureOnCommitCallbacks(execute=True):
+            self.january.save()
+        for shard in ("2026-01", "2026-01-2"):
+            self.assertIsNone(cache.get(SITEMAP_SHARD_KEY.format(shard)))
+
+    def test_cached_documents_and_etags(self):
+        url = reverse("sitemap-shard", args=["2026-03"])
+        etag = self.client.get(url)["ETag"]
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, self.client.get(url).content)
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified["ETag"], etag)
+
+    @patch("apps.blog.tasks.relay_outbox.delay")
+    @patch("apps.blog.tasks.update_related_posts.delay")
+    def test_saving_a_post_only_drops_its_shard(self, update_related_posts, relay_outbox):
+        for shard in ("2026-01", "2026-03"):
+            self.client.get(reverse("sitemap-shard", args=[shard]))
+        self.client.get(reverse("sitemap-index"))
+        
+        self.march.title = "Sitemap 3 updated"
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.march.save()
+            # Until the transaction commits, a request would render the documents without the change
+            self.assertIsNotNone(cache.get(SITEMAP_SHARD_KEY.format("2026-03")))
+        for callback in callbacks:
+            callback()
+        
+        self.assertIsNotNone(cache.get(SITEMAP_SHARD_KEY.format("2026-01")))
+        self.assertIsNone(cache.get(SITEMAP_SHARD_KEY.format("2026-03")))
+        self.assertIsNone(cache.get(SITEMAP_INDEX_KEY))
+
+    def test_feeds(self):
+        rss = self.client.get(reverse("post-feed", args=["rss"]))
+        atom = self.client.get(reverse("post-feed", args=["atom"]))
+        
+        self.assertEqual(rss["Content-Type"], "application/rss+xml")
+        self.assertIn(b"<title>Sitemap 3</title>", rss.content)
+        self.assertLess(rss.content.index(b"Sitemap 3"), rss.content.index(b"Sitemap 1"))
+        self.assertNotIn(b"Draft", rss.content)
+        self.assertIn(b"<link href=\"http://localhost:3000/blog/sitemap-1\"", atom.content)
+        self.assertEqual(self.client.get(reverse("post-feed", args=["json"])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WebhookStubHandler(BaseHTTPRequestHandler):
+    # Records the deliveries, answers the status of the path ("/ok" or "/fail")
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append((self.path, dict(self.headers), body))
+        self.send_response(200 if self.path == "/ok" else 503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@patch("apps.blog.tasks.relay_outbox.delay")
+class OutboxTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), WebhookStubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        WebhookStubHandler.received.clear()
+        self.category = Category.objects.create(name="Outbox", slug="outbox")
+        self.post = Post.objects.create(
+            title="Outbox", description="Outbox", content="Outbox", slug="outbox", category=self.category,
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_publish_events(self, delay):
+        # Creating a draft is not public
+        self.assertFalse(OutboxEvent.objects.exists())
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.status = "published"
+            self.post.save()
+        delay.assert_called()
+        
+        post = Post.objects.get(id=self.post.id)
+        post.slug = "outbox-renamed"
+        post.save()
+        Heading.objects.create(post=post, title="Intro", level=2, order=1)
+        post.status = "draft"
+        post.save()
+        post.title = "Draft edit"
+        post.save()
+        
+        events = [(event.topic, event.data) for event in OutboxEvent.objects.order_by("created_at", "id")]
+        post_id = str(self.post.id)
+        self.assertEqual(events, [
+            ("post.published", {"id": post_id, "slug": "outbox"}),
+            ("post.updated", {"id": post_id, "slug": "outbox-renamed", "previous_slug": "outbox"}),
+            ("post.updated", {"id": post_id, "slug": "outbox-renamed"}),
+            ("post.unpublished", {"id": post_id, "slug": "outbox-renamed"}),
+        ])
+        
+        merged = merge_events(OutboxEvent.objects.order_by("created_at", "id"))
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]["topic"], "post.unpublished")
+        self.assertEqual(merged[0]["data"]["previous_slug"], "outbox")
+
+    def test_purge_drops_the_tracked_keys_without_walking_the_keyspace(self, delay):
+        cache_tracked({
+            "post_detail:v2:a:fields:id,slug": b"stale",
+            "post_detail_data:b:fields:id,slug": {},
+            "post_detail:v2:kept:fields:id,slug": b"fresh",
+            "post_list:page:testserver:1::": b"stale",
+        }, {
+            "post_detail:v2:a:fields:id,slug": post_shapes_key("a"),
+            "post_detail_data:b:fields:id,slug": post_shapes_key("b"),
+            "post_detail:v2:kept:fields:id,slug": post_shapes_key("kept"),
+            "post_list:page:testserver:1::": POST_LIST_KEYS,
+        }, timeout=60)
+        events = [{"data": {"slug": "a"}}, {"data": {"slug": "b"}}, {"data": {"slug": "c", "previous_slug": "d"}}]
+        
+        with patch.object(cache, "delete_pattern") as delete_pattern, patch.object(cache, "iter_keys") as iter_keys:
+            purge_post_caches(events)
+        
+        delete_pattern.assert_not_called()
+        iter_keys.assert_not_called()
+        self.assertFalse(cache.has_key(post_shapes_key("a")))
+        self.assertEqual(cache.get("post_detail:v2:kept:fields:id,slug"), b"fresh")
+        for key in ("post_detail:v2:a:fields:id,slug", "post_detail_data:b:fields:id,slug", "post_list:page:testserver:1::"):
+            self.assertIsNone(cache.get(key))
+
+    @patch("apps.blog.tasks.increment_post_views.delay")
+    def test_shapes_cached_by_the_views_are_purged(self, increment_post_views, delay):
+        self.post.status = "published"
+        self.post.save()
+        relay_events()
+        client = APIClient()
+        headers = {"HTTP_API_KEY": settings.VALID_API_KEYS[0]}
+        client.get(reverse("post-detail") + "?slug=outbox&fields=title", **headers)
+        client.get(reverse("post-list") + "?fields=title", **headers)
+        cached = ["post_detail:v2:outbox:fields:id,title,slug", "post_list:fields:id,title,slug"]
+        self.assertTrue(all(cache.has_key(key) for key in cached))
+        self.assertTrue(list(cache.iter_keys("post_list:page:*")))
+        
+        self.post.title = "Edited"
+        self.post.save()
+        relay_events()
+        self.assertFalse(any(cache.has_key(key) for key in cached))
+        self.assertFalse(list(cache.iter_keys("post_list:page:*")))
+
+    def test_relay_delivers_signed_batches(self, delay):
+        webhook = Webhook.objects.create(name="Frontend", url=f"{self.base_url}/ok", secret="s3cret")
+        Webhook.objects.create(name="Deletes", url=f"{self.base_url}/ok", topics=["post.deleted"])
+        cache.set("post_detail:v2:outbox", b"stale")
+        cache_tracked({"post_detail:v2:outbox:fields:id,slug": b"stale"}, {"post_detail:v2:outbox:fields:id,slug": post_shapes_key("outbox")}, timeout=60)
+        cache.set("post_list", ["stale"])
+        
+        self.post.status = "published"
+        self.post.save()
+        Heading.objects.create(post=self.post, title="Intro", level=2, order=1)
+        
+        self.assertEqual(relay_events(), (2, 1))
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertIsNone(cache.get("post_detail:v2:outbox"))
+        self.assertIsNone(cache.get("post_detail:v2:outbox:fields:id,slug"))
+        self.assertIsNone(cache.get("post_list"))
+        
+        # The publication and the heading edit arrive as one event, only at the interested webhook
+        self.assertEqual(len(WebhookStubHandler.received), 1)
+        path, headers, body = WebhookStubHandler.received[0]
+        self.assertEqual(headers["X-Webhook-Signature"], sign("s3cret", body))
+        payload = json.loads(body)
+        self.assertEqual([event["topic"] for event in payload["events"]], ["post.published"])
+        
+        delivery = webhook.deliveries.get()
+        self.assertEqual(payload["delivery"], str(delivery.id))
+        self.assertEqual((delivery.status, delivery.attempts, delivery.response_status), ("delivered", 1, 200))
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2, WEBHOOK_RETRY_BASE_SECONDS=60)
+    def test_failed_deliveries_are_retried_with_backoff(self, delay):
+        Webhook.objects.create(name="Down", url=f"{self.base_url}/fail")
+        self.post.status = "published"
+        self.post.save()
+        
+        self.assertEqual(relay_events(), (1, 0))
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts, delivery.response_status), ("pending", 1, 503))
+        self.assertGreater(delivery.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        
+        # Not due yet, then given up after the last attempt
+        self.assertEqual(relay_events(), (0, 0))
+        self.assertEqual(len(WebhookStubHandler.received), 1)
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        relay_events()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ("failed", 2))
+
+
+@override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+@patch("apps.blog.tasks.relay_outbox.delay")
+class PostChangesViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.api_key = settings.VALID_API_KEYS[0]
+        self.url = reverse("post-changes")
+        self.category = Category.objects.create(name="Changes", slug="changes")
+        self.start = timezone.now() - timedelta(hours=1)
+        self.posts = [
+            Post.objects.create(
+                title=f"Changes {i}", description="Changes", content="Changes", slug=f"changes-{i}",
+                category=self.category, status="published",
+            )
+            for i in range(4)
+        ]
+        # Posts saved in the same instant are told apart by their id
+        Post.objects.update(updated_at=self.start)
+
+    def get(self, **params):
+        response = self.client.get(self.url, params, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()["results"]
+
+    def test_pages_follow_the_cursor(self, delay):
+        first = self.get(limit=3, fields="title")
+        self.assertTrue(first["has_more"])
+        self.assertEqual(list(first["changes"][0]["post"]), ["id", "title", "slug"])
+        second = self.get(limit=3, cursor=first["cursor"])
+        self.assertFalse(second["has_more"])
+        
+        ids = [change["id"] for change in first["changes"] + second["changes"]]
+        self.assertEqual(ids, sorted(str(post.id) for post in self.posts))
+        # Nothing changed since the last page
+        self.assertEqual(self.get(cursor=second["cursor"]), {"changes": [], "cursor": second["cursor"], "has_more": False})
+
+    def test_updates_unpublications_and_deletions(self, delay):
+        since = (self.start + timedelta(seconds=1)).isoformat()
+        self.assertEqual(self.get(since=since)["changes"], [])
+        
+        updated, unpublished, deleted, headed = self.posts
+        updated.title = "Updated"
+        updated.save()
+        unpublished.status = "draft"
+        unpublished.save()
+        deleted_id = deleted.id
+        deleted.delete()
+        Heading.objects.create(post=headed, title="Intro", level=2, order=1)
+        # Drafts that were never published are not part of the public history
+        Post.objects.create(title="Draft", description="Draft", content="Draft", slug="changes-draft", category=self.category)
+        Post.objects.create(
+            title="Deleted draft", description="Draft", content="Draft", slug="changes-deleted-draft", category=self.category
+        ).delete()
+        
+        with self.assertNumQueries(6):
+            changes = self.get(since=since)["changes"]
+        self.assertEqual(
+            [(change["slug"], change["change"]) for change in changes],
+            [("changes-0", "published"), ("changes-1", "unpublished"), ("changes-2", "deleted"), ("changes-3", "published")],
+        )
+        self.assertEqual(changes[0]["post"]["title"], "Updated")
+        self.assertNotIn("post", changes[1])
+        self.assertTrue(PostTombstone.objects.filter(id=deleted_id, slug="changes-2").exists())
+        self.assertFalse(PostTombstone.objects.filter(slug="changes-deleted-draft").exists())
+        self.assertIsNotNone(Post.objects.get(slug="changes-1").published_at)
+
+    def test_invalid_and_expired_cursors(self, delay):
+        response = self.client.get(self.url, {"cursor": "nope"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"since": "yesterday"}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        cursor = encode_cursor(timezone.now() - timedelta(days=settings.DELTA_SYNC_TOMBSTONE_DAYS + 1), self.posts[0].id)
+        response = self.client.get(self.url, {"cursor": cursor}, HTTP_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
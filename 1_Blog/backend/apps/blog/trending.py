@@ -0,0 +1,76 @@
+import math
+import time
+
+from django.conf import settings
+
+from core.redis_clients import get_redis, register_script
+
+redis_client = get_redis("analytics")
+
+# Sorted set of post slugs scored by exponentially decayed activity
+TRENDING_KEY = "trending:posts"
+# Reference time of the scores, increments are scaled by exp((now - epoch) / tau) so old
+# activity decays relative to new activity without touching every member on each event
+TRENDING_EPOCH_KEY = "trending:epoch"
+
+record_script = register_script("""
+local now = tonumber(ARGV[1])
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    epoch = now
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+local factor = math.exp((now - epoch) / tonumber(ARGV[2]))
+for i = 3, #ARGV, 2 do
+    redis.call('ZINCRBY', KEYS[1], tonumber(ARGV[i + 1]) * factor, ARGV[i])
+end
+return (#ARGV - 2) / 2
+""", namespace="analytics")
+
+rescale_script = register_script("""
+local now = tonumber(ARGV[1])
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+redis.call('SET', KEYS[2], ARGV[1])
+if not epoch then
+    return 0
+end
+local factor = math.exp((epoch - now) / tonumber(ARGV[2]))
+local entries = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #entries, 2 do
+    redis.call('ZADD', KEYS[1], tonumber(entries[i + 1]) * factor, entries[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[3])
+local max_size = tonumber(ARGV[4])
+if max_size > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -max_size - 1)
+end
+return #entries / 2
+""", namespace="analytics")
+
+
+def decay_seconds():
+    # Time constant of the exponential decay for the configured half life
+    return settings.TRENDING_HALF_LIFE_HOURS * 3600 / math.log(2)
+
+def record_trending_activity(events):
+    """
+    Add (slug, kind) events to the trending scores in one round trip, kind is view, click or impression
+    """
+    args = []
+    for slug, kind in events:
+        args.extend([slug, settings.TRENDING_WEIGHTS[kind]])
+
+    if args:
+        record_script(keys=[TRENDING_KEY, TRENDING_EPOCH_KEY], args=[time.time(), decay_seconds(), *args])
+
+def rescale_trending_scores():
+    """
+    Move the scores to the current epoch so they stay small, and trim the set
+    """
+    return rescale_script(
+        keys=[TRENDING_KEY, TRENDING_EPOCH_KEY],
+        args=[time.time(), decay_seconds(), settings.TRENDING_MIN_SCORE, settings.TRENDING_MAX_POSTS],
+    )
+
+def get_trending_slugs(limit):
+    return [slug.decode("utf-8") for slug in redis_client.zrevrange(TRENDING_KEY, 0, limit - 1)]
@@ -3,13 +3,31 @@ from django.urls import path
 from .views import (
     PostListView, 
     PostDetailView, 
+    PostBatchDetailView,
+    PostChangesView,
     PostHeadingsView, 
-    IncrementPostClicksView
+    IncrementPostClicksView,
+    PostDwellTimeView,
+    PostAnalyticsTrendView,
+    TrendingPostListView,
+    AnalyticsExportView,
+    SitemapIndexView,
+    SitemapShardView,
+    PostFeedView,
 )
 
 urlpatterns = [
     path("posts/", PostListView.as_view(), name="post-list"),
+    path("posts/trending/", TrendingPostListView.as_view(), name="post-trending"),
     path("posts/clicks/", IncrementPostClicksView.as_view(), name="increment-post-clicks"),
     path("post/", PostDetailView.as_view(), name="post-detail"),
+    path("posts/batch/", PostBatchDetailView.as_view(), name="post-batch"),
+    path("posts/changes/", PostChangesView.as_view(), name="post-changes"),
     path("posts/headings/", PostHeadingsView.as_view(), name="post-headings"),
+    path("posts/dwell/", PostDwellTimeView.as_view(), name="post-dwell-time"),
+    path("posts/analytics/trend/", PostAnalyticsTrendView.as_view(), name="post-analytics-trend"),
+    path("analytics/export/", AnalyticsExportView.as_view(), name="analytics-export"),
+    path("sitemap/", SitemapIndexView.as_view(), name="sitemap-index"),
+    path("sitemap/<str:shard>/", SitemapShardView.as_view(), name="sitemap-shard"),
+    path("feed/<str:feed_format>/", PostFeedView.as_view(), name="post-feed"),
 ]
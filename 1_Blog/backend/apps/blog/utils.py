@@ -1,3 +1,10 @@
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     
@@ -6,4 +13,42 @@ def get_client_ip(request):
     else:
         ip = request.META.get('REMOTE_ADDR')
     
-    return ip
\ No newline at end of file
+    return ip
+
+# Cheap user agent check used to drop analytics events sent by crawlers
+BOT_USER_AGENT_KEYWORDS = ("bot", "crawl", "spider", "slurp", "headless", "preview")
+
+def is_bot_request(request):
+    user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
+    
+    if not user_agent:
+        return True
+    
+    return any(keyword in user_agent for keyword in BOT_USER_AGENT_KEYWORDS)
+
+
+def uuid7(timestamp=None, rng=None):
+    """
+    Build a time-ordered UUID (version 7): 48 bits of unix milliseconds, then the
+    sub-millisecond fraction and random bits, so new ids land at the end of the index.
+    An optional datetime can be passed to derive the id of an existing row, and a
+    random.Random to make the random bits reproducible.
+    """
+    nanoseconds = int(timestamp.timestamp() * 1_000_000_000) if timestamp else time.time_ns()
+    milliseconds, remainder = divmod(nanoseconds, 1_000_000)
+    sub_millisecond = remainder * 4096 // 1_000_000
+    random_bits = (rng.getrandbits(64) if rng else int.from_bytes(os.urandom(8), "big")) & ((1 << 62) - 1)
+    
+    value = (milliseconds & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= sub_millisecond << 64
+    value |= 0b10 << 62
+    value |= random_bits
+    return uuid.UUID(int=value)
+
+# Default primary key for the high insert tables, time-ordered ids are opt-in with TIME_ORDERED_UUIDS
+def time_ordered_uuid():
+    if getattr(settings, "TIME_ORDERED_UUIDS", False):
+        return uuid7()
+    return uuid.uuid4()
+
@@ -3,22 +3,68 @@ from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework_api.views import StandardAPIView
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound, APIException
-from rest_framework import permissions
+from rest_framework import permissions, status
+from rest_framework.parsers import JSONParser, FormParser
 
-from .models import Post, Heading, PostViews, PostAnalytics
-from .serializers import PostListSerializer, PostSerializer, HeadingSerializer, PostViewsSerializer
-from .utils import get_client_ip
+from .models import Post, Heading, PostViews, PostAnalytics, PostAnalyticsRollup
+from .serializers import HeadingSerializer, PostViewsSerializer
+from .utils import get_client_ip, is_bot_request
+from .parsers import PlainTextJSONParser
+from .trending import record_trending_activity, get_trending_slugs
+from .flush import BACKLOG_KEY, buffer_counters, record_backlog
+from .related import get_related_posts, get_many_related_posts
+from .fast_serializers import (
+    LIST_FIELDS,
+    DETAIL_FIELDS,
+    resolve_fields,
+    fields_cache_suffix,
+    serialize_post_list,
+    serialize_post_detail,
+    serialize_post_details,
+)
+from .response_cache import (
+    POST_LIST_KEYS,
+    cache_tracked,
+    encode_body,
+    encoded_response,
+    post_detail_key,
+    post_shapes_key,
+    render_api_response,
+)
+from .exports import DATASETS, FORMATS, parse_date_bound, export_rows, render_export, stream_export
+from .changes import CursorError, changes_since, cursor_from_since, decode_cursor, is_expired, START_CURSOR
+from .sitemaps import (
+    SITEMAP_INDEX_KEY,
+    SITEMAP_SHARD_KEY,
+    SITEMAP_CONTENT_TYPE,
+    FEED_KEY,
+    FEED_FORMATS,
+    shard_bounds,
+    shard_parts_key,
+    render_sitemap_index,
+    render_sitemap_shard,
+    render_feed,
+    cached_document,
+    document_response,
+)
 from .tasks import increment_post_impressions
 from core.permissions import HasValidAPIKey
+from core.renderers import FastJSONRenderer
+from core.instrumentation import timed, record_cache_lookup
+from core.redis_clients import get_redis, increment_counters
+
+from datetime import timedelta
 
-import redis
 from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 # Manual cache
 from django.core.cache import cache
 from .utils import get_client_ip
 from .tasks import increment_post_views
 
-redis_client = redis.Redis(host=settings.REDIS_HOST, port=6379, db=0)
+redis_client = get_redis("analytics")
 
 
 # class PostListView(ListAPIView):
@@ -30,38 +76,63 @@ class PostListView(StandardAPIView):
     
     # @method_decorator(cache_page(60 * 1)) # Cache for 1 minute
     
+    def increment_impressions(self, posts):
+        # Increment the impressions on post id in redis, in one command
+        buffer_counters("impressions", {post_id: 1 for post_id, _ in posts})
+        record_trending_activity((slug, "impression") for _, slug in posts)
+    
     def get(self, request, *args, **kwargs):
+        # ?fields= and ?include= trim the columns selected and the payload, each shape is cached apart
         try:
-            # Verify if the posts are cached
-            chached_posts = cache.get("post_list")
-            if chached_posts:
-                # Increment the impressions on post id in redis and return the cached posts
-                for post in chached_posts:
-                    redis_client.incr(f"post:impressions:{post['id']}")
-                return self.paginate_response_with_extra(request, chached_posts, extra_data={"total_posts": len(chached_posts)})
-            
-            # Get the posts if not cached
-            posts = Post.post_published.all()
-            
-            if not posts.exists():
-                raise NotFound(detail="Posts do not exist")
-            
-            # Serialize the posts
-            serialized_posts = PostListSerializer(posts, many=True).data
-            
-            # Set the posts in cache
-            cache.set("post_list", serialized_posts, timeout=60 * 5) # Cache for 5 minutes
-            
-            # Increment the impressions on post id in redis
-            for post in posts:
-                redis_client.incr(f"post:impressions:{post.id}")
+            fields = resolve_fields(request.query_params, LIST_FIELDS)
+        except ValueError as e:
+            return self.error(str(e))
+        posts_key = "post_list" + fields_cache_suffix(fields)
+        
+        # Every page is cached already rendered (and compressed), the links in it depend on the host
+        page_key = "post_list:page:{}:{}:{}{}".format(
+            request.get_host(), request.query_params.get("p", 1), request.query_params.get("page_size", ""),
+            fields_cache_suffix(fields),
+        )
+        
+        try:
+            # Verify if the page is cached
+            cached = cache.get_many(["post_list:ids", page_key])
+            record_cache_lookup("post_list:ids" in cached and page_key in cached)
+            if "post_list:ids" in cached and page_key in cached:
+                self.increment_impressions(cached["post_list:ids"])
+                return encoded_response(request, cached[page_key])
             
-        except Post.DoesNotExist:
-            raise NotFound(detail="Posts do not exist")
+            # Verify if the posts are cached
+            serialized_posts = cache.get(posts_key)
+            if not serialized_posts:
+                # Get the posts if not cached and serialize them (same output as PostListSerializer)
+                with timed("serialize"):
+                    serialized_posts = serialize_post_list(Post.post_published.all(), fields)
+                
+                if serialized_posts:
+                    # Set the posts in cache, the ?fields= shapes and the pages are tracked for the purge of the outbox relay
+                    trackers = {posts_key: POST_LIST_KEYS} if fields is not None else {}
+                    cache_tracked({
+                        posts_key: serialized_posts,
+                        "post_list:ids": [(post["id"], post["slug"]) for post in serialized_posts],
+                    }, trackers, timeout=60 * 5) # Cache for 5 minutes
         except Exception as e:
             raise APIException(detail=f"An unexpected error occurred: {str(e)}")
         
-        return self.paginate_response_with_extra(request, serialized_posts, extra_data={"total_posts": posts.count()})
+        if not serialized_posts:
+            raise NotFound(detail="Posts do not exist")
+        
+        self.increment_impressions([(post["id"], post["slug"]) for post in serialized_posts])
+        
+        response = self.paginate_response_with_extra(request, serialized_posts, extra_data={"total_posts": len(serialized_posts)})
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        
+        with timed("serialize"):
+            encoded_page = encode_body(FastJSONRenderer().render(response.data))
+        cache_tracked({page_key: encoded_page}, {page_key: POST_LIST_KEYS}, timeout=60 * 5) # Cache for 5 minutes
+        return encoded_response(request, encoded_page)
 
 
 # class PostDetailView(RetrieveAPIView):
@@ -75,25 +146,33 @@ class PostDetailView(StandardAPIView):
     def get(self, request):
         ip_address = get_client_ip(request)
         slug = request.query_params.get("slug")
+        try:
+            fields = resolve_fields(request.query_params, DETAIL_FIELDS)
+        except ValueError as e:
+            return self.error(str(e))
+        detail_key = post_detail_key(slug, fields_cache_suffix(fields))
         
         try:
-            # Verify if the data is cached
-            chached_post = cache.get(f"post_detail:{slug}")
-            if chached_post:
-                increment_post_views.delay(chached_post["slug"], ip_address)
-                return self.response(chached_post)
-            
-            # Get the post if not cached from the db
-            post = Post.post_published.get(slug=slug)
+            # Verify if the response is cached, it is stored rendered and compressed
+            cached_post = cache.get(detail_key)
+            record_cache_lookup(bool(cached_post))
+            if cached_post:
+                increment_post_views.delay(slug, ip_address)
+                return encoded_response(request, cached_post)
             
-            if not post:
-                raise NotFound(detail="Post does not exist")
+            # Get the post if not cached from the db and serialize it (same output as PostSerializer)
+            with timed("serialize"):
+                serialized_post = serialize_post_detail(Post.post_published.filter(slug=slug), fields)
             
-            # Serialize the post
-            serialized_post = PostSerializer(post).data
+            # The related posts are precomputed in the cache
+            if fields is None or "related_posts" in fields:
+                serialized_post["related_posts"] = get_related_posts(serialized_post["id"])
             
-            # Set the post in cache
-            cache.set(f"post_detail:{slug}", serialized_post, timeout=60 * 5) # Cache for 5 minutes
+            # Set the post in cache, the ?fields= shapes are tracked for the purge of the outbox relay
+            with timed("serialize"):
+                encoded_post = encode_body(render_api_response(serialized_post))
+            trackers = {detail_key: post_shapes_key(slug)} if fields is not None else {}
+            cache_tracked({detail_key: encoded_post}, trackers, timeout=60 * 5) # Cache for 5 minutes
             
             # Increment views count
             increment_post_views.delay(slug, ip_address)
@@ -102,7 +181,80 @@ class PostDetailView(StandardAPIView):
         except Exception as e:
             raise APIException(detail=f"An unexpected error occurred: {str(e)}")
         
-        return self.response(serialized_post)
+        return encoded_response(request, encoded_post)
+
+
+class PostBatchDetailView(StandardAPIView):
+    permission_classes = [HasValidAPIKey]
+    
+    def get(self, request):
+        """
+        Return the details of many posts (?slugs=a,b,c) in one request, for static site builds.
+        Build traffic is not counted as views
+        """
+        slugs = list(dict.fromkeys(slug for slug in request.query_params.get("slugs", "").split(",") if slug))
+        try:
+            fields = resolve_fields(request.query_params, DETAIL_FIELDS)
+        except ValueError as e:
+            return self.error(str(e))
+        if not slugs:
+            return self.error("At least one post slug is required")
+        if len(slugs) > settings.POST_BATCH_MAX_SLUGS:
+            return self.error(f"At most {settings.POST_BATCH_MAX_SLUGS} slugs are allowed per request")
+        
+        # Payloads are cached as data, the detail view caches rendered and compressed bodies
+        keys = {slug: f"post_detail_data:{slug}{fields_cache_suffix(fields)}" for slug in slugs}
+        posts = cache.get_many(list(keys.values()))
+        missing = [slug for slug in slugs if keys[slug] not in posts]
+        record_cache_lookup(not missing)
+        if missing:
+            with timed("serialize"):
+                fresh_posts = serialize_post_details(Post.post_published.filter(slug__in=missing), fields)
+            if fields is None or "related_posts" in fields:
+                related = get_many_related_posts([post["id"] for post in fresh_posts])
+                for post in fresh_posts:
+                    post["related_posts"] = related[post["id"]]
+            fresh = {keys[post["slug"]]: post for post in fresh_posts}
+            # The ?fields= shapes are tracked for the purge of the outbox relay
+            trackers = {keys[slug]: post_shapes_key(slug) for slug in missing} if fields is not None else {}
+            cache_tracked(fresh, trackers, timeout=60 * 5) # Cache for 5 minutes
+            posts.update(fresh)
+        
+        return self.response({
+            "posts": [posts[keys[slug]] for slug in slugs if keys[slug] in posts],
+            "missing": [slug for slug in slugs if keys[slug] not in posts],
+        })
+
+
+class PostChangesView(StandardAPIView):
+    permission_classes = [HasValidAPIKey]
+    
+    def get(self, request):
+        """
+        Return the posts published, updated, unpublished or deleted after ?cursor= (or ?since=, an
+        ISO 8601 datetime), every post without either. Follow the returned cursor while has_more
+        """
+        try:
+            fields = resolve_fields(request.query_params, LIST_FIELDS)
+            limit = min(max(int(request.query_params.get("limit", settings.DELTA_SYNC_PAGE_SIZE)), 1), settings.DELTA_SYNC_MAX_PAGE_SIZE)
+        except ValueError as e:
+            return self.error(str(e))
+        
+        try:
+            if "cursor" in request.query_params:
+                position = decode_cursor(request.query_params["cursor"])
+            elif "since" in request.query_params:
+                position = cursor_from_since(request.query_params["since"])
+            else:
+                position = START_CURSOR
+        except CursorError as e:
+            return self.error(str(e))
+        if is_expired(position):
+            return self.error("The cursor is older than the deleted posts history, start a full sync", status=status.HTTP_410_GONE)
+        
+        with timed("serialize"):
+            changes = changes_since(position, limit, fields)
+        return self.response(changes)
 
 
 # class PostHeadingsView(ListAPIView):
@@ -138,20 +290,240 @@ class IncrementPostClicksView(StandardAPIView):
         """
         data = request.data
         try:
-            post = Post.post_published.get(slug=data.get("slug"))
+            post = Post.post_published.only("id", "slug").get(slug=data.get("slug"))
         except Post.DoesNotExist:
             raise NotFound(detail="Post does not exist")
         
-        try:
-            post_analytics = PostAnalytics.objects.get(post=post)
-            post_analytics.increment_clicks()
-            post_analytics.save()
-        except PostAnalytics.DoesNotExist:
+        clicks = PostAnalytics.objects.filter(post=post).values_list("clicks", flat=True).first()
+        if clicks is None:
             raise NotFound(detail="Post analytics does not exist")
+        
+        # The click is buffered in redis like the impressions, the clicks flush job adds it to the
+        # analytics and the rollups. The response counts the clicks still in the buffer
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.incr(f"post:clicks:{post.id}")
+            record_backlog(pipe, "clicks")
+            buffered = pipe.execute()[0]
+            record_trending_activity([(post.slug, "click")])
         except Exception as e:
             raise APIException(detail=f"An unexpected error occurred while updating post analytics: {str(e)}")
         
         return self.response({
             "message": "Post clicks incremented successfully",
-            "clicks": post_analytics.clicks 
-        })
\ No newline at end of file
+            "clicks": clicks + buffered
+        })
+
+
+class TrendingPostListView(StandardAPIView):
+    permission_classes = [HasValidAPIKey]
+    
+    def get(self, request):
+        """
+        Return the posts with the most recent activity, hydrated from the post card cache
+        """
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            return self.error("Limit must be a number")
+        
+        # Ask for a few extra slugs in case some of them are no longer published
+        slugs = get_trending_slugs(limit * 2)
+        cards = cache.get_many([f"post_card:{slug}" for slug in slugs])
+        
+        missing = [slug for slug in slugs if f"post_card:{slug}" not in cards]
+        record_cache_lookup(not missing)
+        if missing:
+            with timed("serialize"):
+                posts = serialize_post_list(Post.post_published.filter(slug__in=missing))
+            fresh_cards = {f"post_card:{post['slug']}": post for post in posts}
+            cache.set_many(fresh_cards, timeout=60 * 5) # Cache for 5 minutes
+            cards.update(fresh_cards)
+        
+        trending_posts = [cards[f"post_card:{slug}"] for slug in slugs if f"post_card:{slug}" in cards]
+        
+        return self.response(trending_posts[:limit])
+
+
+class PostDwellTimeView(StandardAPIView):
+    # navigator.sendBeacon cannot send custom headers, so this endpoint does not require the API key
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    parser_classes = [JSONParser, PlainTextJSONParser, FormParser]
+    
+    def post(self, request):
+        """
+        Record how long a reader stayed on a post, buffered in redis until the next sync
+        """
+        slug = request.data.get("slug")
+        if not slug or not isinstance(slug, str) or len(slug) > Post._meta.get_field("slug").max_length:
+            return self.error("A post slug is required")
+        
+        try:
+            seconds = float(request.data.get("seconds"))
+        except (TypeError, ValueError):
+            return self.error("A numeric amount of seconds is required")
+        
+        # Drop bots, bounces and forgotten tabs without touching redis
+        if is_bot_request(request) or not (
+            settings.DWELL_TIME_MIN_SECONDS <= seconds <= settings.DWELL_TIME_MAX_SECONDS
+        ):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        # Anyone can post here, only the slugs of published posts get a buffer in redis
+        if not self.is_published(slug):
+            return self.error("Post does not exist", status=status.HTTP_404_NOT_FOUND)
+        
+        # Keep a running sum and count per post, the mean is computed when syncing to the db
+        increment_counters({
+            (f"post:dwell:{slug}", "sum"): seconds,
+            (f"post:dwell:{slug}", "count"): 1,
+            BACKLOG_KEY.format("dwell"): 1,
+        }, client=redis_client)
+        
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    def is_published(self, slug):
+        # Published slugs are remembered for a while, a beacon is sent on every page exit
+        key = f"post_published:{slug}"
+        if cache.get(key):
+            return True
+        if not Post.post_published.filter(slug=slug).exists():
+            return False
+        cache.set(key, True, timeout=60 * 5)
+        return True
+
+
+class PostAnalyticsTrendView(StandardAPIView):
+    permission_classes = [HasValidAPIKey]
+    
+    # Default time window for each period when no start date is given
+    default_windows = {
+        "hour": timedelta(days=2),
+        "day": timedelta(days=30),
+        "month": timedelta(days=365),
+    }
+    
+    def parse_date(self, value, default):
+        if not value:
+            return default
+        
+        date = parse_datetime(value)
+        if date is None:
+            raise ValueError(f"Invalid date: {value}")
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        return date
+    
+    def get(self, request):
+        """
+        Return views, impressions, clicks, CTR and dwell time of a post per hour, day or month
+        """
+        slug = request.query_params.get("slug")
+        period = request.query_params.get("period", "day")
+        if period not in self.default_windows:
+            return self.error("Period must be one of: hour, day, month")
+        
+        try:
+            end = self.parse_date(request.query_params.get("end"), timezone.now())
+            start = self.parse_date(request.query_params.get("start"), end - self.default_windows[period])
+        except ValueError as e:
+            return self.error(str(e))
+        
+        try:
+            post = Post.post_published.only("id").get(slug=slug)
+        except Post.DoesNotExist:
+            raise NotFound(detail="Post does not exist")
+        
+        trend = []
+        for row in PostAnalyticsRollup.objects.trend(post.id, period, start, end):
+            impressions = row["total_impressions"]
+            dwell_count = row["total_dwell_count"]
+            trend.append({
+                "bucket": row["period_bucket"].isoformat(),
+                "views": row["total_views"],
+                "impressions": impressions,
+                "clicks": row["total_clicks"],
+                "clicks_through_rate": (row["total_clicks"] / impressions) * 100 if impressions else 0,
+                "avg_time_on_page": row["total_dwell_sum"] / dwell_count if dwell_count else 0,
+            })
+        
+        return self.response(trend)
+
+
+class AnalyticsExportView(StandardAPIView):
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        """
+        Stream PostAnalytics or PostViews rows as CSV or NDJSON, filtered by date range and category
+        """
+        dataset = request.query_params.get("dataset", "analytics")
+        # "format" is reserved by DRF to pick a renderer
+        export_format = request.query_params.get("output", "csv")
+        if dataset not in DATASETS:
+            return self.error(f"Dataset must be one of: {', '.join(DATASETS)}")
+        if export_format not in FORMATS:
+            return self.error(f"Output must be one of: {', '.join(FORMATS)}")
+        
+        try:
+            start = parse_date_bound(request.query_params.get("start"))
+            end = parse_date_bound(request.query_params.get("end"), end=True)
+        except ValueError as e:
+            return self.error(str(e))
+        
+        header, rows = export_rows(dataset, start, end, request.query_params.get("category"))
+        content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+        
+        response = StreamingHttpResponse(
+            stream_export(render_export(export_format, header, rows)), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.{export_format}"'
+        return response
+
+
+class SitemapIndexView(StandardAPIView):
+    # Crawlers do not have an API key
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    
+    def get(self, request):
+        """
+        Sitemap index with one sitemap per month of published posts, or per part of a big month
+        """
+        document = cached_document(SITEMAP_INDEX_KEY, render_sitemap_index)
+        return document_response(request, document, SITEMAP_CONTENT_TYPE)
+
+
+class SitemapShardView(StandardAPIView):
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    
+    def get(self, request, shard):
+        """
+        Sitemap of the posts published in a month ("YYYY-MM"), or in a part of a big month ("YYYY-MM-2")
+        """
+        if shard_bounds(shard) is None:
+            raise NotFound(detail="Sitemap does not exist")
+        
+        document = cached_document(
+            SITEMAP_SHARD_KEY.format(shard), lambda: render_sitemap_shard(shard), tracker=shard_parts_key(shard)
+        )
+        if document is None:
+            raise NotFound(detail="Sitemap does not exist")
+        return document_response(request, document, SITEMAP_CONTENT_TYPE)
+
+
+class PostFeedView(StandardAPIView):
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    
+    def get(self, request, feed_format):
+        """
+        RSS or Atom feed of the latest published posts
+        """
+        if feed_format not in FEED_FORMATS:
+            raise NotFound(detail="Feed does not exist")
+        
+        document = cached_document(FEED_KEY.format(feed_format), lambda: render_feed(feed_format))
+        return document_response(request, document, FEED_FORMATS[feed_format][1])
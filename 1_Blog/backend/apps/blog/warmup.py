@@ -0,0 +1,103 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .fast_serializers import serialize_post_list, serialize_post_details
+from .models import Post, PostAnalytics, PostAnalyticsRollup
+from .related import get_many_related_posts
+from .response_cache import encode_body, post_detail_key, render_api_response
+
+# Same timeout as the views filling these keys
+WARM_CACHE_SECONDS = 60 * 5
+
+
+def posts_by_traffic(limit=None):
+    """
+    Ids of the published posts, most viewed over the last WARMUP_TRAFFIC_DAYS first, then by all time
+    views and newest first
+    """
+    since = timezone.now() - timedelta(days=settings.WARMUP_TRAFFIC_DAYS)
+    recent_views = (
+        PostAnalyticsRollup.objects.filter(post=OuterRef("pk"), bucket__gte=since)
+        .order_by()
+        .values("post")
+        .annotate(total=Sum("views"))
+        .values("total")
+    )
+    total_views = PostAnalytics.objects.filter(post=OuterRef("pk")).values("views")[:1]
+    ids = (
+        Post.post_published.annotate(recent_views=Subquery(recent_views), total_views=Subquery(total_views))
+        .order_by(F("recent_views").desc(nulls_last=True), F("total_views").desc(nulls_last=True), "-created_at")
+        .values_list("id", flat=True)
+    )
+    return list(ids[:limit] if limit else ids)
+
+def warm_post_list():
+    """
+    Fill the cached post list read by PostListView, return the number of posts
+    """
+    serialized_posts = serialize_post_list(Post.post_published.all())
+    if serialized_posts:
+        cache.set_many({
+            "post_list": serialized_posts,
+            "post_list:ids": [(post["id"], post["slug"]) for post in serialized_posts],
+        }, timeout=WARM_CACHE_SECONDS)
+    return len(serialized_posts)
+
+def warm_post_chunk(post_ids):
+    """
+    Serialize a chunk of posts and fill their detail caches (rendered body and batch payload) in
+    one pipelined set_many, return the number of posts
+    """
+    posts = serialize_post_details(Post.post_published.filter(id__in=post_ids))
+    related = get_many_related_posts([post["id"] for post in posts])
+    entries = {}
+    for post in posts:
+        post["related_posts"] = related[post["id"]]
+        entries[post_detail_key(post["slug"])] = encode_body(render_api_response(post))
+        entries[f"post_detail_data:{post['slug']}"] = post
+    cache.set_many(entries, timeout=WARM_CACHE_SECONDS)
+    return len(posts)
+
+def warm_post_chunk_in_thread(post_ids):
+    try:
+        return warm_post_chunk(post_ids)
+    finally:
+        # Every worker thread opens its own database connection
+        connections.close_all()
+
+def warm_blog_cache(limit=None, chunk_size=None, concurrency=None, progress=None):
+    """
+    Fill the post list and the post detail caches, the most visited posts first, with at most
+    concurrency chunks of chunk_size posts in flight. progress(done, total, elapsed) is called
+    after every chunk. Return {"posts", "list_posts", "seconds"}
+    """
+    chunk_size = chunk_size or settings.WARMUP_CHUNK_SIZE
+    concurrency = concurrency or settings.WARMUP_CONCURRENCY
+    started = time.monotonic()
+
+    list_posts = warm_post_list()
+    post_ids = posts_by_traffic(limit)
+    chunks = [post_ids[start:start + chunk_size] for start in range(0, len(post_ids), chunk_size)]
+
+    done = 0
+    if concurrency > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # map() keeps the traffic order of the results, progress follows the hottest chunks
+            for warmed in executor.map(warm_post_chunk_in_thread, chunks):
+                done += warmed
+                if progress:
+                    progress(done, len(post_ids), time.monotonic() - started)
+    else:
+        for chunk in chunks:
+            done += warm_post_chunk(chunk)
+            if progress:
+                progress(done, len(post_ids), time.monotonic() - started)
+
+    return {"posts": done, "list_posts": list_posts, "seconds": time.monotonic() - started}
@@ -0,0 +1,96 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# {"primary", "wrote"} of the current request, None outside of replica_scope()
+_scope = ContextVar("replica_scope", default=None)
+# replica alias -> (checked at, lag in seconds)
+_replica_lag = {}
+
+REPLICA_LAG_SQL = """
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+
+@contextmanager
+def replica_scope(primary=False):
+    """
+    Reads of the block go to the primary when primary is set, or after its first write (read-your-writes)
+    """
+    scope = {"primary": primary, "wrote": False}
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+def use_primary():
+    return replica_scope(primary=True)
+
+def replica_lag(alias):
+    """
+    Replication lag of a replica in seconds, checked at most every DATABASE_REPLICA_LAG_CHECK_SECONDS
+    """
+    now = time.monotonic()
+    checked_at, lag = _replica_lag.get(alias, (None, 0))
+    if checked_at is not None and now - checked_at < settings.DATABASE_REPLICA_LAG_CHECK_SECONDS:
+        return lag
+
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        lag = 0
+    else:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0] or 0)
+        except DatabaseError as e:
+            # An unreachable replica is skipped until the next check
+            logger.warning("Could not check the lag of the %s database: %s", alias, str(e))
+            lag = float("inf")
+    _replica_lag[alias] = (now, lag)
+    return lag
+
+
+class ReplicaRouter:
+    """
+    Send the reads of published content (DATABASE_REPLICA_MODELS) to a random replica of
+    DATABASE_REPLICAS lagging less than REPLICA_STALENESS_SECONDS. Writes, migrations, atomic
+    blocks and pinned requests use the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        scope = _scope.get()
+        if not settings.DATABASE_REPLICAS or (scope and scope["primary"]):
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower not in settings.DATABASE_REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if replica_lag(alias) <= settings.REPLICA_STALENESS_SECONDS
+        ]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None:
+            scope["primary"] = scope["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
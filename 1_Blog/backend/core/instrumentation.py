@@ -0,0 +1,133 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+from celery.signals import before_task_publish, after_task_publish
+
+# Timings of the request being handled, None outside of PerformanceMiddleware
+_current_timings = ContextVar("request_timings", default=None)
+_installed = False
+
+
+class RequestTimings:
+    """
+    Time and count spent per component (db, redis, serialize, broker...) during one request
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.cache_lookups = {"hit": 0, "miss": 0}
+        # Sum of every recorded duration, lets timed() blocks exclude the work nested in them
+        self.tracked = 0.0
+        self.publish_started = None
+
+    def add(self, name, seconds, count=1):
+        self.durations[name] += seconds
+        self.counts[name] += count
+        self.tracked += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def get_current_timings():
+    return _current_timings.get()
+
+@contextmanager
+def track_request():
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+@contextmanager
+def timed(name):
+    """
+    Record the time of a block under name, minus the db, redis or other timed work nested in it
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    started, tracked = time.perf_counter(), timings.tracked
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings.add(name, max(elapsed - (timings.tracked - tracked), 0))
+
+def record_cache_lookup(hit):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.cache_lookups["hit" if hit else "miss"] += 1
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    # Installed on every connection by PerformanceMiddleware with connection.execute_wrapper()
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", time.perf_counter() - started)
+
+
+def install():
+    """
+    Hook redis-py and the celery publish signals, once per process
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    execute_command = redis.Redis.execute_command
+    execute_pipeline = redis.client.Pipeline.execute
+
+    # Redis calls made while publishing a task are part of the broker time
+    def timed_command(client, *args, **kwargs):
+        timings = _current_timings.get()
+        if timings is None or timings.publish_started is not None:
+            return execute_command(client, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return execute_command(client, *args, **kwargs)
+        finally:
+            timings.add("redis", time.perf_counter() - started)
+
+    def timed_pipeline(pipe, *args, **kwargs):
+        timings = _current_timings.get()
+        if timings is None or timings.publish_started is not None or not pipe.command_stack:
+            return execute_pipeline(pipe, *args, **kwargs)
+        commands = len(pipe.command_stack)
+        started = time.perf_counter()
+        try:
+            return execute_pipeline(pipe, *args, **kwargs)
+        finally:
+            timings.add("redis", time.perf_counter() - started, count=commands)
+
+    redis.Redis.execute_command = timed_command
+    redis.client.Pipeline.execute = timed_pipeline
+
+    before_task_publish.connect(task_publish_started, weak=False)
+    after_task_publish.connect(task_published, weak=False)
+
+def task_publish_started(**kwargs):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.publish_started = time.perf_counter()
+
+def task_published(**kwargs):
+    timings = _current_timings.get()
+    if timings is not None and timings.publish_started is not None:
+        timings.add("broker", time.perf_counter() - timings.publish_started)
+        timings.publish_started = None
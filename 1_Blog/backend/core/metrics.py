@@ -0,0 +1,213 @@
+import atexit
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from apps.blog.api_keys import get_api_key_usage
+from core.redis_clients import get_redis, pipeline, probe
+
+redis_client = get_redis()
+
+# Every counter and histogram lives in one redis hash so all the web and celery processes
+# add to the same numbers. Fields are "<name>|<labels>|<suffix>", histogram buckets are
+# stored per bucket and made cumulative when rendering.
+METRICS_KEY = "metrics:values"
+
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help)
+METRICS = {
+    "blog_http_requests_total": ("counter", "Requests handled, per view, method and status"),
+    "blog_http_request_duration_seconds": ("histogram", "Time to build the response, per view"),
+    "blog_http_db_duration_seconds": ("histogram", "Time spent in database queries per request, per view"),
+    "blog_http_db_queries_total": ("counter", "Database queries, per view"),
+    "blog_http_redis_duration_seconds": ("histogram", "Time spent in redis commands per request, per view"),
+    "blog_http_redis_commands_total": ("counter", "Redis commands, per view"),
+    "blog_http_serialize_duration_seconds": ("histogram", "Time spent serializing per request, per view"),
+    "blog_http_broker_publish_duration_seconds": ("histogram", "Time spent publishing celery tasks per request, per view"),
+    "blog_cache_lookups_total": ("counter", "Response cache lookups, per view and result"),
+    "blog_api_key_requests_total": ("counter", "Requests accepted, per API key"),
+    "blog_api_key_throttled_total": ("counter", "Requests rejected by the rate limit, per API key"),
+    "blog_tasks_total": ("counter", "Celery tasks run, per task and final state"),
+    "blog_task_failures_total": ("counter", "Celery tasks that raised, per task and exception"),
+    "blog_task_duration_seconds": ("histogram", "Run time of celery tasks, per task"),
+    "blog_task_queue_latency_seconds": ("histogram", "Time between publishing a celery task (or its eta) and a worker starting it, per task"),
+    "blog_celery_queue_length": ("gauge", "Messages waiting in the broker, per queue"),
+    "blog_redis_up": ("gauge", "Whether the redis of a namespace answered a ping"),
+    "blog_redis_ping_seconds": ("gauge", "Median ping round trip to the redis of a namespace"),
+}
+
+# Kombu's redis transport keeps one list per priority step, "<queue>" for priority 0
+QUEUE_PRIORITY_SEPARATOR = "\x06\x16"
+QUEUE_PRIORITY_STEPS = (0, 3, 6, 9)
+
+
+def label_string(labels):
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return ",".join(f'{name}="{value}"' for name, value in escaped)
+
+def increment(pipe, name, labels, amount=1):
+    pipe.hincrbyfloat(METRICS_KEY, f"{name}|{label_string(labels)}|", amount)
+
+def observe(pipe, name, labels, value):
+    labels = label_string(labels)
+    bucket = next((bound for bound in HISTOGRAM_BUCKETS if value <= bound), "+Inf")
+    pipe.hincrby(METRICS_KEY, f"{name}|{labels}|{bucket}", 1)
+    pipe.hincrbyfloat(METRICS_KEY, f"{name}|{labels}|sum", value)
+
+
+class MetricsBuffer:
+    """
+    Stand-in for a pipeline adding to the metrics hash: the increments are summed in the process
+    and sent as one HINCRBY or HINCRBYFLOAT per field by flush()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flushed_at = time.monotonic()
+
+    def add(self, field, amount, command):
+        with self.lock:
+            total, _ = self.values.get(field, (0, command))
+            self.values[field] = (total + amount, command)
+
+    def hincrby(self, key, field, amount=1):
+        self.add(field, amount, "hincrby")
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        self.add(field, amount, "hincrbyfloat")
+
+    def due(self):
+        return time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_SECONDS
+
+    def flush(self):
+        with self.lock:
+            values, self.values = self.values, {}
+            self.flushed_at = time.monotonic()
+        if not values:
+            return
+        with pipeline() as pipe:
+            for field, (amount, command) in values.items():
+                getattr(pipe, command)(METRICS_KEY, field, amount)
+
+# Request and task metrics are summed per process, one round trip every METRICS_FLUSH_SECONDS instead
+# of one per request or task. A process that dies loses at most that window
+metrics_buffer = MetricsBuffer()
+atexit.register(metrics_buffer.flush)
+
+
+def record_request_metrics(view, method, status, timings):
+    """
+    Add the timings of one request to the metrics, sent to redis with the next flush
+    """
+    labels = {"view": view}
+    buffer = metrics_buffer
+    increment(buffer, "blog_http_requests_total", {"view": view, "method": method, "status": status})
+    observe(buffer, "blog_http_request_duration_seconds", labels, timings.elapsed())
+    observe(buffer, "blog_http_db_duration_seconds", labels, timings.durations["db"])
+    observe(buffer, "blog_http_redis_duration_seconds", labels, timings.durations["redis"])
+    for name, metric in (("serialize", "blog_http_serialize_duration_seconds"),
+                         ("broker", "blog_http_broker_publish_duration_seconds")):
+        if timings.counts[name]:
+            observe(buffer, metric, labels, timings.durations[name])
+    if timings.counts["db"]:
+        increment(buffer, "blog_http_db_queries_total", labels, timings.counts["db"])
+    if timings.counts["redis"]:
+        increment(buffer, "blog_http_redis_commands_total", labels, timings.counts["redis"])
+    for result, count in timings.cache_lookups.items():
+        if count:
+            increment(buffer, "blog_cache_lookups_total", {"view": view, "result": result}, count)
+    if buffer.due():
+        buffer.flush()
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def collect_api_key_metrics():
+    samples = []
+    for key_id, usage in get_api_key_usage().items():
+        labels = label_string({"key": key_id})
+        samples.append(("blog_api_key_requests_total", labels, "", usage["requests"]))
+        samples.append(("blog_api_key_throttled_total", labels, "", usage["throttled"]))
+    return samples
+
+def collect_queue_metrics():
+    pipe = get_redis("broker").pipeline(transaction=False)
+    for queue in settings.TASK_METRICS_QUEUES:
+        for step in QUEUE_PRIORITY_STEPS:
+            pipe.llen(f"{queue}{QUEUE_PRIORITY_SEPARATOR}{step}" if step else queue)
+    lengths = iter(pipe.execute())
+
+    return [
+        ("blog_celery_queue_length", label_string({"queue": queue}), "", sum(next(lengths) for step in QUEUE_PRIORITY_STEPS))
+        for queue in settings.TASK_METRICS_QUEUES
+    ]
+
+def collect_redis_metrics():
+    samples = []
+    for namespace in settings.REDIS_URLS:
+        health = probe(namespace, samples=1)
+        labels = label_string({"namespace": namespace})
+        samples.append(("blog_redis_up", labels, "", 1 if health["ok"] else 0))
+        if health["ok"]:
+            samples.append(("blog_redis_ping_seconds", labels, "", health["latency"]))
+    return samples
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text format
+    """
+    # The other processes flush on their own schedule
+    metrics_buffer.flush()
+    samples = []
+    for field, value in redis_client.hgetall(METRICS_KEY).items():
+        name, labels, suffix = field.decode().split("|", 2)
+        samples.append((name, labels, suffix, float(value)))
+    samples += collect_api_key_metrics()
+    samples += collect_queue_metrics()
+    samples += collect_redis_metrics()
+
+    grouped = defaultdict(lambda: defaultdict(dict))
+    for name, labels, suffix, value in samples:
+        grouped[name][labels][suffix] = value
+
+    lines = []
+    for name in sorted(grouped):
+        metric_type, description = METRICS.get(name, ("untyped", ""))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, values in sorted(grouped[name].items()):
+            if metric_type != "histogram":
+                lines.append(f"{name}{{{labels}}} {format_value(values[''])}" if labels else f"{name} {format_value(values[''])}")
+                continue
+
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound in (*HISTOGRAM_BUCKETS, "+Inf"):
+                cumulative += values.get(str(bound), 0)
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {format_value(cumulative)}')
+            lines.append(f"{name}_sum{{{labels}}} {format_value(values.get('sum', 0))}")
+            lines.append(f"{name}_count{{{labels}}} {format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, open to staff users or to the METRICS_TOKEN bearer token
+    """
+    authorization = request.headers.get("Authorization", "")
+    token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+        authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+    )
+    if not token_ok and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
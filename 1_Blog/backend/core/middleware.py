@@ -0,0 +1,131 @@
+import logging
+import math
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from core import instrumentation, profiling
+from core.db_routers import replica_scope
+from core.metrics import record_request_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceMiddleware:
+    """
+    Time the database, redis, serialization and broker work of every request, report it in a
+    Server-Timing header and add it to the /metrics histograms of the view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrumentation.install()
+
+    def __call__(self, request):
+        if not settings.PERFORMANCE_METRICS_ENABLED:
+            return self.get_response(request)
+
+        with instrumentation.track_request() as timings, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(instrumentation.db_execute_wrapper))
+            response = self.get_response(request)
+
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = self.server_timing(timings)
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        try:
+            record_request_metrics(view, request.method, response.status_code, timings)
+        except Exception as e:
+            # Metrics are best effort, never fail the request because redis is unreachable
+            logger.warning("Could not record the metrics of %s: %s", view, str(e))
+        return response
+
+    def server_timing(self, timings):
+        entries = []
+        for name in ("db", "redis", "serialize", "broker"):
+            if timings.counts[name]:
+                unit = {"db": "queries", "redis": "commands"}.get(name, "calls")
+                entries.append(f'{name};dur={timings.durations[name] * 1000:.2f};desc="{timings.counts[name]} {unit}"')
+        lookups = timings.cache_lookups
+        if lookups["hit"] or lookups["miss"]:
+            entries.append(f'cache;desc="{"hit" if not lookups["miss"] else "miss"}"')
+        entries.append(f"total;dur={timings.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes for the replicas: writing requests, admin pages and clients that wrote less than
+    REPLICA_STALENESS_SECONDS ago (REPLICA_PIN_COOKIE) read from the primary
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        primary = (
+            request.method not in ("GET", "HEAD", "OPTIONS")
+            or settings.REPLICA_PIN_COOKIE in request.COOKIES
+            or request.path.startswith(reverse("admin:index"))
+        )
+        with replica_scope(primary) as scope:
+            response = self.get_response(request)
+
+        if scope["wrote"]:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, "1",
+                max_age=math.ceil(settings.REPLICA_STALENESS_SECONDS), httponly=True, samesite="Lax",
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests carrying a signed X-Profile header, and a PROFILING_SAMPLE_RATE share
+    of the others, into the profiles ring buffer
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        mode = request.headers.get("X-Profile-Mode")
+        if mode not in profiling.PROFILE_MODES:
+            mode = settings.PROFILING_MODE
+        summary = profiling.new_profile_summary(request, mode)
+        profiler = profiling.make_profiler(mode)
+
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        summary["status"] = response.status_code
+
+        try:
+            profiling.save_profile(summary, profiler.export(f"{request.method} {request.path}"))
+        except Exception as e:
+            # Profiles are best effort, never fail the request because redis is unreachable
+            logger.warning("Could not save the profile of %s: %s", request.path, str(e))
+        else:
+            response["X-Profile-Id"] = summary["id"]
+        return response
+
+    def should_profile(self, request):
+        if profiling.has_valid_profile_token(request):
+            return True
+        return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
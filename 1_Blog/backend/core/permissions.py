@@ -1,11 +1,21 @@
 from rest_framework import permissions
-from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+from apps.blog.api_keys import get_api_key, consume_token
 
 class HasValidAPIKey(permissions.BasePermission):
     """
-    Custom permission to check if the request has a valid API key
+    Custom permission to check if the request has a valid API key, within the rate limit of the key
     """
     
     def has_permission(self, request, view):
-        api_key = request.headers.get("API-Key")
-        return api_key in getattr(settings, "VALID_API_KEYS", [])
\ No newline at end of file
+        api_key = get_api_key(request.headers.get("API-Key"))
+        if api_key is None:
+            return False
+        
+        retry_after = consume_token(api_key)
+        if retry_after:
+            raise Throttled(wait=retry_after)
+        
+        request.api_key = api_key
+        return True
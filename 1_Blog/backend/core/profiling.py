@@ -0,0 +1,197 @@
+import cProfile
+import gzip
+import json
+import marshal
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, Http404
+from django.utils import timezone
+
+from core.redis_clients import get_redis
+
+redis_client = get_redis()
+
+# Ring buffer of the last PROFILING_MAX_PROFILES profiles: a list of JSON summaries, newest
+# first, and one gzipped blob per profile
+PROFILES_KEY = "profiles:index"
+PROFILE_DATA_KEY = "profiles:data:{}"
+
+PROFILE_MODES = ("sample", "cprofile")
+TOKEN_SALT = "core.profiling"
+
+
+def make_profile_token():
+    """
+    Signed value for the X-Profile header, valid for PROFILING_TOKEN_MAX_AGE seconds
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign("profile")
+
+def has_valid_profile_token(request):
+    token = request.headers.get("X-Profile")
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class StackSampler:
+    """
+    Statistical profiler: a background thread records the stack of the profiled thread every interval
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.finished = time.perf_counter()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            self.samples.append((time.perf_counter(), stack[::-1]))
+
+    def export(self, name):
+        """
+        Speedscope file (https://www.speedscope.app/file-format-schema.json) of the samples
+        """
+        frames, frame_index, samples, weights = [], {}, [], []
+        previous = self.started
+        for sampled_at, stack in self.samples:
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(round((sampled_at - previous) * 1000, 3))
+            previous = sampled_at
+
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round((self.finished - self.started) * 1000, 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "blog-backend",
+        }).encode()
+
+
+class CProfiler:
+    """
+    Deterministic profiler, exported in the pstats format (python -m pstats, snakeviz...)
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def export(self, name):
+        # Same bytes as pstats.Stats.dump_stats()
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+def make_profiler(mode):
+    if mode == "cprofile":
+        return CProfiler()
+    return StackSampler(settings.PROFILING_INTERVAL_MS / 1000)
+
+
+def save_profile(summary, data):
+    """
+    Store a profile in the ring buffer, dropping the oldest ones past PROFILING_MAX_PROFILES
+    """
+    pipe = redis_client.pipeline()
+    pipe.set(PROFILE_DATA_KEY.format(summary["id"]), gzip.compress(data), ex=settings.PROFILING_TTL_SECONDS)
+    pipe.lpush(PROFILES_KEY, json.dumps(summary))
+    pipe.lrange(PROFILES_KEY, settings.PROFILING_MAX_PROFILES, -1)
+    pipe.ltrim(PROFILES_KEY, 0, settings.PROFILING_MAX_PROFILES - 1)
+    dropped = pipe.execute()[2]
+    if dropped:
+        redis_client.delete(*(PROFILE_DATA_KEY.format(json.loads(entry)["id"]) for entry in dropped))
+
+def list_profiles():
+    return [json.loads(entry) for entry in redis_client.lrange(PROFILES_KEY, 0, -1)]
+
+def get_profile(profile_id):
+    for summary in list_profiles():
+        if summary["id"] == profile_id:
+            data = redis_client.get(PROFILE_DATA_KEY.format(profile_id))
+            return summary, gzip.decompress(data) if data else None
+    return None, None
+
+def new_profile_summary(request, mode):
+    return {
+        "id": uuid.uuid4().hex,
+        "mode": mode,
+        "method": request.method,
+        "path": request.path,
+        "created_at": timezone.now().isoformat(),
+    }
+
+
+def is_staff(request):
+    return request.user.is_authenticated and request.user.is_staff
+
+def profile_list_view(request):
+    """
+    Summaries of the stored profiles, newest first (staff only)
+    """
+    if not is_staff(request):
+        return HttpResponseForbidden()
+    return JsonResponse({"results": list_profiles()})
+
+def profile_download_view(request, profile_id):
+    """
+    Download a profile: speedscope JSON for sampled profiles, pstats for cProfile ones (staff only)
+    """
+    if not is_staff(request):
+        return HttpResponseForbidden()
+
+    summary, data = get_profile(profile_id)
+    if data is None:
+        raise Http404("Profile does not exist")
+
+    if summary["mode"] == "cprofile":
+        response = HttpResponse(data, content_type="application/octet-stream")
+        extension = "pstats"
+    else:
+        response = HttpResponse(data, content_type="application/json")
+        extension = "speedscope.json"
+    response["Content-Disposition"] = f'attachment; filename="{profile_id}.{extension}"'
+    return response
@@ -0,0 +1,148 @@
+import asyncio
+import statistics
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import redis
+import redis.asyncio
+
+from django.conf import settings
+
+# Every redis key belongs to a namespace served by the url of settings.REDIS_URLS, "default" when
+# missing: "default" (rate limits, metrics, profiles), "analytics" (buffered counters, flush
+# backlogs, trending scores) and "broker" (the celery queues). Clients of a same url share one pool.
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_scripts = []
+_lock = threading.Lock()
+
+
+def redis_url(namespace="default"):
+    return settings.REDIS_URLS.get(namespace) or settings.REDIS_URLS["default"]
+
+def pool_options():
+    return {
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+def get_redis(namespace="default"):
+    """
+    Client of a namespace, created on first use. Connections are only opened by the first command
+    """
+    url = redis_url(namespace)
+    client = _clients.get(url)
+    if client is None:
+        with _lock:
+            client = _clients.get(url)
+            if client is None:
+                pool = redis.BlockingConnectionPool.from_url(url, **pool_options())
+                client = _clients[url] = redis.Redis(connection_pool=pool)
+    return client
+
+def get_async_redis(namespace="default"):
+    """
+    Asyncio client of a namespace, with a pool per event loop since asyncio connections cannot
+    be shared between loops
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    url = redis_url(namespace)
+    if url not in clients:
+        pool = redis.asyncio.BlockingConnectionPool.from_url(url, **pool_options())
+        clients[url] = redis.asyncio.Redis(connection_pool=pool)
+    return clients[url]
+
+@contextmanager
+def override_pools(url, **pool_options):
+    """
+    Serve every namespace from one pool of url built with pool_options (a fakeredis server for the
+    benchmarks). The clients already held by other modules are switched too
+    """
+    clients = list({id(get_redis(namespace)): get_redis(namespace) for namespace in settings.REDIS_URLS}.values())
+    original_pools = [client.connection_pool for client in clients]
+    pool = redis.ConnectionPool.from_url(url, **pool_options)
+    for client in clients:
+        client.connection_pool = pool
+    try:
+        yield pool
+    finally:
+        for client, original_pool in zip(clients, original_pools):
+            client.connection_pool = original_pool
+        pool.disconnect()
+
+@contextmanager
+def pipeline(namespace="default", transaction=False):
+    """
+    Pipeline of a namespace, executed when the block exits without an exception
+    """
+    pipe = get_redis(namespace).pipeline(transaction=transaction)
+    yield pipe
+    pipe.execute()
+
+
+def register_script(source, namespace="default"):
+    """
+    Lua script called with EVALSHA on the client of namespace, see load_scripts()
+    """
+    script = get_redis(namespace).register_script(source)
+    _scripts.append(script)
+    return script
+
+def load_scripts():
+    """
+    SCRIPT LOAD every registered script on every redis, so no call pays for a NOSCRIPT miss
+    """
+    for client in {id(get_redis(namespace)): get_redis(namespace) for namespace in settings.REDIS_URLS}.values():
+        for script in _scripts:
+            client.script_load(script.script)
+    return len(_scripts)
+
+# Add every ARGV (field, amount) pair to the matching key: plain counters when the field is empty,
+# hash fields otherwise. Integer amounts use INCRBY/HINCRBY so the stored values stay integers
+counters_script = register_script("""
+for i, key in ipairs(KEYS) do
+    local field, amount = ARGV[i * 2 - 1], ARGV[i * 2]
+    local is_float = string.find(amount, '.', 1, true) or string.find(amount, 'e', 1, true)
+    if field == '' then
+        redis.call(is_float and 'INCRBYFLOAT' or 'INCRBY', key, amount)
+    else
+        redis.call(is_float and 'HINCRBYFLOAT' or 'HINCRBY', key, field, amount)
+    end
+end
+return #KEYS
+""")
+
+def increment_counters(counters, namespace="default", client=None):
+    """
+    Add to many counters in one atomic command. counters maps a key (plain counter) or a
+    (key, field) pair (hash field) to an int or float amount. client may be a pipeline
+    """
+    keys, args = [], []
+    for target, amount in counters.items():
+        key, field = target if isinstance(target, tuple) else (target, "")
+        keys.append(key)
+        args += [field, repr(amount) if isinstance(amount, float) else amount]
+    if keys:
+        return counters_script(keys=keys, args=args, client=client or get_redis(namespace))
+    return 0
+
+
+def probe(namespace="default", samples=3):
+    """
+    Ping the redis of a namespace, return whether it answered and the median round trip in seconds
+    """
+    latencies = []
+    client = get_redis(namespace)
+    try:
+        for i in range(samples):
+            started = time.perf_counter()
+            client.ping()
+            latencies.append(time.perf_counter() - started)
+    except redis.RedisError as e:
+        return {"ok": False, "latency": None, "error": str(e)}
+    return {"ok": True, "latency": statistics.median(latencies), "error": None}
@@ -0,0 +1,22 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, same compact UTF-8 output as the default JSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        # Indented output was asked for, leave it to the standard renderer
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Types orjson does not know (Decimal, lazy strings...) go through DRF's encoder
+            return super().render(data, accepted_media_type, renderer_context)
@@ -29,6 +29,13 @@ environ.Env.read_env()
 SECRET_KEY = env("SECRET_KEY")
 
 VALID_API_KEYS = env.str("VALID_API_KEYS").split(",")
+# API keys are also created hashed in the database (manage.py create_api_key), lookups are cached
+# in each process for API_KEY_CACHE_SECONDS
+API_KEY_CACHE_SECONDS = env.int("API_KEY_CACHE_SECONDS", default=60)
+API_KEY_CACHE_MAX_ENTRIES = 10000
+# Default token bucket of every key, requests per second and burst size
+API_KEY_RATE_LIMIT_PER_SECOND = env.float("API_KEY_RATE_LIMIT_PER_SECOND", default=10.0)
+API_KEY_RATE_LIMIT_BURST = env.int("API_KEY_RATE_LIMIT_BURST", default=50)
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -112,6 +119,10 @@ CKEDITOR_5_CONFIGS = {
 }
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole request
+    "core.middleware.PerformanceMiddleware",
+    # Before the session middleware, so session writes pin the client to the primary
+    "core.middleware.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     # This is required for Whitenoise to serve static files
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -121,6 +132,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Last, so profiles only cover the view
+    "core.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -158,6 +171,23 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, one alias per host ("replica_0", ...). Locally, pointing
+# DATABASE_REPLICA_HOSTS at the primary host gives a second alias to exercise the routing
+DATABASE_REPLICA_HOSTS = env.list("DATABASE_REPLICA_HOSTS", default=[])
+DATABASE_REPLICAS = []
+for index, host in enumerate(DATABASE_REPLICA_HOSTS):
+    DATABASES[f"replica_{index}"] = {**DATABASES["default"], "HOST": host, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica_{index}")
+
+DATABASE_ROUTERS = ["core.db_routers.ReplicaRouter"]
+# Published content read from the replicas, analytics and keys are always read from the primary
+DATABASE_REPLICA_MODELS = ["blog.category", "blog.post", "blog.heading"]
+# Replicas lagging more than this are skipped (their lag is checked every DATABASE_REPLICA_LAG_CHECK_SECONDS),
+# and a client reads from the primary for this long after a write
+REPLICA_STALENESS_SECONDS = env.float("REPLICA_STALENESS_SECONDS", default=5.0)
+DATABASE_REPLICA_LAG_CHECK_SECONDS = env.float("DATABASE_REPLICA_LAG_CHECK_SECONDS", default=10.0)
+REPLICA_PIN_COOKIE = "primary_db"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -207,6 +237,10 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Use time-ordered (UUIDv7) primary keys for PostViews, PostAnalytics, PostAnalyticsRollup and Heading
+# so inserts append to the primary key index instead of landing on random pages
+TIME_ORDERED_UUIDS = env.bool("TIME_ORDERED_UUIDS", default=False)
+
 # REST Framework
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
@@ -214,6 +248,10 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "core.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 CHANNELS_LAYERS = {
@@ -225,7 +263,18 @@ CHANNELS_LAYERS = {
     }
 }
 
-REDIS_HOST = env("REDIS_HOST")
+# Every redis client of the project comes from core.redis_clients, one pool per url. The
+# analytics buffers and trending scores can be moved to their own instance with ANALYTICS_REDIS_URL
+REDIS_URLS = {
+    "default": env("REDIS_URL"),
+    "analytics": env.str("ANALYTICS_REDIS_URL", default=env("REDIS_URL")),
+    "broker": env("REDIS_URL"),
+}
+REDIS_MAX_CONNECTIONS = env.int("REDIS_MAX_CONNECTIONS", default=50)
+# Seconds to wait for a free connection of the pool, and for redis to answer
+REDIS_POOL_TIMEOUT = env.float("REDIS_POOL_TIMEOUT", default=5.0)
+REDIS_SOCKET_TIMEOUT = env.float("REDIS_SOCKET_TIMEOUT", default=5.0)
+REDIS_HEALTH_CHECK_INTERVAL = env.int("REDIS_HEALTH_CHECK_INTERVAL", default=30)
 
 CACHES = {
     "default": {
@@ -242,7 +291,7 @@ CHANNELS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
-CELERY_BROKER_URL = env("REDIS_URL")
+CELERY_BROKER_URL = REDIS_URLS["broker"]
 CELERY_BROKER_TRANSPORT_OPTIONS = {
     "visibility_timeout": 3600,
     "socket_timeout": 5,
@@ -263,6 +312,147 @@ CELERY_RESULT_SERIALIZER = "json"
 
 CELERY_TIMEZONE = "America/Mexico_City"
 
+# Broker queues whose length is reported on /metrics, next to the per task latency, run time
+# and failures recorded by core.task_metrics
+TASK_METRICS_QUEUES = env.list("TASK_METRICS_QUEUES", default=["celery"])
+
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
-CELERY_BEAT_SCHEDULE = {}
+CELERY_BEAT_SCHEDULE = {
+    # Flushes the impressions and dwell time buffers, each at an interval adapted to its backlog
+    "flush-analytics-buffers": {
+        "task": "apps.blog.tasks.flush_analytics_buffers",
+        "schedule": env.float("ANALYTICS_FLUSH_TICK_SECONDS", default=5.0),
+    },
+    # Safety net of the relay started when a change to published content commits
+    "relay-outbox": {
+        "task": "apps.blog.tasks.relay_outbox",
+        "schedule": env.float("OUTBOX_RELAY_INTERVAL", default=30.0),
+    },
+    "compact-analytics-rollups": {
+        "task": "apps.blog.tasks.compact_analytics_rollups",
+        "schedule": 60.0 * 60,
+    },
+    "rescale-trending-posts": {
+        "task": "apps.blog.tasks.rescale_trending_posts",
+        "schedule": 60.0 * 15,
+    },
+    "build-related-posts": {
+        "task": "apps.blog.tasks.build_related_posts",
+        "schedule": 60.0 * 60 * 24,
+    },
+    "prune-post-views": {
+        "task": "apps.blog.tasks.prune_old_post_views",
+        "schedule": 60.0 * 60 * 24,
+    },
+    "prune-post-tombstones": {
+        "task": "apps.blog.tasks.prune_post_tombstones",
+        "schedule": 60.0 * 60 * 24,
+    },
+}
+
+# Dwell time beacons outside this range (in seconds) are treated as bounces or forgotten tabs
+DWELL_TIME_MIN_SECONDS = env.float("DWELL_TIME_MIN_SECONDS", default=1.0)
+DWELL_TIME_MAX_SECONDS = env.float("DWELL_TIME_MAX_SECONDS", default=60.0 * 30)
+
+# An analytics buffer is flushed every ANALYTICS_FLUSH_MAX_INTERVAL seconds while it holds less than
+# ANALYTICS_FLUSH_BACKLOG_TARGET events, and proportionally faster past it (down to the MIN interval)
+ANALYTICS_FLUSH_MIN_INTERVAL = env.float("ANALYTICS_FLUSH_MIN_INTERVAL", default=5.0)
+ANALYTICS_FLUSH_MAX_INTERVAL = env.float("ANALYTICS_FLUSH_MAX_INTERVAL", default=60.0 * 5)
+ANALYTICS_FLUSH_BACKLOG_TARGET = env.int("ANALYTICS_FLUSH_BACKLOG_TARGET", default=1000)
+ANALYTICS_FLUSH_LOCK_TIMEOUT = env.int("ANALYTICS_FLUSH_LOCK_TIMEOUT", default=60 * 10)
+
+# Hourly analytics rollups older than this many days are compacted into daily rows,
+# and daily rows older than ANALYTICS_DAILY_ROLLUP_DAYS into monthly rows
+ANALYTICS_HOURLY_ROLLUP_DAYS = env.int("ANALYTICS_HOURLY_ROLLUP_DAYS", default=14)
+ANALYTICS_DAILY_ROLLUP_DAYS = env.int("ANALYTICS_DAILY_ROLLUP_DAYS", default=400)
+
+# PostViews rows (one per unique ip per post) are deleted after this many days,
+# a reader coming back after the window counts as a new view
+POST_VIEWS_RETENTION_DAYS = env.int("POST_VIEWS_RETENTION_DAYS", default=90)
+POST_VIEWS_PRUNE_BATCH_SIZE = env.int("POST_VIEWS_PRUNE_BATCH_SIZE", default=5000)
+
+# Trending posts, activity loses half of its weight every TRENDING_HALF_LIFE_HOURS
+TRENDING_HALF_LIFE_HOURS = env.float("TRENDING_HALF_LIFE_HOURS", default=12.0)
+TRENDING_WEIGHTS = {
+    "view": 1.0,
+    "click": 2.0,
+    "impression": 0.05,
+}
+# Posts below this score are dropped when rescaling, and the set keeps at most TRENDING_MAX_POSTS
+TRENDING_MIN_SCORE = 0.01
+TRENDING_MAX_POSTS = 1000
+
+# Per request timings of the database, redis, serialization and broker, sent in a Server-Timing
+# header and aggregated per view on /metrics (staff users, or "Authorization: Bearer METRICS_TOKEN")
+PERFORMANCE_METRICS_ENABLED = env.bool("PERFORMANCE_METRICS_ENABLED", default=True)
+# The header tells anyone how long the database, redis and broker take, only for debugging
+SERVER_TIMING_HEADER = env.bool("SERVER_TIMING_HEADER", default=False)
+# Each process sums its request metrics and adds them to redis at most this often
+METRICS_FLUSH_SECONDS = env.float("METRICS_FLUSH_SECONDS", default=10.0)
+METRICS_TOKEN = env.str("METRICS_TOKEN", default="")
+
+# Requests are profiled when they carry a signed X-Profile header (manage.py profile_token) or
+# with PROFILING_SAMPLE_RATE probability. PROFILING_MODE is "sample" (statistical, speedscope) or
+# "cprofile" (pstats), the last PROFILING_MAX_PROFILES are kept in redis and listed on /profiles/
+PROFILING_SAMPLE_RATE = env.float("PROFILING_SAMPLE_RATE", default=0.0)
+PROFILING_MODE = env.str("PROFILING_MODE", default="sample")
+PROFILING_INTERVAL_MS = env.float("PROFILING_INTERVAL_MS", default=1.0)
+PROFILING_MAX_PROFILES = env.int("PROFILING_MAX_PROFILES", default=50)
+PROFILING_TTL_SECONDS = env.int("PROFILING_TTL_SECONDS", default=60 * 60 * 24 * 7)
+PROFILING_TOKEN_MAX_AGE = env.int("PROFILING_TOKEN_MAX_AGE", default=60 * 60)
+
+# Cached API responses are stored rendered, and brotli/gzip compressed from this size on
+RESPONSE_CACHE_COMPRESS_MIN_BYTES = env.int("RESPONSE_CACHE_COMPRESS_MIN_BYTES", default=1024)
+RESPONSE_CACHE_BROTLI_QUALITY = env.int("RESPONSE_CACHE_BROTLI_QUALITY", default=5)
+
+# Public site linked from the sitemaps and feeds (the Next.js frontend), which serves the
+# sitemap shards and feeds of the API under SITEMAP_SHARD_PATH and FEED_PATH
+SITE_URL = env.str("SITE_URL", default="http://localhost:3000")
+SITE_POST_PATH = env.str("SITE_POST_PATH", default="/blog/{slug}")
+SITEMAP_SHARD_PATH = env.str("SITEMAP_SHARD_PATH", default="/sitemaps/{shard}.xml")
+# The sitemap protocol allows 50,000 URLs per sitemap, bigger months are split in numbered parts
+SITEMAP_SHARD_MAX_URLS = 50000
+FEED_PATH = env.str("FEED_PATH", default="/feed/{format}.xml")
+FEED_TITLE = env.str("FEED_TITLE", default="Blog")
+FEED_DESCRIPTION = env.str("FEED_DESCRIPTION", default="Latest posts")
+FEED_ITEMS = env.int("FEED_ITEMS", default=20)
+# Rendered sitemaps and feeds are dropped by post saves, the timeout only bounds stale shards
+# left by a post moved to another month. Clients may reuse them for SITEMAP_MAX_AGE seconds
+SITEMAP_CACHE_SECONDS = env.int("SITEMAP_CACHE_SECONDS", default=60 * 60 * 24)
+SITEMAP_MAX_AGE = env.int("SITEMAP_MAX_AGE", default=60 * 5)
+
+# Publish events are relayed from the outbox in batches of OUTBOX_BATCH_SIZE events, merged per post
+# into one delivery per webhook (frontend revalidation, CDN purge)
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=500)
+OUTBOX_LOCK_TIMEOUT = env.int("OUTBOX_LOCK_TIMEOUT", default=60 * 5)
+# Failed deliveries are retried after WEBHOOK_RETRY_BASE_SECONDS, doubling up to WEBHOOK_RETRY_MAX_SECONDS,
+# and given up after WEBHOOK_MAX_ATTEMPTS attempts
+WEBHOOK_TIMEOUT_SECONDS = env.float("WEBHOOK_TIMEOUT_SECONDS", default=5.0)
+WEBHOOK_CONCURRENCY = env.int("WEBHOOK_CONCURRENCY", default=4)
+WEBHOOK_DELIVERY_BATCH_SIZE = env.int("WEBHOOK_DELIVERY_BATCH_SIZE", default=100)
+WEBHOOK_MAX_ATTEMPTS = env.int("WEBHOOK_MAX_ATTEMPTS", default=8)
+WEBHOOK_RETRY_BASE_SECONDS = env.float("WEBHOOK_RETRY_BASE_SECONDS", default=30.0)
+WEBHOOK_RETRY_MAX_SECONDS = env.float("WEBHOOK_RETRY_MAX_SECONDS", default=60.0 * 60)
+
+# Slugs accepted by one request of the batch post detail endpoint (static site builds)
+POST_BATCH_MAX_SLUGS = env.int("POST_BATCH_MAX_SLUGS", default=100)
+
+# warm_blog_cache fills the detail caches of the WARMUP_MAX_POSTS most visited posts (0 for every post),
+# most views over the last WARMUP_TRAFFIC_DAYS first, in chunks of WARMUP_CHUNK_SIZE posts
+# with WARMUP_CONCURRENCY chunks at a time
+WARMUP_MAX_POSTS = env.int("WARMUP_MAX_POSTS", default=1000)
+WARMUP_TRAFFIC_DAYS = env.int("WARMUP_TRAFFIC_DAYS", default=7)
+WARMUP_CHUNK_SIZE = env.int("WARMUP_CHUNK_SIZE", default=100)
+WARMUP_CONCURRENCY = env.int("WARMUP_CONCURRENCY", default=4)
+
+# Delta sync pages (posts/changes/), changes of the last DELTA_SYNC_SETTLE_SECONDS wait for the
+# transactions still writing older timestamps. Tombstones of deleted posts are kept DELTA_SYNC_TOMBSTONE_DAYS,
+# older cursors must start over with a full sync
+DELTA_SYNC_PAGE_SIZE = env.int("DELTA_SYNC_PAGE_SIZE", default=100)
+DELTA_SYNC_MAX_PAGE_SIZE = env.int("DELTA_SYNC_MAX_PAGE_SIZE", default=500)
+DELTA_SYNC_SETTLE_SECONDS = env.float("DELTA_SYNC_SETTLE_SECONDS", default=5.0)
+DELTA_SYNC_TOMBSTONE_DAYS = env.int("DELTA_SYNC_TOMBSTONE_DAYS", default=90)
+
+# Number of related posts precomputed for each post
+RELATED_POSTS_COUNT = env.int("RELATED_POSTS_COUNT", default=5)
 
@@ -0,0 +1,82 @@
+import logging
+import time
+
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_failure, worker_process_shutdown
+from django.utils.dateparse import parse_datetime
+
+from core.metrics import increment, metrics_buffer, observe
+
+logger = logging.getLogger(__name__)
+
+# task id -> {"started", "latency", "exception"} of the tasks running in this worker process
+_running = {}
+_installed = False
+
+
+def install():
+    """
+    Connect the celery signal handlers recording the task metrics, once per process
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    before_task_publish.connect(stamp_enqueued_at, weak=False)
+    task_prerun.connect(task_started, weak=False)
+    task_failure.connect(task_failed, weak=False)
+    task_postrun.connect(task_finished, weak=False)
+    # Pool processes may exit without running atexit, send what is left in the buffer
+    worker_process_shutdown.connect(flush_task_metrics, weak=False)
+
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Custom message headers end up on task.request in the worker
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+def queue_latency(request):
+    """
+    Seconds between the task being published (or its eta) and a worker starting it, None when unknown
+    """
+    enqueued_at = request.get("enqueued_at")
+    if enqueued_at is None:
+        return None
+    ready_at = enqueued_at
+    if request.eta:
+        eta = parse_datetime(request.eta) if isinstance(request.eta, str) else request.eta
+        ready_at = max(ready_at, eta.timestamp())
+    return max(time.time() - ready_at, 0)
+
+def task_started(task_id=None, task=None, **kwargs):
+    _running[task_id] = {
+        "started": time.perf_counter(),
+        "latency": queue_latency(task.request),
+        "exception": None,
+    }
+
+def task_failed(task_id=None, exception=None, **kwargs):
+    if task_id in _running:
+        _running[task_id]["exception"] = type(exception).__name__
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    running = _running.pop(task_id, None)
+    if running is None:
+        return
+
+    labels = {"task": task.name}
+    buffer = metrics_buffer
+    increment(buffer, "blog_tasks_total", {"task": task.name, "state": state or "UNKNOWN"})
+    observe(buffer, "blog_task_duration_seconds", labels, time.perf_counter() - running["started"])
+    if running["latency"] is not None:
+        observe(buffer, "blog_task_queue_latency_seconds", labels, running["latency"])
+    if running["exception"]:
+        increment(buffer, "blog_task_failures_total", {"task": task.name, "exception": running["exception"]})
+    if buffer.due():
+        flush_task_metrics()
+
+def flush_task_metrics(**kwargs):
+    try:
+        metrics_buffer.flush()
+    except Exception as e:
+        # Metrics are best effort, never fail the task because redis is unreachable
+        logger.warning("Could not flush the task metrics: %s", str(e))
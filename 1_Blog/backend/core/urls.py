@@ -20,10 +20,16 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.metrics import metrics_view
+from core.profiling import profile_list_view, profile_download_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/blog/", include("apps.blog.urls")),
     path("ckeditor5/", include("django_ckeditor_5.urls")),
+    path("metrics", metrics_view, name="metrics"),
+    path("profiles/", profile_list_view, name="profile-list"),
+    path("profiles/<str:profile_id>", profile_download_view, name="profile-download"),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)